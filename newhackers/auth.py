@@ -17,10 +17,9 @@
 
 import logging
 
-import requests
 from bs4 import BeautifulSoup
 
-from newhackers import config
+from newhackers import config, hnclient, ratelimit
 from newhackers.exceptions import ClientError, ServerError
 
 
@@ -37,10 +36,10 @@ def get_token(user, password):
     Raises a ClientError if authentication failed.
 
     """
-    # XXX this is very dangerous. It has the potential to get us banned
-    # and I don't think there's any way to rate limit it for multiple
-    # users.
-    r = requests.get(config.HN_LOGIN)
+    # XXX this is very dangerous. It has the potential to get us banned.
+    # Logins share newhackers.ratelimit with all our other requests to
+    # HN, but a single user can still use up the logins' share.
+    r = hnclient.get(config.HN_LOGIN, priority=ratelimit.ACCOUNT)
     soup = BeautifulSoup(r.content)
     try:
         fnid = soup.find('input', attrs=dict(name='fnid'))['value']
@@ -49,8 +48,9 @@ def get_token(user, password):
                       config.HN_LOGIN, r.content)
         raise ServerError("Authentication failed. Unknown server error.")
 
-    r = requests.post(config.HN_LOGIN_POST,
-                      data={'fnid': fnid, 'u': user, 'p': password})
+    r = hnclient.post(config.HN_LOGIN_POST,
+                      data={'fnid': fnid, 'u': user, 'p': password},
+                      priority=ratelimit.ACCOUNT)
 
     # XXX HN returns 200 on failed authentication, so we have to EAFP
     try:
@@ -16,50 +16,84 @@
 # along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
 
 from datetime import datetime, timedelta
+import hashlib
 import json
+import time
 
 import redis
 import requests
 
-from newhackers import config
+from newhackers import (breaker, cache, config, executor, hnclient,
+                        ratelimit, stats)
 from newhackers.config import rdb
 from newhackers.parsers import parse_stories, parse_comments
-from newhackers.exceptions import ClientError, NotFound, ServerError
+from newhackers.streamparser import PageParser
+from newhackers.exceptions import (ClientError, LocalLimit, NotFound,
+                                   RateLimited, ServerError)
 
 
-def too_old(key):
+# the errors of a failing or unreachable HN
+UPSTREAM_ERRORS = (ServerError, requests.RequestException)
+# the errors which count against HN, see newhackers.breaker
+BREAKER_ERRORS = (ServerError, requests.Timeout, requests.ConnectionError)
+
+
+def too_old(key, ahead=0):
     """Check if an item in the redis database is too old
 
-    We're following a convention which says that a last_updated
-    timestamp is stored in 'key/updated'. If we can't find the
-    timestamp, then the item is too old, so we return True.
+    The item's last_updated timestamp is stored in its cache entry. If
+    we can't find the timestamp, then the item is too old, so we return
+    True.
 
     We check if this timestamp (a float of seconds since the epoch) is
     too old according to CACHE_INTERVAL
 
+    :ahead: seconds - also count the item as too old if it will be
+    within this many seconds
+
+    Items which store their own update interval use that one instead.
+
     """
-    try:
-        updated = float(rdb[key + "/updated"])
-    except KeyError:
+    entry = cache.read(key, ['updated', 'interval'])
+    if entry is None:
         return True
-    else:
-        age = datetime.now() - datetime.fromtimestamp(updated)
+    return expired(entry.updated, ahead, entry.interval)
+
 
-    allowed_age = timedelta(seconds=config.CACHE_INTERVAL)
+def expired(updated, ahead=0, interval=None):
+    """Check if a last_updated timestamp is too old
+
+    :updated: the timestamp stored in the item's cache entry or None
+    :ahead: seconds - see too_old
+    :interval: the item's update interval, config.CACHE_INTERVAL if None
+
+    """
+    if updated is None:
+        return True
+    if interval is None:
+        interval = config.CACHE_INTERVAL
+    age = datetime.now() - datetime.fromtimestamp(float(updated))
+
+    allowed_age = timedelta(seconds=float(interval) - ahead)
     if age < allowed_age:
         return False
     else:
         return True
 
 
-def update_page(db_key, path):
+def update_page(db_key, path, priority=ratelimit.USER, deadline=None):
     """Updates a page in the database
 
     The page is downloaded, parsed and then stored in the database as a
-    JSON string. This string is also returned by the function.
+    JSON string. This string is also returned by the function. Parsing
+    is done by the executor configured in config.PARSE_EXECUTOR, or with
+    config.HN_STREAM while the page is being downloaded.
 
     :db_key: a redis string of the key where the stories page will be stored
     :path: the HN URL path where the page will be downloaded from
+    :priority: of the request to HN, see newhackers.ratelimit
+    :deadline: the time.time() by which HN must have answered, see
+    newhackers.hnclient.request
 
     Raises NotFound when the page could not be found on the remote
     server or ServerError in case the server returned a response that we
@@ -67,21 +101,69 @@ def update_page(db_key, path):
     doesn't even have sensible status codes)
 
     """
-    res = hn_get(path)
+    return download_page(db_key, path, priority, deadline=deadline)[0]
+
+
+def download_page(db_key, path, priority=ratelimit.USER, fingerprint=None,
+                  deadline=None):
+    """Download and parse a page, see update_page
+
+    :fingerprint: the fingerprint of the page's last download, if the
+    page didn't change since then it isn't parsed again. Pages with a
+    fingerprint aren't parsed while they're downloaded with
+    config.HN_STREAM, which would parse them before they can be compared.
+
+    Returns a tuple of the page's JSON string, or None if it didn't
+    change, and its fingerprint, a hash of the HTML.
+
+    """
     if db_key.startswith('/pages'):
-        result = parse_stories(res.text)
+        parse = parse_stories
     elif db_key.startswith('/comments'):
-        result = parse_comments(res.text)
+        parse = parse_comments
     else:
         raise TypeError('Wrong DB Key.')
 
-    return json.dumps(result)
+    if (config.HN_STREAM and config.PARSER == 'stream' and
+            fingerprint is None):
+        # the HTML is parsed in this process as it arrives, so parsing
+        # overlaps with the download instead of following it
+        page = PageParser()
+        res = hn_get(path, priority=priority, on_chunk=page.feed_bytes,
+                     deadline=deadline)
+        stats.incr('parse.streamed')
+    else:
+        res = hn_get(path, priority=priority, deadline=deadline)
+        page = res.text
+
+    new_fingerprint = hashlib.sha1(res.text.encode('utf-8')).hexdigest()
+    if new_fingerprint == fingerprint:
+        return None, fingerprint
+
+    start = time.time()
+    if isinstance(page, PageParser):
+        page.close()
+        result = parse(page)
+    else:
+        result = executor.run(parse, page)
+    stats.incr('parse.pages')
+    stats.incr('parse.ms', int((time.time() - start) * 1000))
+
+    return json.dumps(result), new_fingerprint
 
 
 def hn_get(*args, **kwargs):
     """Download an HN page.
 
-    The arguments are the same as for the `requests.get` function.
+    The arguments are the same as for the `newhackers.hnclient.get`
+    function, which sends the request through a shared session.
+
+    Requests which time out or get a response we don't understand count
+    as failures for newhackers.breaker, which can raise CircuitOpen, and
+    any other answer from HN counts as a success. Requests we didn't
+    send or gave up on ourselves (RateLimited and LocalLimit) and other
+    errors don't count; if they were the breaker's probe, somebody else
+    can probe right away.
 
     Return a requests Response object
 
@@ -89,7 +171,30 @@ def hn_get(*args, **kwargs):
     # add the domain name to the first argument which is the path
     args = tuple([config.HN + args[0]] + list(args[1:]))
 
-    res = requests.get(*args, **kwargs)
+    probe = breaker.allow()
+    try:
+        res = _checked_get(*args, **kwargs)
+    except (RateLimited, LocalLimit):
+        # not HN's fault
+        breaker.give_back(probe)
+        raise
+    except (NotFound, ClientError):
+        # HN answered
+        breaker.success()
+        raise
+    except BREAKER_ERRORS:
+        breaker.failure()
+        raise
+    except Exception:
+        # e.g. a ChunkedEncodingError, which doesn't tell if HN is failing
+        breaker.give_back(probe)
+        raise
+    breaker.success()
+    return res
+
+
+def _checked_get(*args, **kwargs):
+    res = hnclient.get(*args, **kwargs)
     # HN is ignorant of HTTP status codes
     # all errors seem to be plain text sentences
     if res.text in ['No such item.', 'Unknown.', 'Unknown or expired link.']:
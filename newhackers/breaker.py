@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from newhackers import config, stats
+from newhackers.config import rdb
+from newhackers.exceptions import CircuitOpen
+
+
+BREAKER_KEY = '/breaker/hn'
+
+# The breaker's states, see allow
+CLOSED = 'closed'  # requests are sent to HN
+OPEN = 'open'  # HN is failing, requests fail fast
+HALF_OPEN = 'half_open'  # one probe request is being sent to HN
+
+# Returns what to do with a request: 'send' it, 'reject' it or send it
+# as the 'probe' of an open breaker which was open for ARGV[2] seconds.
+# The probe gets ARGV[2] seconds too before somebody else can probe.
+# When the breaker opened is kept in 'opened', see give_back.
+_allow = rdb.register_script("""
+local breaker = redis.call('hmget', KEYS[1], 'state', 'since')
+if breaker[1] ~= 'open' and breaker[1] ~= 'half_open' then
+    return 'send'
+end
+local now = tonumber(ARGV[1])
+if now < tonumber(breaker[2]) + tonumber(ARGV[2]) then
+    return 'reject'
+end
+if breaker[1] == 'open' then
+    redis.call('hset', KEYS[1], 'opened', breaker[2])
+end
+redis.call('hmset', KEYS[1], 'state', 'half_open', 'since', ARGV[1])
+return 'probe'
+""")
+
+# Opens a half-open breaker again as it was before the probe which
+# started at ARGV[1], so that the next request can probe.
+_give_back = rdb.register_script("""
+local breaker = redis.call('hmget', KEYS[1], 'state', 'since', 'opened')
+if breaker[1] == 'half_open' and breaker[2] == ARGV[1] then
+    redis.call('hmset', KEYS[1], 'state', 'open', 'since', breaker[3])
+end
+""")
+
+# Records how a request went, ARGV[2] is 1 if it succeeded. The breaker
+# opens after ARGV[3] failures in a row. Returns the new state if it
+# changed or an empty string.
+_record = rdb.register_script("""
+local state = redis.call('hget', KEYS[1], 'state') or 'closed'
+if ARGV[2] == '1' then
+    redis.call('del', KEYS[1])
+    if state ~= 'closed' then
+        return 'closed'
+    end
+    return ''
+end
+
+if state == 'half_open' then
+    redis.call('hmset', KEYS[1], 'state', 'open', 'since', ARGV[1])
+    return 'open'
+elseif state == 'open' then
+    -- a request which was sent before it opened
+    return ''
+end
+local failures = redis.call('hincrby', KEYS[1], 'failures', 1)
+if failures >= tonumber(ARGV[3]) then
+    redis.call('hmset', KEYS[1], 'state', 'open', 'since', ARGV[1],
+               'failures', 0)
+    return 'open'
+end
+return ''
+""")
+
+
+def allow():
+    """Check whether a request can be sent to HN
+
+    After config.BREAKER_FAILURES failed requests in a row the breaker
+    opens and requests fail fast for config.BREAKER_RESET_TIME seconds.
+    Then a single probe request is let through, which closes the breaker
+    again if it succeeds. The state is shared by all the processes.
+
+    Raises CircuitOpen if the request shouldn't be sent. Returns the
+    probe, for give_back, if the request is one, otherwise None.
+
+    """
+    now = repr(time.time())
+    action = _allow(keys=[BREAKER_KEY],
+                    args=[now, config.BREAKER_RESET_TIME], client=rdb)
+    if action == 'reject':
+        stats.incr('breaker.rejected')
+        raise CircuitOpen("HN is failing, try again later.")
+    if action == 'probe':
+        stats.incr('breaker.probes')
+        return now
+    return None
+
+
+def success():
+    """Record a request which HN answered"""
+    _record_result(1)
+
+
+def failure():
+    """Record a request which failed because of HN, see allow"""
+    _record_result(0)
+
+
+def give_back(probe):
+    """Let somebody else probe, :probe: never got an answer from HN
+
+    E.g. when the probe was rate limited before it was sent. Does nothing
+    if :probe: is None, see allow.
+
+    """
+    if probe is not None:
+        _give_back(keys=[BREAKER_KEY], args=[probe], client=rdb)
+
+
+def state():
+    """Return a dict with the breaker's state, failures and since when"""
+    breaker = rdb.hgetall(BREAKER_KEY)
+    return {'state': breaker.get('state', CLOSED),
+            'failures': int(breaker.get('failures', 0)),
+            'since': float(breaker['since']) if 'since' in breaker else None}
+
+
+def _record_result(ok):
+    changed = _record(keys=[BREAKER_KEY],
+                      args=[repr(time.time()), ok, config.BREAKER_FAILURES],
+                      client=rdb)
+    if changed:
+        stats.incr('breaker.' + changed)
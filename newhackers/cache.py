@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+import hashlib
+import re
+import time
+
+import redis
+
+from newhackers import capacity, codec, config
+from newhackers.config import rdb
+
+
+# A cached page is stored in a redis hash with these fields:
+# - payload - the page's JSON document, see newhackers.codec
+# - updated - when the page was downloaded, in seconds since the epoch
+# - etag - a hash of the JSON document without its times, see etag
+# - version - the layout of the hash, VERSION
+# - interval - seconds after which the page is too old, see next_interval;
+#   config.CACHE_INTERVAL if it's missing
+# - stale_until - when the page stops being served while it's being
+#   updated, see stale_until
+# - fingerprint - a hash of the page's HTML, see backend.download_page
+FIELDS = ('payload', 'updated', 'etag', 'version', 'interval', 'stale_until',
+          'fingerprint')
+Entry = namedtuple('Entry', FIELDS)
+
+VERSION = 1
+
+# the times of stories and comments in a JSON document, which are decoded
+# against the clock of each download, see parsers._decode_time
+TIME_FIELD = re.compile(r'"time":\s*[-+.\deE]+')
+
+# Sets fields of a page, ARGV is a list of fields and values. It doesn't
+# create a hash for a page which isn't stored anymore.
+_set_if_stored = rdb.register_script("""
+if redis.call('exists', KEYS[1]) == 1 then
+    redis.call('hmset', KEYS[1], unpack(ARGV))
+end
+""")
+
+# Sets the stale_until of a page to ARGV[1], but not later than ARGV[2]
+# seconds after it was updated.
+_extend_stale = rdb.register_script("""
+local updated = redis.call('hget', KEYS[1], 'updated')
+if updated then
+    local stale_until = math.min(tonumber(ARGV[1]),
+                                 tonumber(updated) + tonumber(ARGV[2]))
+    redis.call('hset', KEYS[1], 'stale_until', tostring(stale_until))
+end
+""")
+
+
+def read(db_key, fields=FIELDS):
+    """Return the Entry stored at :db_key: or None if there isn't one
+
+    :fields: only read these fields, the others will be None
+
+    Pages which are still stored in the old 'key' and 'key/updated'
+    strings are migrated to a hash first.
+
+    """
+    try:
+        values = rdb.hmget(db_key, fields)
+    except redis.ResponseError:
+        # WRONGTYPE, the key is a string
+        migrate(db_key)
+        values = rdb.hmget(db_key, fields)
+
+    if all(value is None for value in values):
+        return None
+    return _entry(dict(zip(fields, values)))
+
+
+def write(db_key, doc, pipe=None, interval=None, fingerprint=None):
+    """Store a page's JSON document and return its Entry
+
+    :pipe: a redis pipeline to add the commands to, it's the caller's
+    job to execute it then
+    :interval: the page's update interval, config.CACHE_INTERVAL by default
+    :fingerprint: the hash of the page's HTML, see backend.download_page
+
+    Stored pages are also published on config.INVALIDATE_CHANNEL and
+    their size is accounted for, see newhackers.capacity.
+
+    """
+    if interval is None:
+        interval = config.CACHE_INTERVAL
+    now = time.time()
+    entry = Entry(codec.encode(doc), now, etag(doc), VERSION, interval,
+                  now + interval + config.STALE_TIME, fingerprint)
+
+    execute = pipe is None
+    if execute:
+        pipe = rdb.pipeline(True)
+    pipe.hmset(db_key, dict((field, value) for field, value
+                            in entry._asdict().iteritems()
+                            if value is not None))
+    pipe.publish(config.INVALIDATE_CHANNEL, db_key)
+    capacity.record(db_key, len(entry.payload), pipe)
+    if execute:
+        pipe.execute()
+
+    return entry
+
+
+def stale_until(entry):
+    """Return the time when a page becomes too old to be served
+
+    A page is fresh for its interval and then stale for another
+    config.STALE_TIME seconds, during which it is still served while it
+    is being updated. After that it has to be downloaded before being
+    served again.
+
+    """
+    if entry.stale_until is not None:
+        return entry.stale_until
+    interval = entry.interval or config.CACHE_INTERVAL
+    return (entry.updated or 0) + interval + config.STALE_TIME
+
+
+def extend_stale(db_key):
+    """Keep serving a stale page for config.STALE_TIME more seconds
+
+    Used when updating the page failed, so that readers don't all wait
+    for HN while it's failing. A page isn't served for longer than
+    config.STALE_IF_ERROR seconds after it was updated, however often
+    updating it fails.
+
+    """
+    _extend_stale(keys=[db_key],
+                  args=[time.time() + config.STALE_TIME,
+                        config.STALE_IF_ERROR],
+                  client=rdb)
+
+
+def touch(db_key, interval=None):
+    """Mark a stored page as just downloaded without storing it again
+
+    Used when the page didn't change since it was stored. It's published
+    on config.INVALIDATE_CHANNEL like a stored page.
+
+    :interval: the page's update interval, config.CACHE_INTERVAL by default
+
+    """
+    if interval is None:
+        interval = config.CACHE_INTERVAL
+    now = time.time()
+    pipe = rdb.pipeline(True)
+    _set_if_stored(keys=[db_key],
+                   args=['updated', now, 'interval', interval,
+                         'stale_until', now + interval + config.STALE_TIME],
+                   client=pipe)
+    pipe.publish(config.INVALIDATE_CHANNEL, db_key)
+    pipe.execute()
+
+
+def next_interval(previous, new_etag):
+    """Return the update interval of a page which was just downloaded
+
+    :previous: the page's Entry from before the download or None
+    :new_etag: the ETag of the downloaded page
+
+    Pages which didn't change since the last download are updated less
+    often, up to config.MAX_CACHE_INTERVAL, and pages which did are
+    updated more often, down to config.MIN_CACHE_INTERVAL.
+
+    """
+    if previous is None or previous.etag is None:
+        return config.CACHE_INTERVAL
+    interval = previous.interval or config.CACHE_INTERVAL
+    if previous.etag == new_etag:
+        return min(interval * config.CACHE_INTERVAL_STEP,
+                   config.MAX_CACHE_INTERVAL)
+    return max(interval / config.CACHE_INTERVAL_STEP,
+               config.MIN_CACHE_INTERVAL)
+
+
+def etag(doc):
+    """Return the ETag of a JSON document string
+
+    The times in the document are left out, so a page which didn't change
+    on HN keeps its ETag even though its relative times were decoded at
+    a different second. The ETag is semantic, not byte-level: documents
+    which only differ in their times share it, so it's only sent as a
+    weak ETag, see views._add_page_headers.
+
+    """
+    if isinstance(doc, unicode):
+        doc = doc.encode('utf-8')
+    return hashlib.sha1(TIME_FIELD.sub('', doc)).hexdigest()
+
+
+def migrate(db_key):
+    """Move a page from the old 'key' and 'key/updated' strings to a hash
+
+    Returns True if the page was migrated.
+
+    """
+    with rdb.pipeline(True) as pipe:
+        try:
+            pipe.watch(db_key, db_key + '/updated')
+            if pipe.type(db_key) != 'string':
+                return False
+            payload, updated = pipe.mget(db_key, db_key + '/updated')
+            try:
+                doc = codec.decode(payload)
+            except ValueError:
+                # not a page, e.g. a 'key/updated' timestamp
+                return False
+
+            pipe.multi()
+            pipe.delete(db_key, db_key + '/updated')
+            # serve it while it's being updated, no matter how old it is
+            pipe.hmset(db_key, {'payload': payload,
+                                'updated': updated or 0,
+                                'etag': etag(doc),
+                                'version': VERSION,
+                                'stale_until': (time.time() +
+                                                config.STALE_TIME)})
+            capacity.record(db_key, len(payload), pipe)
+            pipe.execute()
+        except redis.WatchError:
+            # somebody else changed it meanwhile
+            return False
+    return True
+
+
+def migrate_all():
+    """Migrate all the pages which are still in the old format"""
+    migrated = 0
+    for pattern in ['/pages/*', '/comments/*']:
+        for db_key in rdb.scan_iter(pattern):
+            if migrate(db_key):
+                migrated += 1
+    return migrated
+
+
+def _entry(values):
+    if values.get('updated') is not None:
+        values['updated'] = float(values['updated'])
+    if values.get('version') is not None:
+        values['version'] = int(values['version'])
+    for field in ['interval', 'stale_until']:
+        if values.get(field) is not None:
+            values[field] = float(values[field])
+    return Entry(**dict((field, values.get(field)) for field in FIELDS))
+
+
+if __name__ == '__main__':
+    print "Migrated %d pages." % migrate_all()
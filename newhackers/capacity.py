@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from newhackers import config, stats
+from newhackers.config import rdb
+
+
+# hash of db_key -> bytes of the stored page
+SIZES_KEY = '/capacity/sizes'
+# hash of prefix -> bytes of all the stored pages with that prefix
+USAGE_KEY = '/capacity/usage'
+# sorted sets of db_key -> when the page was last read, one per prefix
+LRU_KEY = '/capacity/lru'
+
+_record = rdb.register_script("""
+local old = tonumber(redis.call('hget', KEYS[1], ARGV[1]) or 0)
+redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+redis.call('hincrby', KEYS[2], ARGV[3], ARGV[2] - old)
+redis.call('zadd', KEYS[3], ARGV[4], ARGV[1])
+""")
+
+_forget = rdb.register_script("""
+local size = tonumber(redis.call('hget', KEYS[1], KEYS[4]) or 0)
+redis.call('hdel', KEYS[1], KEYS[4])
+redis.call('hincrby', KEYS[2], ARGV[1], 0 - size)
+redis.call('zrem', KEYS[3], KEYS[4])
+if redis.call('del', KEYS[4]) == 1 then
+    redis.call('publish', ARGV[2], KEYS[4])
+end
+return size
+""")
+
+
+def prefix(db_key):
+    """Return the config.CACHE_BUDGETS prefix of :db_key: or None"""
+    for name in config.CACHE_BUDGETS:
+        if db_key.startswith(name):
+            return name
+    return None
+
+
+def record(db_key, size, pipe=None):
+    """Account for a page of :size: bytes which was stored at :db_key:
+
+    :pipe: a redis pipeline to add the command to, see cache.write
+
+    """
+    name = prefix(db_key)
+    if name is None:
+        return
+    _record(keys=[SIZES_KEY, USAGE_KEY, LRU_KEY + name],
+            args=[db_key, size, name, time.time()],
+            client=rdb if pipe is None else pipe)
+
+
+def touch(db_keys, pipe):
+    """Mark the stored pages at :db_keys: as recently read
+
+    :pipe: a redis pipeline to add the commands to
+
+    """
+    now = time.time()
+    for db_key in db_keys:
+        name = prefix(db_key)
+        if name is not None:
+            # only pages which are stored can be evicted
+            pipe.zadd(LRU_KEY + name, {db_key: now}, xx=True)
+
+
+def forget(db_key):
+    """Delete a stored page, e.g. one which HN doesn't have anymore
+
+    Returns the number of bytes which were freed.
+
+    """
+    name = prefix(db_key)
+    if name is None:
+        rdb.delete(db_key)
+        return 0
+    return _forget(keys=[SIZES_KEY, USAGE_KEY, LRU_KEY + name, db_key],
+                   args=[name, config.INVALIDATE_CHANNEL], client=rdb)
+
+
+def evict():
+    """Delete pages until every prefix fits in its config.CACHE_BUDGETS
+
+    Pages which weren't read for config.CACHE_IDLE_TIME are deleted
+    first, e.g. pages of expired fnid links, then the least recently
+    read ones.
+
+    Returns the number of deleted pages.
+
+    """
+    evicted = 0
+    for name, budget in config.CACHE_BUDGETS.iteritems():
+        lru = LRU_KEY + name
+        idle = rdb.zrangebyscore(lru, '-inf',
+                                 time.time() - config.CACHE_IDLE_TIME)
+        for db_key in idle:
+            forget(db_key)
+        evicted += len(idle)
+
+        used = int(rdb.hget(USAGE_KEY, name) or 0)
+        while used > budget:
+            oldest = rdb.zrange(lru, 0, 0)
+            if not oldest:
+                break
+            used -= forget(oldest[0])
+            evicted += 1
+
+    if evicted:
+        stats.incr('cache.evicted', evicted)
+    return evicted
+
+
+def usage():
+    """Return the bytes and number of pages stored for each prefix"""
+    budgets = config.CACHE_BUDGETS.items()
+    pipe = rdb.pipeline(False)
+    for name, budget in budgets:
+        pipe.hget(USAGE_KEY, name)
+        pipe.zcard(LRU_KEY + name)
+    values = pipe.execute()
+
+    return dict((name, {'bytes': int(used or 0),
+                        'pages': pages,
+                        'budget': budget})
+                for (name, budget), used, pages
+                in zip(budgets, values[::2], values[1::2]))
@@ -1,15 +1,29 @@
 #!/usr/bin/env python
 from __future__ import absolute_import
 
+from datetime import timedelta
+
 from celery import Celery
 
+from newhackers import config
+
 celery = Celery('newhackers.celer',
-                include=['newhackers.backend'])
+                include=['newhackers.backend', 'newhackers.tasks'])
 
 # Optional configuration, see the application user guide.
 celery.conf.update(
     CELERY_TASK_RESULT_EXPIRES=3600,
     BROKER_URL = 'redis://localhost:6379/0',
+    CELERYBEAT_SCHEDULE={
+        'refresh-popular': {
+            'task': 'newhackers.tasks.refresh_popular',
+            'schedule': timedelta(seconds=config.REFRESH_INTERVAL),
+        },
+        'evict': {
+            'task': 'newhackers.tasks.evict',
+            'schedule': timedelta(seconds=config.EVICT_INTERVAL),
+        },
+    },
 )
 
 if __name__ == '__main__':
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+import zlib
+
+from newhackers import config
+
+
+# The first byte of a stored value says how the rest of it is encoded.
+# Values stored before there was a format byte are plain JSON documents,
+# so they start with '{' or '['.
+FORMAT_GZIP = '\x01'  # gzip-compressed JSON
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def encode(doc):
+    """Encode a JSON document string for storing in the database"""
+    if isinstance(doc, unicode):
+        doc = doc.encode('utf-8')
+    compressor = zlib.compressobj(config.CACHE_COMPRESS_LEVEL, zlib.DEFLATED,
+                                  GZIP_WBITS)
+    return FORMAT_GZIP + compressor.compress(doc) + compressor.flush()
+
+
+def decode(value):
+    """Return the JSON document string out of a stored value
+
+    Raises ValueError if the value's format is unknown.
+
+    """
+    header = value[:1]
+    if header == FORMAT_GZIP:
+        return zlib.decompress(value[1:], GZIP_WBITS)
+    elif header in ('{', '['):
+        return value
+    else:
+        raise ValueError("Unknown format %r." % header)
+
+
+def gzip_body(value):
+    """Return the gzip stream out of a stored value
+
+    This can be sent as it is to clients which accept gzip, without
+    decompressing it first. Returns None if the value isn't gzipped.
+
+    """
+    if value[:1] == FORMAT_GZIP:
+        return value[1:]
+    return None
@@ -1,9 +1,66 @@
+import os
+
 import redis
 
 rdb = redis.Redis(db=8)
 
-HN = "https://news.ycombinator.com/"
+# e.g. a local tests/fakehn.py for testing without the real HN
+HN = os.environ.get('NEWHACKERS_HN', "https://news.ycombinator.com/")
 HN_LOGIN = HN + "newslogin?whence=news"
 HN_LOGIN_POST = HN + 'y'
 CACHE_INTERVAL = 60  # seconds
+MIN_CACHE_INTERVAL = 30  # seconds, for pages which change every update
+MAX_CACHE_INTERVAL = 30 * 60  # seconds, for pages which never change
+CACHE_INTERVAL_STEP = 2  # factor for changing a page's interval by
+STALE_TIME = 10 * 60  # seconds a page is served while it's being updated
+STALE_IF_ERROR = 24 * 60 * 60  # seconds a page is served while HN fails
 STORIES_PER_PAGE = 30
+PARSER = 'stream'  # or 'soup' for the BeautifulSoup parser
+TIME_CACHE_SIZE = 1024  # decoded relative timestamps
+# 'inline' or 'process' to parse pages in a pool of worker processes
+PARSE_EXECUTOR = 'inline'
+PARSE_PROCESSES = 2
+PARSE_QUEUE_SIZE = 8  # pages waiting for or being parsed in the pool
+PARSE_TIMEOUT = 10  # seconds
+PARSE_POLL_INTERVAL = 0.005  # seconds between checks for parsed pages
+CACHE_COMPRESS_LEVEL = 6  # zlib level for the pages stored in redis
+MISS_WAIT_TIMEOUT = 10  # seconds to wait for a page someone else downloads
+MISS_LOCK_TIME = 30  # seconds a cold miss can hold the page's lock
+WAIT_POLL_INTERVAL = 0.01  # seconds between checks while waiting, see green
+STATS_INTERVAL = 10  # seconds between adding the counters to redis
+LOCAL_CACHE_BYTES = 16 * 2 ** 20  # pages cached in each web process
+LOCAL_CACHE_TTL = 60  # seconds
+INVALIDATE_CHANNEL = '/invalidate'  # pubsub channel for updated pages
+POPULARITY_FLUSH_INTERVAL = 10  # seconds between adding requests to redis
+POPULARITY_DECAY = 0.9  # request counts are multiplied by it every refresh
+POPULARITY_MIN_SCORE = 0.5  # less popular pages aren't refreshed anymore
+REFRESH_INTERVAL = 10  # seconds between celery beat refreshes
+REFRESH_TOP_KEYS = 100  # the most popular pages are refreshed ahead of time
+REFRESH_BUDGET = 30  # at most this many refreshes per minute, 0 turns them off
+CACHE_BUDGETS = {  # bytes of stored pages with these key prefixes
+    '/pages/': 32 * 2 ** 20,
+    '/comments/': 256 * 2 ** 20,
+}
+CACHE_IDLE_TIME = 24 * 60 * 60  # seconds before an unread page is evicted
+EVICT_INTERVAL = 60  # seconds between celery beat evictions
+HN_TIMEOUT = (3.05, 10)  # seconds to connect to HN and to wait for a response
+HN_POOL_SIZE = 10  # keep-alive connections to HN in each process
+HN_RETRIES = 2  # for idempotent requests which failed to connect or got a 5xx
+HN_RATE = 2.0  # requests/s to HN from all the processes, not counting retries
+HN_BURST = 20  # requests which can be sent at once after a quiet period
+HN_PRIORITIES = {  # requests left for higher priorities, seconds to wait
+    'user': (0, 5),
+    'account': (2, 5),
+    'background': (10, 0),
+}
+PREFETCH_DEPTH = 1  # 'more' pages prefetched after a stories page update
+PREFETCH_BUDGET = 10  # prefetches per minute
+HN_MAX_BODY = 2 * 2 ** 20  # bytes, bigger responses are aborted
+HN_READ_DEADLINE = 20  # seconds to download a whole response
+HN_CHUNK_SIZE = 16 * 2 ** 10  # bytes read from HN at once
+HN_STREAM = False  # parse pages while they're downloaded, see download_page
+USER_DEADLINE = 15  # seconds a user's request can wait for HN
+TASK_DEADLINE = 60  # seconds a background update can wait for HN
+BREAKER_FAILURES = 5  # failed HN requests in a row which open the breaker
+BREAKER_RESET_TIME = 30  # seconds before an open breaker lets a probe through
+VOTE_LINKS_TTL = 5 * 60  # seconds a user's vote links are cached
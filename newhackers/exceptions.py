@@ -1,3 +1,6 @@
 class NotFound(Exception): pass
 class ClientError(Exception): pass
 class ServerError(Exception): pass
+class RateLimited(ServerError): pass
+class CircuitOpen(ServerError): pass
+class LocalLimit(ServerError): pass
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+import multiprocessing
+import threading
+import time
+
+try:
+    import gevent
+except ImportError:
+    gevent = None
+
+from newhackers import config
+from newhackers.exceptions import ServerError
+
+
+_pool = None
+# one slot for each page which is waiting for or being parsed in the pool
+_slots = None
+
+
+def run(func, *args):
+    """Run a CPU-bound function such as a parser and return its result
+
+    With config.PARSE_EXECUTOR = 'inline' :func: is simply called. With
+    'process' it is run in a pool of config.PARSE_PROCESSES processes, so
+    that e.g. the web server's event loop is free while pages are being
+    parsed. :func: and :args: must be picklable in that case. If gevent
+    is installed the result is waited for with gevent.sleep, so that
+    other greenlets run in the meantime.
+
+    Raises ServerError if there are already config.PARSE_QUEUE_SIZE
+    calls waiting for the pool or if the call doesn't finish in
+    config.PARSE_TIMEOUT seconds. A call which timed out keeps its slot
+    until the pool has actually finished it.
+
+    """
+    if config.PARSE_EXECUTOR == 'inline':
+        return func(*args)
+
+    pool, slots = _get_pool()
+    if not slots.acquire(False):
+        raise ServerError("Too many pages are waiting to be parsed.")
+    try:
+        result = pool.apply_async(_call, (func, args),
+                                  callback=lambda outcome: slots.release())
+    except Exception:
+        slots.release()
+        raise
+
+    _wait(result, config.PARSE_TIMEOUT)
+    if not result.ready():
+        raise ServerError("Parsing the page took too long.")
+    ok, value = result.get()
+    if not ok:
+        raise value
+    return value
+
+
+def shutdown():
+    """Stop the pool processes, a new pool is started when needed"""
+    global _pool, _slots
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+    _pool = _slots = None
+
+
+def _call(func, args):
+    """Run :func: in a pool process and return (ok, result or exception)
+
+    Exceptions are returned instead of raised, so that the callback which
+    frees the call's slot always runs.
+
+    """
+    try:
+        return True, func(*args)
+    except Exception as e:
+        return False, e
+
+
+def _wait(result, timeout):
+    """Wait at most :timeout: seconds for the pool's AsyncResult"""
+    if gevent is None:
+        result.wait(timeout)
+        return
+    end = time.time() + timeout
+    while not result.ready() and time.time() < end:
+        gevent.sleep(config.PARSE_POLL_INTERVAL)
+
+
+def _get_pool():
+    global _pool, _slots
+    if _pool is None:
+        _pool = multiprocessing.Pool(config.PARSE_PROCESSES)
+        _slots = threading.BoundedSemaphore(config.PARSE_QUEUE_SIZE)
+    return _pool, _slots
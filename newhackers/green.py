@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+try:
+    import gevent
+except ImportError:
+    gevent = None
+
+from newhackers import config
+
+
+def sleep(seconds):
+    """Sleep, letting the other greenlets run meanwhile
+
+    The server runs in gevent's WSGIServer without monkey patching, where
+    time.sleep would stop every request of the process.
+
+    """
+    if gevent is None:
+        time.sleep(seconds)
+    else:
+        gevent.sleep(seconds)
+
+
+def wait(ready, timeout):
+    """Wait until :ready: returns True or :timeout: seconds passed
+
+    :ready: is called every config.WAIT_POLL_INTERVAL seconds, so it
+    works for events set by other threads as well as by greenlets.
+
+    Returns the last result of :ready:
+
+    """
+    end = time.time() + timeout
+    while not ready():
+        left = end - time.time()
+        if left <= 0:
+            return False
+        sleep(min(config.WAIT_POLL_INTERVAL, left))
+    return True
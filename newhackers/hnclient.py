@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+from cookielib import DefaultCookiePolicy
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from newhackers import config, ratelimit, stats
+from newhackers.exceptions import LocalLimit, ServerError
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get(url, **kwargs):
+    """Send a GET request to HN, see request"""
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    """Send a POST request to HN, see request"""
+    return request('POST', url, **kwargs)
+
+
+def request(method, url, priority=ratelimit.USER, on_chunk=None,
+            deadline=None, **kwargs):
+    """Send a request to HN over a pooled keep-alive connection
+
+    The arguments are the same as for `requests.request`. The timeout
+    defaults to config.HN_TIMEOUT and idempotent requests are retried up
+    to config.HN_RETRIES times on connection errors and 5xx responses.
+    Only the first try takes a token from newhackers.ratelimit, retries
+    don't, so a call can send up to config.HN_RETRIES + 1 requests.
+
+    :priority: see newhackers.ratelimit, which can raise RateLimited
+    :on_chunk: called with every chunk of the body as it's downloaded
+    :deadline: the time.time() by which the whole response must be
+    downloaded, the timeout is shortened to fit it
+
+    The body is read in chunks of config.HN_CHUNK_SIZE bytes. Raises
+    LocalLimit if :deadline: passed before the request was sent or if
+    the body is bigger than config.HN_MAX_BODY bytes, and ServerError if
+    it isn't downloaded in config.HN_READ_DEADLINE seconds or by
+    :deadline:.
+
+    Return a requests Response object with the whole body
+
+    """
+    ratelimit.acquire(priority)
+    read_deadline = time.time() + config.HN_READ_DEADLINE
+    if deadline is None:
+        kwargs.setdefault('timeout', config.HN_TIMEOUT)
+    else:
+        left = deadline - time.time()
+        if left <= 0:
+            stats.incr('hn.out_of_time')
+            raise LocalLimit("No time left for HN.")
+        kwargs.setdefault('timeout', tuple(min(timeout, left)
+                                           for timeout in config.HN_TIMEOUT))
+        read_deadline = min(read_deadline, deadline)
+    session = _get_session()
+    try:
+        res = session.request(method, url, stream=True, **kwargs)
+    finally:
+        _count_connections(session, url)
+    try:
+        _read_body(res, read_deadline, on_chunk)
+    except:
+        # don't put a half-read connection back in the pool
+        res.close()
+        raise
+    return res
+
+
+def _read_body(res, deadline, on_chunk=None):
+    """Read the body of a streamed response, see request
+
+    :deadline: is checked between chunks, so a stalled read can overrun
+    it by up to the read timeout, which request shortens to the time
+    left before the caller's deadline.
+
+    """
+    if int(res.headers.get('Content-Length') or 0) > config.HN_MAX_BODY:
+        stats.incr('hn.too_big')
+        raise LocalLimit("HN's response is too big.")
+
+    chunks = []
+    size = 0
+    for chunk in res.iter_content(config.HN_CHUNK_SIZE):
+        size += len(chunk)
+        if size > config.HN_MAX_BODY:
+            stats.incr('hn.too_big')
+            raise LocalLimit("HN's response is too big.")
+        if time.time() > deadline:
+            stats.incr('hn.too_slow')
+            raise ServerError("HN took too long to respond.")
+        chunks.append(chunk)
+        if on_chunk is not None:
+            on_chunk(chunk)
+    # what res.content would have read
+    res._content = ''.join(chunks)
+
+
+def _get_session():
+    global _session, _session_pid
+    # sockets can't be shared with the processes we fork
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = _new_session()
+                _session_pid = os.getpid()
+    return _session
+
+
+def _new_session():
+    session = requests.Session()
+    # the session is shared by all users, so it must not keep their
+    # cookies; responses still have them in Response.cookies
+    session.cookies.set_policy(_NO_COOKIES)
+    retries = Retry(total=config.HN_RETRIES, backoff_factor=0.1,
+                    status_forcelist=[500, 502, 503, 504],
+                    raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=2,
+                          pool_maxsize=config.HN_POOL_SIZE,
+                          max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _count_connections(session, url):
+    """Count the requests and the new connections in newhackers.stats
+
+    hn.requests - hn.connections is the number of reused connections.
+
+    """
+    pool = session.get_adapter(url).poolmanager.connection_from_url(url)
+    with _session_lock:
+        # the connections the pool had opened the last time we counted
+        new = pool.num_connections - getattr(pool, 'counted_connections', 0)
+        pool.counted_connections = pool.num_connections
+    stats.incr('hn.requests')
+    if new:
+        stats.incr('hn.connections', new)
+
+
+class _NoCookiesPolicy(DefaultCookiePolicy):
+    def set_ok(self, cookie, request):
+        return False
+
+
+_NO_COOKIES = _NoCookiesPolicy()
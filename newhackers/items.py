@@ -15,16 +15,95 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
+import logging
+import threading
 import time
 
 from bs4 import BeautifulSoup
+from flask import g, has_request_context
 
+from newhackers import (cache, capacity, config, green, popularity, stats,
+                        tasks)
 from newhackers.config import rdb
-from newhackers.backend import update_page
-from newhackers import tasks
+from newhackers.backend import UPSTREAM_ERRORS, expired, update_page
+from newhackers.exceptions import NotFound, ServerError
+from newhackers.redis_lock import redis_lock, LockException
 
 
-def get_stories(page):
+# db_key -> _Flight for the cold misses this process is fetching
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+class LocalCache(object):
+    """An in-process LRU cache of cache.Entry pages
+
+    Holds at most :max_bytes: of pages, each for at most :ttl: seconds
+    and never past the time when the page is due for an update, so a
+    page from the local cache is always fresh.
+
+    """
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        # db_key -> (entry, expires), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db_key):
+        """Return the cached Entry or None if it's not cached"""
+        with self._lock:
+            try:
+                entry, expires = self._entries.pop(db_key)
+            except KeyError:
+                return None
+            if expires <= time.time():
+                self.size -= len(entry.payload)
+                return None
+            self._entries[db_key] = (entry, expires)
+            return entry
+
+    def set(self, db_key, entry):
+        """Cache a page's Entry"""
+        if entry.updated is None or len(entry.payload) > self.max_bytes:
+            return
+        interval = entry.interval or config.CACHE_INTERVAL
+        expires = min(time.time() + self.ttl, entry.updated + interval)
+        if expires <= time.time():
+            return
+
+        with self._lock:
+            self._discard(db_key)
+            self._entries[db_key] = (entry, expires)
+            self.size += len(entry.payload)
+            while self.size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def discard(self, db_key):
+        """Remove a page from the cache if it's there"""
+        with self._lock:
+            self._discard(db_key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _discard(self, db_key):
+        cached = self._entries.pop(db_key, None)
+        if cached is not None:
+            self.size -= len(cached[0].payload)
+
+
+_local = LocalCache(config.LOCAL_CACHE_BYTES, config.LOCAL_CACHE_TTL)
+# the thread which drops pages from _local when they're updated
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_stories(page, fields=cache.FIELDS):
     """Return a page of stories
 
     :page: string - can be one of:
@@ -32,46 +111,243 @@ def get_stories(page):
      - 'ask' - retrieves stories from the first page of Ask HN stories
      - '<hash>' - a page hash which represents an identifier of a common
        HN or Ask HN page
+    :fields: see _get_cache
+
+    Returns the page's cache.Entry; its payload can be decoded with
+    codec.decode.
 
     Raises NotFound exception if the page was not found.
 
     """
     if page not in ['', 'ask']:
         page = "x?fnid=" + page
-    return _get_cache('/pages/' + page, page)
+    return _get_cache('/pages/' + page, page, fields)
 
 
-def get_comments(item):
+def get_comments(item, fields=cache.FIELDS):
     """Return a page of comments
 
     :item: int - the identifier of a comments page on HN
+    :fields: see _get_cache
 
-    Returns information about a submission and all the comments attached
-    to it.
+    Returns the cache.Entry of a page with information about a
+    submission and all the comments attached to it; its payload can be
+    decoded with codec.decode.
 
     """
     item = str(item)
-    return _get_cache('/comments/' + item, 'item?id=' + item)
+    return _get_cache('/comments/' + item, 'item?id=' + item, fields)
 
 
-def _get_cache(db_key, page):
+def _get_cache(db_key, page, fields=cache.FIELDS):
     """Retrieves an item from HN with caching
 
     :db_key: string - the database key where the item is stored
     :page: string - the path after the HN root from where the item
     is downloaded
+    :fields: the cache.Entry fields which are needed, e.g. without the
+    payload for checking if a client's copy is still good. Other fields
+    may or may not be filled in.
 
-    Returns a JSON document representing the resource.
+    Returns the cache.Entry of the stored JSON document representing
+    the resource. Stale pages are returned while they're being updated
+    in the background, see cache.stale_until; older pages are downloaded
+    first, unless HN fails. HN gets config.USER_DEADLINE seconds for
+    that.
+
+    In a request, whether the page was served from the cache ('HIT') or
+    had to be downloaded first ('MISS') is kept in flask.g.cache_status.
 
     """
-    try:
-        stories = rdb[db_key]
-    except KeyError:
-        stories = update_page(db_key, page)
-        rdb[db_key] = stories
-        rdb[db_key + '/updated'] = time.time()
-        return stories
+    deadline = time.time() + config.USER_DEADLINE
+    _listen_for_invalidations()
+    popularity.hit(db_key, page)
+
+    entry = _local.get(db_key)
+    if entry is not None:
+        stats.incr('local_cache.hit')
+        _set_cache_status('HIT')
+        # pages are only cached locally while they're fresh
+        return entry
+    stats.incr('local_cache.miss')
+
+    # we always need these to decide whether to update the page
+    entry = cache.read(db_key, tuple(set(fields) | set(
+        ['updated', 'interval', 'stale_until'])))
+    if entry is None:
+        _set_cache_status('MISS')
+        entry = _fetch_once(db_key, page, deadline)
+    elif time.time() >= cache.stale_until(entry):
+        stats.incr('cache.hard_expired')
+        _set_cache_status('MISS')
+        entry = _refetch(db_key, page, entry, deadline)
+    else:
+        _set_cache_status('HIT')
+        _schedule_update(db_key, page, entry.updated, entry.interval)
+
+    if entry.payload is not None:
+        _local.set(db_key, entry)
+    return entry
+
+
+def _set_cache_status(status):
+    """Keep how the page of this request was found, see _get_cache"""
+    if has_request_context():
+        g.cache_status = status
+
+
+def _schedule_update(db_key, page, updated, interval=None):
+    """Enqueue a tasks.update of the page if it's due for one
+
+    :updated: the page's last_updated timestamp
+    :interval: the page's update interval, see backend.expired
+
+    A 'key/queued' marker which expires after CACHE_INTERVAL makes sure
+    that at most one update is enqueued per interval, no matter how many
+    requests find the page too old before the update runs.
+
+    Returns True if an update was enqueued.
+
+    """
+    if not expired(updated, interval=interval):
+        stats.incr('refresh.not_due')
+        return False
+
+    if not rdb.set(db_key + '/queued', 1, nx=True, ex=config.CACHE_INTERVAL):
+        stats.incr('refresh.already_queued')
+        return False
 
     tasks.update.delay(db_key, page)
+    stats.incr('refresh.enqueued')
+    return True
+
+
+def _refetch(db_key, page, old, deadline=None):
+    """Download a page which is too old to be served
+
+    :old: the page's stored Entry
+    :deadline: see backend.update_page
+
+    If HN fails, :old: is returned instead if it's not older than
+    config.STALE_IF_ERROR and it keeps being served for a while, see
+    cache.extend_stale.
+
+    """
+    try:
+        return _fetch_once(db_key, page, deadline)
+    except NotFound:
+        capacity.forget(db_key)
+        raise
+    except UPSTREAM_ERRORS:
+        if time.time() >= (old.updated or 0) + config.STALE_IF_ERROR:
+            raise
+        logging.warning("Serving a stale %s, HN failed.", db_key,
+                        exc_info=True)
+        stats.incr('cache.stale_on_error')
+        cache.extend_stale(db_key)
+        return old
+
+
+class _Flight(object):
+    """A cold miss which is being fetched, other requests can wait for it"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def _fetch_once(db_key, page, deadline=None):
+    """Download and store a page which is not cached
+
+    :deadline: see backend.update_page
+
+    Only one request per process downloads the page, the others
+    requesting the same page wait up to config.MISS_WAIT_TIMEOUT seconds
+    for its result. See _fetch_locked for other processes.
+
+    Returns the page's cache.Entry.
+
+    """
+    with _flights_lock:
+        flight = _flights.get(db_key)
+        leader = flight is None
+        if leader:
+            flight = _flights[db_key] = _Flight()
+
+    if not leader:
+        # the leader can be a greenlet of this thread, Event.wait would
+        # keep it from running
+        if not green.wait(flight.done.is_set, config.MISS_WAIT_TIMEOUT):
+            raise ServerError("Timed out waiting for the page.")
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    try:
+        flight.value = _fetch_locked(db_key, page, deadline)
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[db_key]
+        flight.done.set()
+
+    return flight.value
+
+
+def _fetch_locked(db_key, page, deadline=None):
+    """Download and store a page while holding its redis lock
+
+    This is the same lock that tasks.update takes, so a process which
+    had to wait for it will usually find the page already stored and
+    doesn't need to download it again.
+
+    """
+    entry = None
+    try:
+        with redis_lock(rdb, '/lock' + db_key, atime=config.MISS_WAIT_TIMEOUT,
+                        ltime=config.MISS_LOCK_TIME, cooperative=True):
+            entry = cache.read(db_key)
+            if entry is None or time.time() >= cache.stale_until(entry):
+                entry = cache.write(db_key, update_page(
+                    db_key, page, deadline=deadline))
+    except LockException:
+        # either we couldn't get the lock in time or it expired while
+        # we were downloading, which doesn't matter anymore
+        if entry is None:
+            raise ServerError("Timed out waiting for the page.")
+
+    return entry
+
+
+def _listen_for_invalidations():
+    """Start a thread which drops updated pages from the local cache
+
+    Pages are published on config.INVALIDATE_CHANNEL whenever they are
+    stored in redis.
+
+    """
+    global _listener
+    if _listener is not None and _listener.is_alive():
+        return
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = threading.Thread(target=_invalidate_forever)
+            _listener.daemon = True
+            _listener.start()
+
 
-    return stories
+def _invalidate_forever():
+    while True:
+        try:
+            pubsub = rdb.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(config.INVALIDATE_CHANNEL)
+            # we might have missed messages while not subscribed
+            _local.clear()
+            for message in pubsub.listen():
+                _local.discard(message['data'])
+        except Exception:
+            logging.exception("Lost the cache invalidation subscription.")
+            _local.clear()
+            time.sleep(1)
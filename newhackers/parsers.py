@@ -15,22 +15,34 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
+from datetime import datetime, timedelta
 import re
 import time
 
 from bs4 import BeautifulSoup
 from parsedatetime import parsedatetime as pdt
 
-from newhackers import config
+from newhackers import config, streamparser
+from newhackers.streamparser import Element
 
 
 cal = pdt.Calendar()
 
+# the relative timestamps HN uses, e.g. "3 hours ago"
+RELATIVE_TIME = re.compile(
+    r'^\s*(\d+)\s+(second|minute|hour|day|week)s?\s+ago\s*$')
+# (timestamp, second) -> decoded time
+_time_cache = OrderedDict()
 
-def parse_comments(page):
+
+def parse_comments(page, engine=None):
     """Parse comments from an HN comments page
 
-    :page: an HTML document with comments
+    :page: an HTML document with comments, or for the 'stream' engine
+    also a closed streamparser.PageParser which was fed the document
+    :engine: the name of the parser to use, either 'stream' or 'soup';
+    defaults to config.PARSER
 
     Returns a dict of metadata about the story and a list of comments. E.g.
 
@@ -53,18 +65,27 @@ def parse_comments(page):
      }
 
     """
-    soup = BeautifulSoup(page)
-    more, titles = _parse_links(soup)
+    # decode all the relative times of this page against the same clock
+    now = time.time()
+    if (engine or config.PARSER) == 'soup':
+        soup = BeautifulSoup(page)
+        more, titles = _parse_links(soup)
+        subtexts = _parse_subtexts(soup, now)
+        comments = _parse_comments(soup, now)
+    else:
+        doc = _page_parser(page)
+        more, titles = _links(doc.titles)
+        subtexts = _subtexts(doc.subtexts, now)
+        comments = _comments(doc.comheads, doc.comments, now)
+
     assert more is None
     assert len(titles) == 1
-    
-    subtexts = _parse_subtexts(soup)
     assert len(subtexts) == 1
 
     resp = titles[0]
     resp.update(subtexts[0])
 
-    resp['comments'] = _parse_comments(soup)
+    resp['comments'] = comments
     if not resp['comments_no']:
         assert len(resp['comments']) == 0
     if resp['comments_no'] != -1:
@@ -73,20 +94,23 @@ def parse_comments(page):
     return resp
 
 
-def _parse_comments(soup):
+def _parse_comments(soup, now=None):
     """Extract all the comments from a comments page.
 
     Returns None if this page has no comments.
 
     """
-    com_spans = soup.find_all('span', 'comhead')
+    return _comments(_elements(soup.find_all('span', 'comhead')),
+                     _elements(soup.find_all('span', 'comment')), now)
+
+
+def _comments(com_spans, comment_bodies, now=None):
+    """Build the comments list out of comhead and comment Elements"""
     if not com_spans:
         return None
 
     # first comhead belongs to the story title
-    com_spans.pop(0)
-
-    comment_bodies = soup.find_all('span', 'comment')
+    com_spans = com_spans[1:]
 
     comments = []
     for head, body in zip(com_spans, comment_bodies):
@@ -98,18 +122,22 @@ def _parse_comments(soup):
             # ignore deleted comments
             assert not head.text
             continue
-        comment['time'] = _decode_time(c_time)
-        comment['link'] = head.find_all('a')[1]['href'].split('item?id=')[1]
+        comment['time'] = _decode_time(c_time, now)
+        comment['link'] = head.links[1][0].split('item?id=')[1]
         comment['body'] = body.text.strip()
         comments.append(comment)
 
     return comments
     
 
-def parse_stories(page):
+def parse_stories(page, engine=None):
     """Parse stories from an HN stories page
 
-    :page: an HTML document which contains 30 stories
+    :page: an HTML document which contains 30 stories, or for the
+    'stream' engine also a closed streamparser.PageParser, see
+    parse_comments
+    :engine: the name of the parser to use, either 'stream' or 'soup';
+    defaults to config.PARSER
 
     Returns a dict with a more link and a list of stories dicts. E.g.
 
@@ -132,12 +160,17 @@ def parse_stories(page):
            ...]}
 
     """
-    soup = BeautifulSoup(page)
+    now = time.time()
+    if (engine or config.PARSER) == 'soup':
+        soup = BeautifulSoup(page)
+        more, stories = _parse_links(soup)
+        subtexts = _parse_subtexts(soup, now)
+    else:
+        doc = _page_parser(page)
+        more, stories = _links(doc.titles)
+        subtexts = _subtexts(doc.subtexts, now)
 
-    more, stories = _parse_links(soup)
     assert len(stories) == config.STORIES_PER_PAGE
-
-    subtexts = _parse_subtexts(soup)
     assert len(subtexts) == config.STORIES_PER_PAGE
 
     for story, subtext in zip(stories, subtexts):
@@ -146,6 +179,13 @@ def parse_stories(page):
     return dict(stories=stories, more=more)
 
 
+def _page_parser(page):
+    """Return a PageParser which was fed :page:, see parse_stories"""
+    if isinstance(page, streamparser.PageParser):
+        return page
+    return streamparser.parse(page)
+
+
 def _parse_links(soup):
     """Return a more link and a list of title/link dicts
 
@@ -165,22 +205,26 @@ def _parse_links(soup):
     # - the title and link of the story
     # The title and the link don't have a valign attribute
     # Finally there is a 'More' link to the next page of stories.
-    titles = soup.find_all("td", "title", valign=False)
+    return _links(_elements(soup.find_all("td", "title", valign=False)))
+
 
+def _links(titles):
+    """Return a more link and a list of title/link dicts out of Elements"""
     # comments pages have only one title and no 'More' link
     if len(titles) == 1:
         more = None
     else:
-        more = _extract_more(titles.pop(-1))
-        
+        more = _extract_more(titles[-1])
+        titles = titles[:-1]
+
     stories = [{'title': title.text.strip().split('\n')[0],
-                'link': title.find("a")["href"]}
+                'link': title.links[0][0]}
                for title in titles]
 
     return more, stories
 
 
-def _parse_subtexts(soup):
+def _parse_subtexts(soup, now=None):
     """Returns a list of dictionaries with stories metadata
 
     Returns e.g.
@@ -201,7 +245,11 @@ def _parse_subtexts(soup):
     """
     # Some other data about each submission is stored in <td
     # class="subtext"> elements
-    metadata = soup.find_all("td", "subtext")
+    return _subtexts(_elements(soup.find_all("td", "subtext")), now)
+
+
+def _subtexts(metadata, now=None):
+    """Return a list of stories metadata dicts out of subtext Elements"""
     if not metadata:
         return None
 
@@ -216,10 +264,10 @@ def _parse_subtexts(soup):
         # Jobs post
         if 'point' in meta.text:
             story_time = re.search('\s+(.*?)\s+\|', meta.text).group(1)
-            stories[s]['time'] = _decode_time(story_time)
+            stories[s]['time'] = _decode_time(story_time, now)
             stories[s]['score'] = int(re.search(
                     "(\d+)\s+points?", meta.text).group(1))
-            stories[s]['author'] = meta.a.text.strip()
+            stories[s]['author'] = meta.links[0][1].strip()
             if 'discuss' in meta.text:  # Zero comments
                 stories[s]['comments_no'] = 0
             else:
@@ -233,7 +281,7 @@ def _parse_subtexts(soup):
                     stories[s]['comments_no'] = -1
 
         else:  # Jobs post
-            stories[s]['time'] = _decode_time(meta.text.strip())
+            stories[s]['time'] = _decode_time(meta.text.strip(), now)
             stories[s]['comments_no'] = None
             stories[s]['score'] = None
             stories[s]['author'] = None
@@ -241,12 +289,49 @@ def _parse_subtexts(soup):
     return stories
 
 
-def _extract_more(more_soup):
-    """Extract a page identifier from the <a> element in a BeautifulSoup"""
-    return more_soup.find("a")['href'].split('fnid=')[-1]
+def _extract_more(more):
+    """Extract a page identifier from the first link of an Element"""
+    return more.links[0][0].split('fnid=')[-1]
 
 
-def _decode_time(timestamp):
-    """Decode time from a relative timestamp to a localtime float"""
-    return time.mktime(cal.parse(timestamp)[0])
+def _elements(tags):
+    """Turn BeautifulSoup tags into the Elements the streamparser makes"""
+    return [Element(tag.text, [(a.get('href'), a.text)
+                               for a in tag.find_all('a')])
+            for tag in tags]
 
+
+def _decode_time(timestamp, now=None):
+    """Decode time from a relative timestamp to a localtime float
+
+    :timestamp: a string such as "3 hours ago"
+    :now: the epoch float the timestamp is relative to; defaults to the
+    current time
+
+    The common "N units ago" timestamps are computed directly, anything
+    else goes through parsedatetime. Results are cached for each second
+    of :now:, so the timestamps of a page which are decoded with the
+    same :now: are only computed once.
+
+    """
+    if now is None:
+        now = time.time()
+    key = (timestamp, int(now))
+    try:
+        decoded = _time_cache.pop(key)
+    except KeyError:
+        match = RELATIVE_TIME.match(timestamp)
+        if match:
+            number, unit = match.groups()
+            then = (datetime.fromtimestamp(int(now)) -
+                    timedelta(**{unit + 's': int(number)}))
+            decoded = time.mktime(then.timetuple())
+        else:
+            decoded = time.mktime(
+                cal.parse(timestamp, time.localtime(now))[0])
+
+        if len(_time_cache) >= config.TIME_CACHE_SIZE:
+            _time_cache.popitem(last=False)
+
+    _time_cache[key] = decoded
+    return decoded
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+from collections import Counter
+import threading
+import time
+
+from newhackers import capacity, config
+from newhackers.backend import expired
+from newhackers.config import rdb
+
+
+# sorted set of db_key -> decayed number of requests for the page
+POPULAR_KEY = '/popular'
+# hash of db_key -> the page's HN path, for updating the popular pages
+PATHS_KEY = '/popular/paths'
+
+# requests which weren't added to the sorted set yet
+_hits = Counter()
+_paths = {}
+_lock = threading.Lock()
+_last_flush = time.time()
+
+
+def hit(db_key, page):
+    """Count a request for the page stored at :db_key:
+
+    :page: the page's HN path
+
+    Like newhackers.stats, requests are counted in the process and only
+    added to redis every config.POPULARITY_FLUSH_INTERVAL seconds. This
+    is also when the page is marked as recently read for eviction, see
+    newhackers.capacity.
+
+    """
+    with _lock:
+        _hits[db_key] += 1
+        _paths[db_key] = page
+        due = time.time() - _last_flush >= config.POPULARITY_FLUSH_INTERVAL
+
+    if due:
+        flush()
+
+
+def flush():
+    """Add this process' requests to the shared sorted set"""
+    global _last_flush
+    with _lock:
+        hits = dict(_hits)
+        paths = dict(_paths)
+        _hits.clear()
+        _paths.clear()
+        _last_flush = time.time()
+
+    if hits:
+        pipe = rdb.pipeline(False)
+        for db_key, amount in hits.iteritems():
+            pipe.zincrby(POPULAR_KEY, amount, db_key)
+        pipe.hmset(PATHS_KEY, paths)
+        capacity.touch(hits, pipe)
+        pipe.execute()
+
+
+def decay():
+    """Age the request counts and forget the pages nobody reads anymore
+
+    Every count is multiplied by config.POPULARITY_DECAY and the pages
+    left with less than config.POPULARITY_MIN_SCORE are dropped.
+
+    Returns the number of dropped pages.
+
+    """
+    with rdb.pipeline(True) as pipe:
+        pipe.zunionstore(POPULAR_KEY, {POPULAR_KEY: config.POPULARITY_DECAY})
+        pipe.zrangebyscore(POPULAR_KEY, '-inf',
+                           '(%f' % config.POPULARITY_MIN_SCORE)
+        pipe.zremrangebyscore(POPULAR_KEY, '-inf',
+                              '(%f' % config.POPULARITY_MIN_SCORE)
+        cold = pipe.execute()[1]
+
+    if cold:
+        rdb.hdel(PATHS_KEY, *cold)
+    return len(cold)
+
+
+def due(ahead):
+    """Return the popular pages which need updating, most popular first
+
+    :ahead: seconds - also include pages which will be too old by then
+
+    Only the config.REFRESH_TOP_KEYS most popular pages are looked at.
+    Returns a list of (db_key, page) tuples.
+
+    """
+    db_keys = rdb.zrevrange(POPULAR_KEY, 0, config.REFRESH_TOP_KEYS - 1)
+    if not db_keys:
+        return []
+
+    pipe = rdb.pipeline(False)
+    for db_key in db_keys:
+        pipe.hmget(db_key, ['updated', 'interval'])
+    # pages still in the old format are errors, they get updated anyway
+    timestamps = [(None, None) if isinstance(values, Exception) else values
+                  for values in pipe.execute(raise_on_error=False)]
+    paths = rdb.hmget(PATHS_KEY, db_keys)
+
+    return [(db_key, path)
+            for db_key, path, (updated, interval)
+            in zip(db_keys, paths, timestamps)
+            if path is not None and expired(updated, ahead, interval)]
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from newhackers import config, green, stats
+from newhackers.config import rdb
+from newhackers.exceptions import RateLimited
+
+
+# The priorities of requests to HN, from the most important one, see
+# config.HN_PRIORITIES
+USER = 'user'  # a user is waiting for the page
+ACCOUNT = 'account'  # logins and votes
+BACKGROUND = 'background'  # updates of pages which are already stored
+
+BUCKET_KEY = '/ratelimit/hn'
+
+# A token bucket which is refilled with ARGV[2] tokens per second up to
+# ARGV[3] tokens. A token is only taken if at least ARGV[4] are left
+# after it. Returns 0 if we got one or the milliseconds until we might.
+_take = rdb.register_script("""
+local now, rate = tonumber(ARGV[1]), tonumber(ARGV[2])
+local burst, reserve = tonumber(ARGV[3]), tonumber(ARGV[4])
+local bucket = redis.call('hmget', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+
+local wait = 0
+if tokens - 1 >= reserve then
+    tokens = tokens - 1
+else
+    wait = math.ceil((reserve + 1 - tokens) / rate * 1000)
+end
+redis.call('hmset', KEYS[1], 'tokens', tostring(tokens),
+           'updated', tostring(now))
+redis.call('expire', KEYS[1], math.ceil(burst / rate) + 1)
+return wait
+""")
+
+
+def acquire(priority=USER):
+    """Wait for our turn to send a request to HN
+
+    All the processes share a bucket of config.HN_BURST requests which
+    is refilled with config.HN_RATE requests per second. Lower
+    priorities leave some of the bucket to the higher ones and wait
+    less for their turn, see config.HN_PRIORITIES.
+
+    Raises RateLimited if the wait would be too long. The wait lets the
+    other greenlets run, see newhackers.green.
+
+    """
+    reserve, max_wait = config.HN_PRIORITIES[priority]
+    deadline = time.time() + max_wait
+    while True:
+        wait = _take(keys=[BUCKET_KEY],
+                     args=[repr(time.time()), config.HN_RATE,
+                           config.HN_BURST, reserve],
+                     client=rdb) / 1000.0
+        if not wait:
+            stats.incr('ratelimit.%s.sent' % priority)
+            return
+        if time.time() + wait > deadline:
+            stats.incr('ratelimit.%s.limited' % priority)
+            raise RateLimited("Too many requests to HN.")
+        stats.incr('ratelimit.%s.waited' % priority)
+        green.sleep(wait)
@@ -3,56 +3,97 @@
 
 import time
 
-import redis
-
 import contextlib, uuid
 
+from newhackers import green, stats
+from newhackers.config import rdb
+
+
+# Deletes the lock only if we still hold it and wakes up one of the
+# processes which are waiting for it in acquire_lock.
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('del', KEYS[1], KEYS[2])
+    redis.call('rpush', KEYS[2], 1)
+    redis.call('pexpire', KEYS[2], ARGV[2])
+    return 1
+end
+return 0
+"""
+_release = rdb.register_script(RELEASE_SCRIPT)
+
 
 class LockException(Exception): pass
 
 
 @contextlib.contextmanager
-def redis_lock(conn, lockname, atime=10, ltime=10):
+def redis_lock(conn, lockname, atime=10, ltime=10, cooperative=False):
     identifier = str(uuid.uuid4())
     if acquire_lock(**locals()) != identifier:
         raise LockException("could not acquire lock")
+    acquired = time.time()
     try:
         yield identifier
     finally:
-        if not release_lock(conn, lockname, identifier):
+        stats.incr('lock.hold_ms', int((time.time() - acquired) * 1000))
+        if not release_lock(conn, lockname, identifier, ltime):
+            stats.incr('lock.lost')
             raise LockException("lock was lost")
 
 
-def acquire_lock(conn, lockname, identifier, atime=10, ltime=10):
-    end = time.time() + atime
-    while end > time.time():
-        if conn.setnx(lockname, identifier):
-            conn.expire(lockname, ltime)
-            return identifier
-        elif not conn.ttl(lockname):
-            conn.expire(lockname, ltime)
+def acquire_lock(conn, lockname, identifier, atime=10, ltime=10,
+                 cooperative=False):
+    """Try to get the lock for :atime: seconds and hold it for :ltime:
 
-        time.sleep(.001)
-    return False
+    Instead of polling, waiting processes block on the lock's wake list
+    until release_lock pushes to it or the lock expires.
 
+    :cooperative: poll the wake list instead, letting the other greenlets
+    run meanwhile, see newhackers.green. A blocking read would stop the
+    whole web server.
 
-def release_lock(conn, lockname, identifier):
-    pipe = conn.pipeline(True)
+    Returns :identifier: if we got the lock or False.
 
+    """
+    start = time.time()
+    end = start + atime
+    wake = lockname + '/wake'
+    contended = False
     while True:
-        try:
-            pipe.watch(lockname)
-            if pipe.get(lockname) == identifier:
-                pipe.multi()
-                pipe.delete(lockname)
-                pipe.execute()
-                return True
-
-            pipe.unwatch()
-            break
-
-        except redis.exceptions.WatchError:
-            pass
-
-    # we lost the lock
-    return False
+        if conn.set(lockname, identifier, nx=True, px=int(ltime * 1000)):
+            stats.incr('lock.acquired')
+            if contended:
+                stats.incr('lock.contended')
+                stats.incr('lock.wait_ms', int((time.time() - start) * 1000))
+            return identifier
+        contended = True
+
+        remaining = end - time.time()
+        if remaining <= 0:
+            stats.incr('lock.timeout')
+            return False
+
+        ttl = conn.pttl(lockname)
+        if ttl == -1:
+            # a lock without an expiry would be held forever
+            conn.pexpire(lockname, int(ltime * 1000))
+        elif ttl > 0:
+            remaining = min(remaining, ttl / 1000.0)
+        if cooperative:
+            green.wait(lambda: conn.lpop(wake) is not None, remaining)
+        else:
+            # fractional timeouts need redis >= 6.0, 0 would block forever
+            conn.blpop(wake, max(remaining, 0.001))
+
+
+def release_lock(conn, lockname, identifier, ltime=10):
+    """Release the lock if we still hold it
+
+    :ltime: seconds for which a wake up is kept for processes which
+    weren't waiting yet
+
+    Returns False if the lock expired and maybe someone else got it.
+
+    """
+    return bool(_release(keys=[lockname, lockname + '/wake'],
+                         args=[identifier, int(ltime * 1000)], client=conn))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+from collections import Counter
+import threading
+import time
+
+from newhackers import config
+from newhackers.config import rdb
+
+
+STATS_KEY = '/stats'
+
+# counters which weren't added to the redis hash yet
+_counts = Counter()
+_lock = threading.Lock()
+_last_flush = time.time()
+
+
+def incr(name, amount=1):
+    """Increment the counter :name: by :amount:
+
+    Counters are kept in the process and only added to the redis hash
+    shared by all the processes every config.STATS_INTERVAL seconds, so
+    counting doesn't cost a round trip.
+
+    """
+    with _lock:
+        _counts[name] += amount
+        due = time.time() - _last_flush >= config.STATS_INTERVAL
+
+    if due:
+        flush()
+
+
+def flush():
+    """Add this process' counters to the shared redis hash"""
+    global _last_flush
+    with _lock:
+        counts = dict(_counts)
+        _counts.clear()
+        _last_flush = time.time()
+
+    if counts:
+        pipe = rdb.pipeline(False)
+        for name, amount in counts.iteritems():
+            pipe.hincrby(STATS_KEY, name, amount)
+        pipe.execute()
+
+
+def get():
+    """Return a dict with the counters of all the processes"""
+    flush()
+    return dict((name, int(amount))
+                for name, amount in rdb.hgetall(STATS_KEY).iteritems())
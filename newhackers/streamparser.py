@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+import codecs
+from htmlentitydefs import name2codepoint
+from HTMLParser import HTMLParser
+
+
+# A captured element: all its text and the (href, text) of every <a>
+# inside it, in document order
+Element = namedtuple('Element', 'text links')
+
+# These never get an end tag, so they are never pushed on the tag stack
+VOID_TAGS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen',
+    'link', 'menuitem', 'meta', 'param', 'source', 'track', 'wbr',
+    'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex', 'nextid',
+    'spacer'])
+
+WHITESPACE = u'\x20\x0a\x09\x0c\x0d'
+
+
+class _Capture(object):
+    """An element which is being collected while it's still open"""
+    __slots__ = ('kind', 'depth', 'text', 'links')
+
+    def __init__(self, kind, depth):
+        self.kind = kind
+        self.depth = depth
+        self.text = []
+        self.links = []
+
+
+class PageParser(HTMLParser):
+    """Collect everything the HN parsers need in a single pass
+
+    This is an event-driven alternative to building a BeautifulSoup
+    tree and then running a `find_all` over it for every kind of
+    element. Feed it the document (all at once or in chunks, see also
+    `feed_bytes`) and then call `close`. The captured elements will be
+    in these lists:
+
+     - titles - <td class="title"> without a valign attribute
+     - subtexts - <td class="subtext">
+     - comheads - <span class="comhead">
+     - comments - <span class="comment">
+
+    Tags are closed the same way BeautifulSoup's html.parser builder
+    closes them, so the text of each element is the same as its
+    `.text` in a BeautifulSoup tree.
+
+    """
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.titles = []
+        self.subtexts = []
+        self.comheads = []
+        self.comments = []
+
+        self._stack = []
+        self._captures = []
+        # (href, text, depth) of each open <a> inside a capture
+        self._links = []
+        # text since the last tag, it's added to the open elements at once
+        self._data = []
+        # void tags which might still get a redundant end tag
+        self._closed_voids = []
+        # for the chunks given to feed_bytes
+        self._decoder = None
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in VOID_TAGS:
+            self._closed_voids.append(tag)
+            return
+
+        self._stack.append(tag)
+        depth = len(self._stack)
+
+        if tag == 'a' and self._captures:
+            link = (dict(attrs).get('href'), [], depth)
+            self._links.append(link)
+            for capture in self._captures:
+                capture.links.append(link)
+            return
+
+        if tag not in ('td', 'span'):
+            return
+
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        if tag == 'td':
+            if 'title' in classes and 'valign' not in attrs:
+                self._captures.append(_Capture(self.titles, depth))
+            elif 'subtext' in classes:
+                self._captures.append(_Capture(self.subtexts, depth))
+        else:
+            if 'comhead' in classes:
+                self._captures.append(_Capture(self.comheads, depth))
+            elif 'comment' in classes:
+                self._captures.append(_Capture(self.comments, depth))
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            self._flush()
+            if tag in self._closed_voids:
+                self._closed_voids.remove(tag)
+        else:
+            self.handle_starttag(tag, attrs)
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self._closed_voids:
+            # e.g. the </br> in <br>foo</br>
+            self._closed_voids.remove(tag)
+            return
+
+        self._flush()
+        # like BeautifulSoup, close everything up to the most recent
+        # open tag with this name, or nothing if there isn't one
+        try:
+            index = len(self._stack) - 1 - self._stack[::-1].index(tag)
+        except ValueError:
+            return
+        del self._stack[index:]
+        self._close_to(index)
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def handle_charref(self, name):
+        if name[0] in 'xX':
+            code = int(name[1:], 16)
+        else:
+            code = int(name)
+
+        data = None
+        if code < 256:
+            # same Windows-1252 guess that BeautifulSoup does
+            try:
+                data = chr(code).decode('windows-1252')
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = unichr(code)
+            except (ValueError, OverflowError):
+                data = u"\N{REPLACEMENT CHARACTER}"
+        self._data.append(data)
+
+    def handle_entityref(self, name):
+        try:
+            self._data.append(unichr(name2codepoint[name]))
+        except KeyError:
+            self._data.append(u"&%s" % name)
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, data):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        self._flush()
+        if data.upper().startswith('CDATA['):
+            self._data.append(data[len('CDATA['):])
+            self._flush()
+
+    def feed_bytes(self, chunk):
+        """Feed a chunk of a UTF-8 encoded document
+
+        A character can be split between chunks. Undecodable bytes are
+        replaced rather than guessed at like `parse` does, because the
+        chunks before them were already parsed.
+
+        """
+        if self._decoder is None:
+            self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.feed(self._decoder.decode(chunk))
+
+    def close(self):
+        if self._decoder is not None:
+            self.feed(self._decoder.decode('', True))
+        HTMLParser.close(self)
+        self._flush()
+        self._close_to(0)
+
+    def _flush(self):
+        """Add the text collected since the last tag to the open elements"""
+        if not self._data:
+            return
+        data = u''.join(self._data)
+        self._data = []
+
+        # BeautifulSoup collapses whitespace-only strings outside of <pre>
+        if (not data.strip(WHITESPACE) and 'pre' not in self._stack
+                and 'textarea' not in self._stack):
+            data = u'\n' if u'\n' in data else u' '
+
+        for capture in self._captures:
+            capture.text.append(data)
+        for link in self._links:
+            link[1].append(data)
+
+    def _close_to(self, depth):
+        """Finish all the captures and links deeper than :depth:"""
+        while self._links and self._links[-1][2] > depth:
+            self._links.pop()
+
+        while self._captures and self._captures[-1].depth > depth:
+            capture = self._captures.pop()
+            capture.kind.append(Element(
+                u''.join(capture.text),
+                [(href, u''.join(text)) for href, text, _ in capture.links]))
+
+
+def parse(page):
+    """Parse an HN page in one pass and return the PageParser"""
+    if isinstance(page, str):
+        try:
+            page = page.decode('utf-8')
+        except UnicodeDecodeError:
+            page = page.decode('windows-1252', 'replace')
+
+    parser = PageParser()
+    parser.feed(page)
+    parser.close()
+    return parser
@@ -15,27 +15,184 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
 
+import json
 import time
 
-from newhackers.backend import too_old, update_page
+from newhackers import cache, capacity, config, popularity, ratelimit, stats
+from newhackers.backend import (UPSTREAM_ERRORS, download_page, expired,
+                                update_page)
 from newhackers.config import rdb
 from newhackers.celer import celery
+from newhackers.exceptions import CircuitOpen, NotFound, RateLimited
 from newhackers.redis_lock import redis_lock, LockException
 
 
 @celery.task
-def update(db_key, page):
+def update(db_key, page, ahead=0):
+    """Update a page if it's too old, see backend.too_old
+
+    Pages which didn't change since the last update are updated less
+    often from now on and pages which did more often, see
+    cache.next_interval. HN gets config.TASK_DEADLINE seconds to answer.
+    If HN fails, the stored page can be served for longer instead, see
+    cache.extend_stale. Pages whose HTML didn't change aren't parsed and
+    stored again, only marked as updated, see backend.download_page.
+    Updated stories pages also prefetch the pages after them, see
+    prefetch.
+
+    """
+    deadline = time.time() + config.TASK_DEADLINE
     try:
         with redis_lock(rdb, '/lock' + db_key):
-            if too_old(db_key):
-                stories = update_page(db_key, page)
-                pipe = rdb.pipeline(True)
-                pipe[db_key] = stories
-                pipe[db_key + '/updated'] = time.time()
-                pipe.execute()
+            previous = cache.read(db_key, ['updated', 'etag', 'interval',
+                                           'fingerprint'])
+            if previous is None or expired(previous.updated, ahead,
+                                           previous.interval):
+                try:
+                    doc, fingerprint = download_page(
+                        db_key, page, ratelimit.BACKGROUND,
+                        previous and previous.fingerprint, deadline)
+                except RateLimited:
+                    # users' requests go first, the page can be updated
+                    # the next time it's requested
+                    stats.incr('refresh.rate_limited')
+                    cache.extend_stale(db_key)
+                    return
+                except CircuitOpen:
+                    # HN is known to be failing, keep serving the old page
+                    stats.incr('refresh.circuit_open')
+                    cache.extend_stale(db_key)
+                    return
+                except NotFound:
+                    # e.g. an expired fnid link
+                    capacity.forget(db_key)
+                    raise
+                except UPSTREAM_ERRORS:
+                    stats.incr('refresh.failed')
+                    cache.extend_stale(db_key)
+                    raise
+                if doc is None:
+                    stats.incr('refresh.html_unchanged')
+                    cache.touch(db_key,
+                                cache.next_interval(previous, previous.etag))
+                    return
+                stats.incr('refresh.parsed')
+                etag = cache.etag(doc)
+                if previous is not None and previous.etag == etag:
+                    stats.incr('refresh.unchanged')
+                else:
+                    stats.incr('refresh.changed')
+                cache.write(db_key, doc,
+                            interval=cache.next_interval(previous, etag),
+                            fingerprint=fingerprint)
+                _prefetch_more(db_key, doc, config.PREFETCH_DEPTH)
     except LockException:
         pass
+    finally:
+        # the page can be queued again, see items._schedule_update
+        rdb.delete(db_key + '/queued')
+
+
+@celery.task
+def prefetch(fnid, depth):
+    """Download the stories page :fnid: before anybody asks for it
+
+    :fnid: the 'more' link of a stories page which was just updated
+    :depth: how many pages to prefetch, following their 'more' links
+
+    Prefetches are background requests, see newhackers.ratelimit, and
+    at most config.PREFETCH_BUDGET are sent per minute. Pages which are
+    already stored or being downloaded are skipped.
+
+    """
+    db_key = '/pages/x?fnid=' + fnid
+    if cache.read(db_key, ['updated']) is not None:
+        stats.incr('prefetch.cached')
+        return
+    if not _take_prefetch_budget():
+        stats.incr('prefetch.over_budget')
+        return
+
+    try:
+        # don't wait for somebody else who is downloading it
+        with redis_lock(rdb, '/lock' + db_key, atime=0):
+            doc = update_page(db_key, 'x?fnid=' + fnid, ratelimit.BACKGROUND,
+                              time.time() + config.TASK_DEADLINE)
+            cache.write(db_key, doc)
+    except (LockException, NotFound):
+        return
+    except UPSTREAM_ERRORS:
+        stats.incr('prefetch.failed')
+        return
+    stats.incr('prefetch.fetched')
+
+    _prefetch_more(db_key, doc, depth - 1)
+
+
+def _prefetch_more(db_key, doc, depth):
+    """Enqueue a prefetch of the 'more' page of a stories page"""
+    if depth <= 0 or not db_key.startswith('/pages/'):
+        return
+    more = json.loads(doc).get('more')
+    if more:
+        prefetch.delay(more, depth)
+
+
+def _take_prefetch_budget():
+    """Count a prefetch, returns False if the minute's budget is spent"""
+    budget_key = '/prefetch/budget/%d' % (time.time() // 60)
+    pipe = rdb.pipeline(True)
+    pipe.incr(budget_key)
+    pipe.expire(budget_key, 60)
+    return pipe.execute()[0] <= config.PREFETCH_BUDGET
+
+
+def _take_refresh_budget():
+    """Return how many pages this run of refresh_popular can update
+
+    Every run gets its share of config.REFRESH_BUDGET. The fraction of a
+    page which is left over is kept for the next run, so that small
+    budgets aren't rounded up or down to whole pages per run.
+
+    """
+    credit = (float(rdb.get('/refresh/credit') or 0) +
+              config.REFRESH_BUDGET * config.REFRESH_INTERVAL / 60.0)
+    rdb.set('/refresh/credit', repr(credit % 1), ex=60)
+    return int(credit)
+
+
+@celery.task
+def refresh_popular():
+    """Update the most popular pages before they get too old
+
+    Run by celery beat every config.REFRESH_INTERVAL seconds, so pages
+    which would get too old before the next run are updated now. At most
+    config.REFRESH_BUDGET pages per minute are updated; the most popular
+    ones go first.
+
+    """
+    popularity.flush()
+    stats.incr('refresh.cold', popularity.decay())
+
+    budget = _take_refresh_budget()
+    for db_key, page in popularity.due(config.REFRESH_INTERVAL):
+        if budget == 0:
+            stats.incr('refresh.over_budget')
+            continue
+        if not rdb.set(db_key + '/queued', 1, nx=True,
+                       ex=config.CACHE_INTERVAL):
+            stats.incr('refresh.already_queued')
+            continue
+        update.delay(db_key, page, config.REFRESH_INTERVAL)
+        stats.incr('refresh.scheduled')
+        budget -= 1
+
+
+@celery.task
+def evict():
+    """Keep the stored pages within their budgets, see capacity.evict
 
- 
+    Run by celery beat every config.EVICT_INTERVAL seconds.
 
- 
+    """
+    capacity.evict()
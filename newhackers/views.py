@@ -15,11 +15,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
 
+from calendar import timegm
 import logging
+import time
 
-from flask import abort, jsonify, request
+from flask import abort, g, jsonify, request
 
-from newhackers import app, auth, items, exceptions, votes
+from newhackers import (app, auth, breaker, capacity, codec, config, items,
+                        exceptions, stats, votes)
 
 
 @app.route("/stories")
@@ -36,23 +39,82 @@ def get_stories(page=None):
         page = ''
 
     try:
-        resp = items.get_stories(page)
+        return _page_response(items.get_stories, page)
     except exceptions.NotFound:
         abort(404)
 
-    return app.response_class(resp, mimetype='application/json')
-
 
 @app.route("/comments/<int:item_id>")
 def get_comments(item_id):
     """Return story with its comments"""
     try:
-        resp = items.get_comments(item_id)
+        return _page_response(items.get_comments, item_id)
     except exceptions.NotFound:
         abort(404)
 
-    return app.response_class(resp, mimetype='application/json')
-    
+
+def _page_response(get_page, page):
+    """Return a JSON response for a cached page
+
+    :get_page: items.get_stories or items.get_comments
+    :page: the argument for :get_page:
+
+    Conditional requests whose ETag or Last-Modified still match get a
+    304 Not Modified, without reading the page's payload at all.
+
+    Pages are stored gzipped, so clients which accept gzip get the stored
+    bytes as they are instead of having them decompressed and then
+    compressed again.
+
+    """
+    if request.if_none_match or request.if_modified_since:
+        entry = get_page(page, fields=('updated', 'etag', 'interval'))
+        if _not_modified(entry):
+            resp = app.response_class(status=304)
+            return _add_page_headers(resp, entry)
+        if entry.payload is None:
+            entry = get_page(page)
+    else:
+        entry = get_page(page)
+
+    body = codec.gzip_body(entry.payload)
+    if body is not None and request.accept_encodings['gzip']:
+        resp = app.response_class(body, mimetype='application/json')
+        resp.headers['Content-Encoding'] = 'gzip'
+    else:
+        resp = app.response_class(codec.decode(entry.payload),
+                                  mimetype='application/json')
+    return _add_page_headers(resp, entry)
+
+
+def _not_modified(entry):
+    """Check if the client's copy of a page is still the current one"""
+    # If-None-Match wins if both are sent
+    if request.if_none_match:
+        return (entry.etag is not None and
+                request.if_none_match.contains_weak(entry.etag))
+    # HTTP dates don't have fractions of a second
+    return (entry.updated is not None and int(entry.updated) <=
+            timegm(request.if_modified_since.utctimetuple()))
+
+
+def _add_page_headers(resp, entry):
+    if entry.etag is not None:
+        # weak, the gzipped and plain bodies share it, see cache.etag
+        resp.set_etag(entry.etag, weak=True)
+    if entry.updated is not None:
+        resp.last_modified = int(entry.updated)
+        age = max(0, int(time.time() - entry.updated))
+        resp.headers['Age'] = str(age)
+        if age >= (entry.interval or config.CACHE_INTERVAL):
+            resp.headers['Warning'] = '110 - "Response is Stale"'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    # whether the page had to be downloaded, see items._get_cache
+    cache_status = getattr(g, 'cache_status', None)
+    if cache_status is not None:
+        resp.headers['X-Cache'] = cache_status
+    return resp
+
 
 @app.route("/get_token", methods=["POST"])
 def get_token():
@@ -93,6 +155,9 @@ def vote():
                              request.form['item'])
     except KeyError:
         abort(401)
+    except exceptions.NotFound:
+        # no such item or an expired vote link
+        abort(404)
     except exceptions.ClientError as e:
         resp = jsonify(error=e.message)
         resp.status_code = 403
@@ -103,3 +168,21 @@ def vote():
         return resp
 
     return jsonify(vote='Success' if success else 'Fail')
+
+
+@app.route("/stats")
+def get_stats():
+    """Return the counters of all the API processes"""
+    return jsonify(stats.get())
+
+
+@app.route("/stats/cache")
+def get_cache_stats():
+    """Return how much of their budgets the stored pages use"""
+    return jsonify(capacity.usage())
+
+
+@app.route("/stats/breaker")
+def get_breaker_stats():
+    """Return the state of the circuit breaker in front of HN"""
+    return jsonify(breaker.state())
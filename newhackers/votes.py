@@ -15,45 +15,95 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
 
-from bs4 import BeautifulSoup
-import requests
+import hashlib
+from HTMLParser import HTMLParser
+import re
 
+from newhackers import config, ratelimit, stats
 from newhackers.backend import hn_get
+from newhackers.config import rdb
 from newhackers.exceptions import ClientError
 
 
+# the start tags of the vote arrows, e.g. <a id="up_123" href="vote?...">;
+# the attributes follow whitespace, so e.g. data-id= doesn't match
+VOTE_TAG = re.compile(
+    r"""<a\s(?:[^>]*\s)?id=["']?((?:up|down)_\w+)[^>]*>""", re.I)
+HREF = re.compile(r"""(?:^|\s)href=(?:"([^"]*)"|'([^']*)'|([^\s>]+))""",
+                  re.I)
+
+_html = HTMLParser()
+
+
 def vote(token, direction, item):
     """Vote for an item
 
     :token: an authentication token which will be sent as a Cookie
     :item: string identifying the item
     :direction: either 'up' or 'down'
+
+    The vote links of the item's page are cached for the user, see
+    _cache_vote_links, so the page isn't downloaded again for voting on
+    the other items on it.
     """
     if direction not in ['up', 'down']:
         raise ClientError("Wrong direction. Must be one of: 'up', 'down'.")
 
-    res = hn_get("item?id=" + item, cookies={'user': token})
-    vote_link = _find_vote_link(res.text, item, direction)
+    link_id = '%s_%s' % (direction, item)
+    vote_link = rdb.hget(_links_key(token), link_id)
+    if vote_link is not None:
+        stats.incr('votes.cached_link')
+    else:
+        stats.incr('votes.page_fetched')
+        res = hn_get("item?id=" + item, cookies={'user': token},
+                     priority=ratelimit.ACCOUNT)
+        links = _vote_links(res.text)
+        _cache_vote_links(token, links)
+        vote_link = links.get(link_id)
 
     if not vote_link:
         raise ClientError("Could not find vote link.")
 
-    res = hn_get(vote_link, cookies={'user': token})
+    try:
+        res = hn_get(vote_link, cookies={'user': token},
+                     priority=ratelimit.ACCOUNT)
+    finally:
+        # there are no arrows for an item after voting on it, and a link
+        # which HN rejected, e.g. an expired one, won't work next time
+        rdb.hdel(_links_key(token), 'up_' + item, 'down_' + item)
     if res.text == '':
         return True
 
 
-def _find_vote_link(page, item, direction):
-    """Return a vote link (HN path) for this item
+def _vote_links(page):
+    """Return a dict of the vote links (HN paths) on a page
 
-    :page: a string of an HN page containing the item
-    :item: string identifying the item
-    :direction: either 'up' or 'down'
+    :page: a string of an HN page
+
+    The keys are the ids of the vote arrows, e.g. 'up_123'. The links
+    are found without parsing the whole page.
 
     """
-    soup = BeautifulSoup(page)
-    elem = soup.find(id='%s_%s' % (direction, item))
-    try:
-        return elem['href']
-    except (KeyError, TypeError):
-        return None
+    links = {}
+    for tag in VOTE_TAG.finditer(page):
+        href = HREF.search(tag.group(0))
+        if href is not None:
+            links[tag.group(1)] = _html.unescape(
+                next(value for value in href.groups() if value is not None))
+    return links
+
+
+def _cache_vote_links(token, links):
+    """Store a user's vote links for config.VOTE_LINKS_TTL seconds"""
+    if not links:
+        return
+    key = _links_key(token)
+    pipe = rdb.pipeline(True)
+    pipe.hmset(key, links)
+    pipe.expire(key, config.VOTE_LINKS_TTL)
+    pipe.execute()
+
+
+def _links_key(token):
+    # don't keep the users' tokens in the key names
+    return '/votes/' + hashlib.sha1(token.encode('utf-8')).hexdigest()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""A local stand-in for HN which serves the HTML fixtures
+
+Every stories page (/news, /ask and /x?fnid=...) is the front page
+fixture and comments pages (/item?id=...) are one of the comments
+fixtures. Logins (/newslogin and /y) succeed for any user unless the
+password is 'wrong', and votes (/vote) always do. Responses can be
+delayed and some of them can fail the ways HN fails.
+
+Run it from the root of the project and point newhackers at it:
+
+    $ PYTHONPATH=. tests/fakehn.py --port 8001 --latency 200 --jitter 50
+    $ NEWHACKERS_HN=http://localhost:8001/ ./server
+
+or start it from Python with FakeHN(...).start().
+
+"""
+import argparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import random
+import socket
+from SocketServer import ThreadingMixIn
+import threading
+import time
+import urlparse
+import uuid
+
+from tests.fixtures import ASK_COMMENTS, COMMENTS_PAGE, FRONT_PAGE, NO_COMMENTS
+
+
+# the items of the comments fixtures, other items get one of them
+ITEMS = {'4705067': COMMENTS_PAGE,
+         '4655144': ASK_COMMENTS,
+         '4706068': NO_COMMENTS}
+
+# the ways HN fails, see backend.hn_get: (status, body)
+ERRORS = {
+    'weird': (200, 'Unexpected weirdness.'),  # a page we don't understand
+    'expired': (200, 'Unknown or expired link.'),
+    'unknown': (200, 'Unknown.'),
+    'unavailable': (503, 'Service Unavailable'),
+}
+
+LOGIN_FORM = ('<html><body><form method="post" action="y">'
+              '<input type="hidden" name="fnid" value="%s">'
+              '<input type="text" name="u"><input type="password" name="p">'
+              '</form></body></html>')
+
+
+def _read(fixture):
+    with open(fixture) as f:
+        return f.read()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    pages = dict((fixture, _read(fixture)) for fixture in
+                 [FRONT_PAGE, COMMENTS_PAGE, ASK_COMMENTS, NO_COMMENTS])
+
+    def setup(self):
+        # or keep-alive responses wait for delayed ACKs
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        if self._failed():
+            return
+
+        if url.path in ('/', '/news', '/ask'):
+            self._send(200, self.pages[FRONT_PAGE])
+        elif url.path == '/x' and 'fnid' in query:
+            self._send(200, self.pages[FRONT_PAGE])
+        elif url.path == '/item':
+            item = query.get('id', [''])[0]
+            if not item.isdigit():
+                self._send(200, 'No such item.')
+                return
+            fixture = ITEMS.get(item) or sorted(ITEMS.values())[
+                int(item) % len(ITEMS)]
+            self._send(200, self.pages[fixture])
+        elif url.path == '/newslogin':
+            self._send(200, LOGIN_FORM % self.server.new_fnid())
+        elif url.path == '/vote':
+            self._send(200, '')
+        else:
+            self._send(200, 'Unknown.')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        form = urlparse.parse_qs(self.rfile.read(length))
+        if self._failed():
+            return
+
+        if self.path != '/y':
+            self._send(200, 'Unknown.')
+        elif not self.server.used_fnid(form.get('fnid', [''])[0]):
+            self._send(200, 'Unknown or expired link.')
+        elif form.get('p', [''])[0] in ('', 'wrong'):
+            # like HN, a failed login is a 200 without the cookie
+            self._send(200, '<html>Bad login.</html>')
+        else:
+            cookie = 'user=%s&%s' % (form['u'][0], uuid.uuid4().hex)
+            self._send(200, '<html>Logged in.</html>',
+                       [('Set-Cookie', cookie)])
+
+    def _failed(self):
+        """Wait like HN would and maybe fail, returns True if it failed"""
+        self.server.wait()
+        error = self.server.pick_error()
+        if error is None:
+            return False
+        status, body = ERRORS[error]
+        self._send(status, body)
+        return True
+
+    def _send(self, status, body, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeHN(ThreadingMixIn, HTTPServer):
+    """The fake HN server
+
+    :latency: seconds every response is delayed by
+    :jitter: up to this many seconds are added to or taken from latency
+    :error_rate: the fraction of the requests which fail
+    :errors: the names of the ERRORS failed requests pick from
+
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0, jitter=0,
+                 error_rate=0, errors=('weird', 'unavailable')):
+        HTTPServer.__init__(self, address, Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.errors = list(errors)
+        self._fnids = set()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        """The root URL of the server, which config.HN can be set to"""
+        return 'http://%s:%d/' % self.server_address
+
+    def start(self):
+        """Serve requests in a background thread and return the URL"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def wait(self):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def pick_error(self):
+        """Return the name of the error to answer with or None"""
+        if self.errors and random.random() < self.error_rate:
+            return random.choice(self.errors)
+        return None
+
+    def new_fnid(self):
+        fnid = uuid.uuid4().hex[:10]
+        with self._lock:
+            self._fnids.add(fnid)
+        return fnid
+
+    def used_fnid(self, fnid):
+        """Return True if :fnid: is a login form's, which can be used once"""
+        with self._lock:
+            if fnid in self._fnids:
+                self._fnids.remove(fnid)
+                return True
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0,
+                        help="milliseconds every response is delayed by")
+    parser.add_argument('--jitter', type=float, default=0,
+                        help="up to this many milliseconds are added to or "
+                        "taken from the latency")
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help="the fraction of requests which fail")
+    parser.add_argument('--error', action='append', choices=sorted(ERRORS),
+                        help="how requests fail (default: weird and "
+                        "unavailable)")
+    args = parser.parse_args()
+
+    server = FakeHN((args.host, args.port), args.latency / 1000.0,
+                    args.jitter / 1000.0, args.error_rate,
+                    args.error or ('weird', 'unavailable'))
+    print "Serving a fake HN on " + server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
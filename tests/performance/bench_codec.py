@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""Compare the size and speed of the cache formats over the fixtures
+
+Run it from the root of the project:
+
+    $ PYTHONPATH=. tests/performance/bench_codec.py
+
+"""
+import json
+import logging
+from timeit import default_timer
+import warnings
+
+from newhackers import codec, parsers
+from tests.fixtures import ASK_COMMENTS, COMMENTS_PAGE, FRONT_PAGE, NO_COMMENTS
+
+
+FIXTURES = [(FRONT_PAGE, parsers.parse_stories),
+            (COMMENTS_PAGE, parsers.parse_comments),
+            (ASK_COMMENTS, parsers.parse_comments),
+            (NO_COMMENTS, parsers.parse_comments)]
+ITERATIONS = 200
+
+
+def timed(func, arg):
+    """Return the average seconds it takes to call func(arg)"""
+    start = default_timer()
+    for i in xrange(ITERATIONS):
+        func(arg)
+    return (default_timer() - start) / ITERATIONS
+
+
+def main():
+    warnings.simplefilter('ignore')
+    logging.disable(logging.CRITICAL)
+
+    print "%-20s %10s %10s %7s %10s %10s" % (
+        'fixture', 'JSON B', 'stored B', 'ratio', 'encode us', 'decode us')
+    for fixture, parse in FIXTURES:
+        with open(fixture) as f:
+            doc = json.dumps(parse(f.read()))
+        value = codec.encode(doc)
+        print "%-20s %10d %10d %7.2f %10.1f %10.1f" % (
+            fixture.replace('tests/fixtures/', ''), len(doc), len(value),
+            float(len(value)) / len(doc),
+            timed(codec.encode, doc) * 10 ** 6,
+            timed(codec.decode, value) * 10 ** 6)
+
+
+if __name__ == '__main__':
+    main()
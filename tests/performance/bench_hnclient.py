@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Compare fetching pages with new connections and with the HN client
+
+A local stand-in for HN serves the front page fixture over keep-alive
+HTTP/1.1. It can add a delay to every new connection, like the TCP and
+TLS handshakes with the real HN would.
+
+Run it from the root of the project:
+
+    $ PYTHONPATH=. tests/performance/bench_hnclient.py --connect-delay 50
+
+"""
+import argparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import logging
+import socket
+from SocketServer import ThreadingMixIn
+import threading
+from timeit import default_timer
+import time
+
+import mock
+import requests
+
+from benchutils import percentile
+from newhackers import config, hnclient, ratelimit, stats
+from tests.fixtures import FRONT_PAGE
+from tests.utils import rdb
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connect_delay = 0
+    with open(FRONT_PAGE) as f:
+        page = f.read()
+
+    def setup(self):
+        time.sleep(self.connect_delay)
+        # or keep-alive responses wait for delayed ACKs
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.page)))
+        self.end_headers()
+        self.wfile.write(self.page)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def bench(get, url, iterations):
+    timings = []
+    for i in xrange(iterations):
+        start = default_timer()
+        get(url).content
+        timings.append(default_timer() - start)
+    timings.sort()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    parser.add_argument('--connect-delay', type=float, default=0,
+                        help="milliseconds added to every new connection")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    Handler.connect_delay = args.connect_delay / 1000.0
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%d/news' % server.server_port
+    config.HN = url
+    # keep the connection counters out of the real database
+    stats.rdb = rdb
+
+    print "%-20s %9s %9s %9s %10s" % (
+        'client', 'p50 ms', 'p90 ms', 'p99 ms', 'fetches/s')
+    # measure the connections, not waiting for the rate limit's tokens
+    with mock.patch.object(ratelimit, 'acquire'):
+        for name, get in [('new connections', requests.get),
+                          ('hnclient', hnclient.get)]:
+            timings = bench(get, url, args.iterations)
+            print "%-20s %9.2f %9.2f %9.2f %10.1f" % (
+                name, percentile(timings, 50) * 1000,
+                percentile(timings, 90) * 1000,
+                percentile(timings, 99) * 1000, len(timings) / sum(timings))
+
+    hnclient._get_session().close()
+    server.shutdown()
+    rdb.flushdb()
+
+
+if __name__ == '__main__':
+    main()
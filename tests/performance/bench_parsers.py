@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""Benchmark the HN parsers over the HTML fixtures
+
+Every fixture is parsed with every parser engine and the per-call
+latency percentiles, throughput and allocation peak are reported.
+
+Run it from the root of the project:
+
+    $ PYTHONPATH=. tests/performance/bench_parsers.py
+    $ PYTHONPATH=. tests/performance/bench_parsers.py --save baseline.json
+    $ PYTHONPATH=. tests/performance/bench_parsers.py --check baseline.json
+
+--check exits with an error if any fixture got slower (or allocates
+more) than the baseline by more than the tolerance.
+
+"""
+import argparse
+import json
+import logging
+import sys
+from timeit import default_timer
+import warnings
+
+try:
+    import tracemalloc
+except ImportError:
+    # only available on Python 3.4+ or with pytracemalloc
+    tracemalloc = None
+
+from benchutils import percentile
+from newhackers import parsers
+from tests.fixtures import ASK_COMMENTS, COMMENTS_PAGE, FRONT_PAGE, NO_COMMENTS
+
+
+FIXTURES = [(FRONT_PAGE, parsers.parse_stories),
+            (COMMENTS_PAGE, parsers.parse_comments),
+            (ASK_COMMENTS, parsers.parse_comments),
+            (NO_COMMENTS, parsers.parse_comments)]
+ENGINES = ['stream', 'soup']
+
+
+def peak_memory(parse, page, engine):
+    """Return the peak number of bytes allocated while parsing"""
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        parse(page, engine=engine)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench(parse, page, engine, iterations):
+    """Parse :page: :iterations: times and return its stats dict"""
+    # warm up caches and imports
+    parse(page, engine=engine)
+
+    timings = []
+    for i in xrange(iterations):
+        start = default_timer()
+        parse(page, engine=engine)
+        timings.append(default_timer() - start)
+    timings.sort()
+
+    total = sum(timings)
+    return {'p50': percentile(timings, 50),
+            'p90': percentile(timings, 90),
+            'p99': percentile(timings, 99),
+            'max': timings[-1],
+            'calls_per_sec': iterations / total,
+            'mb_per_sec': len(page) * iterations / total / 2 ** 20,
+            'peak_bytes': peak_memory(parse, page, engine)}
+
+
+def run(iterations, engines):
+    results = {}
+    for fixture, parse in FIXTURES:
+        with open(fixture) as f:
+            page = f.read()
+        for engine in engines:
+            results['%s %s' % (fixture, engine)] = bench(
+                parse, page, engine, iterations)
+    return results
+
+
+def report(results):
+    print "%-40s %9s %9s %9s %9s %10s %12s" % (
+        'fixture/engine', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms',
+        'calls/s', 'peak KB')
+    for name in sorted(results):
+        stats = results[name]
+        peak = stats['peak_bytes']
+        print "%-40s %9.2f %9.2f %9.2f %9.2f %10.1f %12s" % (
+            name.replace('tests/fixtures/', ''),
+            stats['p50'] * 1000, stats['p90'] * 1000, stats['p99'] * 1000,
+            stats['max'] * 1000, stats['calls_per_sec'],
+            '-' if peak is None else '%.1f' % (peak / 1024.0))
+
+
+def check(results, baseline, tolerance):
+    """Return a list of regressions against the :baseline: results"""
+    regressions = []
+    for name, stats in sorted(results.items()):
+        try:
+            base = baseline[name]
+        except KeyError:
+            continue
+        # the median is the least noisy of the latencies
+        for key in ['p50', 'peak_bytes']:
+            if stats[key] is None or base.get(key) is None:
+                continue
+            if stats[key] > base[key] * (1 + tolerance):
+                regressions.append("%s %s: %s > %s" % (
+                    name, key, stats[key], base[key]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, default=50)
+    parser.add_argument('-e', '--engine', action='append', choices=ENGINES,
+                        help="benchmark only this engine")
+    parser.add_argument('--save', metavar='FILE',
+                        help="save the results as a baseline")
+    parser.add_argument('--check', metavar='FILE',
+                        help="fail if slower than this baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed slowdown against the baseline "
+                        "(default: %(default)s)")
+    args = parser.parse_args()
+
+    # bs4 warns about guessing the parser and chardet is very chatty
+    warnings.simplefilter('ignore')
+    logging.disable(logging.CRITICAL)
+
+    results = run(args.iterations, args.engine or ENGINES)
+    report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print "Saved baseline to " + args.save
+
+    if args.check:
+        with open(args.check) as f:
+            regressions = check(results, json.load(f), args.tolerance)
+        if regressions:
+            print "Regressions:"
+            print "\n".join(regressions)
+            sys.exit(1)
+        print "No regressions against " + args.check
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+"""Helpers shared by the benchmarks in this directory
+
+The benchmarks are run as scripts, so this module is imported by its
+name from their directory.
+
+"""
+
+
+def percentile(timings, percent):
+    """Return the :percent: percentile of a sorted list of timings"""
+    index = int(round(percent / 100.0 * (len(timings) - 1)))
+    return timings[index]
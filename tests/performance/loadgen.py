@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+"""Load test a running newhackers server with a mix of API requests
+
+The requests are picked at random from a weighted mix of endpoints, e.g.
+--mix stories=5,comments=4,ask=1. Latencies are recorded in histograms
+per endpoint, and page requests are also split into cache hits and
+misses by their X-Cache header.
+
+In the closed-loop mode (the default) --concurrency clients send a new
+request as soon as they get a response. In the open-loop mode requests
+arrive at a fixed --rate whether or not the server keeps up, and their
+latency counts from when they should have been sent, so a slow server
+isn't hidden by sending it fewer requests.
+
+Run it from the root of the project, e.g. against a server using the
+fake HN from tests/fakehn.py:
+
+    $ PYTHONPATH=. tests/performance/loadgen.py --duration 30 --save v1.json
+    $ PYTHONPATH=. tests/performance/loadgen.py --mode open --rate 200 \\
+          --mix stories=3,comments=1 --compare v1.json
+
+"""
+import argparse
+from collections import defaultdict
+import json
+import Queue
+import random
+import sys
+import threading
+import time
+from timeit import default_timer
+
+import requests
+
+
+# name: (method, path), paths are formatted with the --pages/--items
+ENDPOINTS = {
+    'stories': ('GET', 'stories'),
+    'stories_page': ('GET', 'stories/{page}'),
+    'ask': ('GET', 'ask'),
+    'comments': ('GET', 'comments/{item}'),
+    'vote': ('POST', 'vote'),
+    'get_token': ('POST', 'get_token'),
+}
+DEFAULT_MIX = ('stories=30,stories_page=10,ask=15,comments=40,vote=3,'
+               'get_token=2')
+# the 'more' page of the front page fixture and the items of the
+# comments fixtures, see tests/fakehn.py
+DEFAULT_PAGES = ['4AVKeJz9TP']
+DEFAULT_ITEMS = ['4705067', '4655144', '4706068']
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+class Histogram(object):
+    """Latencies in log-linear buckets, like an HDR histogram
+
+    Values are counted in buckets which are never wider than 1/2 **
+    :precision_bits: of the values in them, so percentiles are that
+    precise no matter how long the tail is, in constant memory.
+
+    """
+    def __init__(self, precision_bits=7):
+        self.precision_bits = precision_bits
+        self.counts = defaultdict(int)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds):
+        value = int(seconds * 1e6)  # microseconds
+        self.counts[self._bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for bucket, count in other.counts.iteritems():
+            self.counts[bucket] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Return the :percent: percentile in seconds"""
+        if not self.count:
+            return None
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self._highest(bucket), self.max) / 1e6
+        return self.max / 1e6
+
+    def summary(self):
+        """Return a dict of the percentiles, mean and max in milliseconds"""
+        summary = {'count': self.count}
+        if self.count:
+            for percent in PERCENTILES:
+                summary['p%s' % percent] = self.percentile(percent) * 1000
+            summary['mean'] = self.total / 1000.0 / self.count
+            summary['max'] = self.max / 1000.0
+        return summary
+
+    def _bucket(self, value):
+        shift = max(0, value.bit_length() - self.precision_bits)
+        return shift, value >> shift
+
+    def _highest(self, bucket):
+        shift, index = bucket
+        return ((index + 1) << shift) - 1
+
+
+class Results(object):
+    """The histograms and errors of a thread, merged in the end"""
+    def __init__(self):
+        self.latencies = defaultdict(Histogram)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, name, seconds, status, cache=None):
+        """:cache: the response's X-Cache header, 'HIT' or 'MISS'"""
+        self.latencies[name].record(seconds)
+        self.statuses[name][str(status)] += 1
+        if cache is not None:
+            self.latencies['%s.%s' % (name, cache.lower())].record(seconds)
+
+    def merge(self, other):
+        for name, histogram in other.latencies.iteritems():
+            self.latencies[name].merge(histogram)
+        for name, statuses in other.statuses.iteritems():
+            for status, count in statuses.iteritems():
+                self.statuses[name][status] += count
+
+
+class Client(object):
+    """Sends the requests of one thread over a keep-alive session"""
+    def __init__(self, args, token):
+        self.args = args
+        self.token = token
+        self.session = requests.Session()
+        self.results = Results()
+
+    def send(self, name, started=None):
+        """Send a request to endpoint :name: and record its latency
+
+        :started: when the request should have been sent, for counting
+        the time it waited for a free client too
+
+        """
+        method, path = ENDPOINTS[name]
+        url = self.args.url + path.format(
+            page=random.choice(self.args.pages),
+            item=random.choice(self.args.items))
+        data = None
+        if name == 'get_token':
+            data = {'user': self.args.user, 'password': self.args.password}
+        elif name == 'vote':
+            data = {'token': self.token, 'direction': 'up',
+                    'item': self.args.vote_item}
+
+        if started is None:
+            started = default_timer()
+        try:
+            res = self.session.request(method, url, data=data,
+                                       timeout=self.args.timeout)
+            res.content
+        except requests.RequestException as e:
+            status, cache = type(e).__name__, None
+        else:
+            status = res.status_code
+            cache = res.headers.get('X-Cache')
+        self.results.record(name, default_timer() - started, status, cache)
+
+
+def parse_mix(mix):
+    """Return the endpoints and their weights out of 'name=weight,...'"""
+    names, weights = [], []
+    for part in mix.split(','):
+        name, weight = part.split('=')
+        if name not in ENDPOINTS:
+            raise ValueError("Unknown endpoint %r." % name)
+        names.append(name)
+        weights.append(float(weight))
+    return names, weights
+
+
+def pick(names, weights):
+    point = random.uniform(0, sum(weights))
+    for name, weight in zip(names, weights):
+        point -= weight
+        if point <= 0:
+            return name
+    return names[-1]
+
+
+def get_token(args):
+    """Log in once for the votes, returns None if it failed"""
+    try:
+        res = requests.post(args.url + 'get_token', timeout=args.timeout,
+                            data={'user': args.user,
+                                  'password': args.password})
+        return res.json()['token']
+    except (requests.RequestException, ValueError, KeyError):
+        return None
+
+
+def closed_loop(args, clients, names, weights):
+    """Every client sends its next request when it got a response"""
+    end = default_timer() + args.duration
+
+    def run(client):
+        while default_timer() < end:
+            client.send(pick(names, weights))
+
+    _run_threads(run, clients)
+
+
+def open_loop(args, clients, names, weights):
+    """Requests arrive at args.rate per second, whatever the latency"""
+    arrivals = Queue.Queue()
+
+    def run(client):
+        while True:
+            arrival = arrivals.get()
+            if arrival is None:
+                return
+            name, scheduled = arrival
+            client.send(name, scheduled)
+
+    threads = _start_threads(run, clients)
+    start = default_timer()
+    for i in xrange(int(args.duration * args.rate)):
+        scheduled = start + i / args.rate
+        while default_timer() < scheduled:
+            time.sleep(scheduled - default_timer())
+        arrivals.put((pick(names, weights), scheduled))
+    for thread in threads:
+        arrivals.put(None)
+    for thread in threads:
+        thread.join()
+
+
+def _start_threads(target, clients):
+    threads = [threading.Thread(target=target, args=(client,))
+               for client in clients]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    return threads
+
+
+def _run_threads(target, clients):
+    for thread in _start_threads(target, clients):
+        thread.join()
+
+
+def report(args, results, elapsed):
+    """Return the machine-readable report of a run"""
+    endpoints = {}
+    for name, histogram in results.latencies.iteritems():
+        endpoints[name] = histogram.summary()
+        statuses = results.statuses.get(name)
+        if statuses:
+            endpoints[name]['statuses'] = dict(statuses)
+            endpoints[name]['errors'] = sum(
+                count for status, count in statuses.iteritems()
+                if not status.startswith('2'))
+
+    total = Histogram()
+    for name in results.statuses:
+        total.merge(results.latencies[name])
+    endpoints['total'] = total.summary()
+    endpoints['total']['errors'] = sum(
+        endpoints[name]['errors'] for name in results.statuses)
+
+    return {'settings': {'url': args.url, 'mode': args.mode, 'mix': args.mix,
+                         'concurrency': args.concurrency, 'rate': args.rate,
+                         'duration': args.duration},
+            'elapsed': elapsed,
+            'throughput': total.count / elapsed,
+            'endpoints': endpoints}
+
+
+def print_report(data):
+    print "%-22s %8s %7s %9s %9s %9s %9s %9s" % (
+        'endpoint', 'requests', 'errors', 'p50 ms', 'p90 ms', 'p99 ms',
+        'p99.9 ms', 'max ms')
+    for name, summary in sorted(data['endpoints'].items()):
+        if not summary['count']:
+            continue
+        print "%-22s %8d %7s %9.2f %9.2f %9.2f %9.2f %9.2f" % (
+            name, summary['count'], summary.get('errors', '-'),
+            summary['p50'], summary['p90'], summary['p99'],
+            summary['p99.9'], summary['max'])
+    print "Throughput: %.1f requests/s" % data['throughput']
+
+
+def compare(data, baseline):
+    """Print how the latencies changed since the :baseline: report"""
+    print "%-22s %10s %10s %10s" % ('change since baseline', 'p50', 'p99',
+                                    'p99.9')
+    for name, summary in sorted(data['endpoints'].items()):
+        base = baseline['endpoints'].get(name)
+        if not base or not base['count'] or not summary['count']:
+            continue
+        changes = []
+        for key in ['p50', 'p99', 'p99.9']:
+            changes.append('%+9.1f%%' % (
+                (summary[key] - base[key]) / base[key] * 100
+                if base[key] else 0))
+        print "%-22s %10s %10s %10s" % tuple([name] + changes)
+    print "Throughput: %+.1f%%" % (
+        (data['throughput'] - baseline['throughput']) /
+        baseline['throughput'] * 100)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default='http://localhost:5000/')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help="endpoint=weight,... out of %s (default: "
+                        "%%(default)s)" % ', '.join(sorted(ENDPOINTS)))
+    parser.add_argument('--mode', choices=['closed', 'open'],
+                        default='closed')
+    parser.add_argument('-c', '--concurrency', type=int, default=10,
+                        help="clients sending requests at the same time")
+    parser.add_argument('-r', '--rate', type=float, default=50,
+                        help="requests per second in the open-loop mode")
+    parser.add_argument('-d', '--duration', type=float, default=10,
+                        help="seconds")
+    parser.add_argument('--timeout', type=float, default=30,
+                        help="seconds to wait for a response")
+    parser.add_argument('--pages', type=lambda s: s.split(','),
+                        default=DEFAULT_PAGES,
+                        help="the stories pages' ids for stories_page")
+    parser.add_argument('--items', type=lambda s: s.split(','),
+                        default=DEFAULT_ITEMS,
+                        help="the item ids for comments, new ones are "
+                        "cache misses")
+    parser.add_argument('--user', default='loadgen')
+    parser.add_argument('--password', default='loadgen')
+    parser.add_argument('--vote-item', default=DEFAULT_ITEMS[0])
+    parser.add_argument('--save', metavar='FILE',
+                        help="save the report as JSON")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="compare with a report saved before")
+    args = parser.parse_args()
+    if not args.url.endswith('/'):
+        args.url += '/'
+
+    try:
+        names, weights = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    token = get_token(args) if 'vote' in names else None
+    clients = [Client(args, token) for i in xrange(args.concurrency)]
+    start = default_timer()
+    if args.mode == 'open':
+        open_loop(args, clients, names, weights)
+    else:
+        closed_loop(args, clients, names, weights)
+    elapsed = default_timer() - start
+
+    results = Results()
+    for client in clients:
+        results.merge(client.results)
+    data = report(args, results, elapsed)
+    print_report(data)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        print "Saved the report to " + args.save
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(data, json.load(f))
+
+    if not data['endpoints']['total']['count']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
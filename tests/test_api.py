@@ -15,16 +15,28 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
 
+from gzip import GzipFile
+from StringIO import StringIO
+import time
 import unittest
 
-from flask import json
+from flask import g, json
 import mock
 from werkzeug.exceptions import NotFound
 
-from newhackers import app, auth, backend, exceptions, items, votes
+from newhackers import (app, auth, backend, breaker, cache, capacity, codec,
+                        exceptions, items, stats, votes)
 from tests.fixtures import COMMENTS_JSON, ITEM_ID, PAGE_ID, STORIES_JSON
 
 
+UPDATED = 1356998400.5  # Tue, 01 Jan 2013 00:00:00 GMT
+
+
+def page_entry(payload):
+    return cache.Entry(payload, UPDATED, 'etag1', cache.VERSION, 60, None,
+                       None)
+
+
 class JSONApiTest(unittest.TestCase):
     def setUp(self):
         self.app = app.test_client()
@@ -40,16 +52,69 @@ class JSONApiTest(unittest.TestCase):
 
     def test_stories_default(self):
         with mock.patch.object(items, "get_stories",
-                               return_value=STORIES_JSON) as get_stories:
+                               return_value=page_entry(STORIES_JSON)
+                               ) as get_stories:
             response = self.app.get('/stories/')
             get_stories.assert_called_with('')
             self.assertEqual(response.status_code, 200)
             self.assertEqual(response.content_type, 'application/json')
             self.assertEqual(response.data, STORIES_JSON)
 
+    def test_stories_encoded(self):
+        with mock.patch.object(items, "get_stories",
+                               return_value=page_entry(
+                                   codec.encode(STORIES_JSON))):
+            response = self.app.get('/stories/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, STORIES_JSON)
+
+    def test_stories_gzip(self):
+        with mock.patch.object(items, "get_stories",
+                               return_value=page_entry(
+                                   codec.encode(STORIES_JSON))):
+            response = self.app.get('/stories/',
+                                    headers=[('Accept-Encoding', 'gzip')])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content_type, 'application/json')
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+            self.assertEqual(
+                GzipFile(fileobj=StringIO(response.data)).read(),
+                STORIES_JSON)
+
+    def test_stories_gzip_not_accepted(self):
+        with mock.patch.object(items, "get_stories",
+                               return_value=page_entry(
+                                   codec.encode(STORIES_JSON))):
+            response = self.app.get(
+                '/stories/', headers=[('Accept-Encoding', 'gzip;q=0')])
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertEqual(response.data, STORIES_JSON)
+
+    def test_stories_gzip_plain_stored(self):
+        with mock.patch.object(items, "get_stories",
+                               return_value=page_entry(STORIES_JSON)):
+            response = self.app.get('/stories/',
+                                    headers=[('Accept-Encoding', 'gzip')])
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertEqual(response.data, STORIES_JSON)
+
+    def test_comments_gzip(self):
+        with mock.patch.object(items, "get_comments",
+                               return_value=page_entry(
+                                   codec.encode(COMMENTS_JSON))):
+            response = self.app.get('/comments/' + str(ITEM_ID),
+                                    headers=[('Accept-Encoding',
+                                              'deflate, gzip')])
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(
+                GzipFile(fileobj=StringIO(response.data)).read(),
+                COMMENTS_JSON)
+
     def test_ask_default(self):
         with mock.patch.object(items, "get_stories",
-                               return_value=STORIES_JSON) as get_stories:
+                               return_value=page_entry(STORIES_JSON)
+                               ) as get_stories:
             response = self.app.get('/ask/')
             get_stories.assert_called_with('ask')
             self.assertEqual(response.status_code, 200)
@@ -58,13 +123,104 @@ class JSONApiTest(unittest.TestCase):
 
     def test_stories_specific(self):
         with mock.patch.object(items, "get_stories",
-                               return_value=STORIES_JSON) as get_stories:
+                               return_value=page_entry(STORIES_JSON)
+                               ) as get_stories:
             response = self.app.get('/stories/' + PAGE_ID)
             get_stories.assert_called_with(PAGE_ID)
             self.assertEqual(response.status_code, 200)
             self.assertEqual(response.content_type, 'application/json')
             self.assertEqual(response.data, STORIES_JSON)
 
+    def test_stories_etag(self):
+        with mock.patch.object(items, "get_stories",
+                               return_value=page_entry(STORIES_JSON)):
+            response = self.app.get('/stories/')
+            self.assertEqual(response.headers['ETag'], 'W/"etag1"')
+            self.assertEqual(response.headers['Last-Modified'],
+                             'Tue, 01 Jan 2013 00:00:00 GMT')
+
+    def test_stories_age(self):
+        entry = page_entry(STORIES_JSON)._replace(updated=time.time() - 10)
+        with mock.patch.object(items, "get_stories", return_value=entry):
+            response = self.app.get('/stories/')
+            self.assertAlmostEqual(int(response.headers['Age']), 10, delta=1)
+            self.assertNotIn('Warning', response.headers)
+
+    def test_stories_stale(self):
+        entry = page_entry(STORIES_JSON)._replace(updated=time.time() - 70)
+        with mock.patch.object(items, "get_stories", return_value=entry):
+            response = self.app.get('/stories/')
+            self.assertEqual(response.headers['Warning'],
+                             '110 - "Response is Stale"')
+
+    def test_stories_cache_status(self):
+        def get_stories(page):
+            g.cache_status = 'MISS'
+            return page_entry(STORIES_JSON)
+
+        with mock.patch.object(items, "get_stories", get_stories):
+            response = self.app.get('/stories/')
+            self.assertEqual(response.headers['X-Cache'], 'MISS')
+
+    def test_stories_if_none_match(self):
+        with mock.patch.object(items, "get_stories",
+                               return_value=page_entry(None)
+                               ) as get_stories:
+            response = self.app.get('/stories/',
+                                    headers=[('If-None-Match', '"etag1"')])
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, '')
+            self.assertEqual(response.headers['ETag'], 'W/"etag1"')
+            # the payload wasn't read
+            get_stories.assert_called_once_with(
+                '', fields=('updated', 'etag', 'interval'))
+
+    def test_stories_if_none_match_weak(self):
+        with mock.patch.object(items, "get_stories",
+                               return_value=page_entry(None)):
+            response = self.app.get('/stories/',
+                                    headers=[('If-None-Match', 'W/"etag1"')])
+            self.assertEqual(response.status_code, 304)
+
+    def test_stories_if_none_match_changed(self):
+        with mock.patch.object(items, "get_stories",
+                               side_effect=[page_entry(None),
+                                            page_entry(STORIES_JSON)]
+                               ) as get_stories:
+            response = self.app.get('/stories/',
+                                    headers=[('If-None-Match', '"etag0"')])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, STORIES_JSON)
+            get_stories.assert_called_with('')
+
+    def test_stories_if_modified_since(self):
+        with mock.patch.object(items, "get_stories",
+                               return_value=page_entry(None)):
+            response = self.app.get(
+                '/stories/',
+                headers=[('If-Modified-Since',
+                          'Tue, 01 Jan 2013 00:00:00 GMT')])
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers['ETag'], 'W/"etag1"')
+
+    def test_stories_modified_since(self):
+        with mock.patch.object(items, "get_stories",
+                               side_effect=[page_entry(None),
+                                            page_entry(STORIES_JSON)]):
+            response = self.app.get(
+                '/stories/',
+                headers=[('If-Modified-Since',
+                          'Mon, 31 Dec 2012 23:59:59 GMT')])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, STORIES_JSON)
+
+    def test_comments_if_none_match(self):
+        with mock.patch.object(items, "get_comments",
+                               return_value=page_entry(None)):
+            response = self.app.get('/comments/' + str(ITEM_ID),
+                                    headers=[('If-None-Match', '"etag1"')])
+            self.assertEqual(response.status_code, 304)
+
     def test_stories_404(self):
         with mock.patch.object(items, "get_stories",
                                side_effect=exceptions.NotFound
@@ -76,7 +232,8 @@ class JSONApiTest(unittest.TestCase):
 
     def test_comments(self):
         with mock.patch.object(items, "get_comments",
-                               return_value=COMMENTS_JSON) as get_comments:
+                               return_value=page_entry(COMMENTS_JSON)
+                               ) as get_comments:
             response = self.app.get('/comments/' + str(ITEM_ID))
             get_comments.assert_called_with(ITEM_ID)
             self.assertEqual(response.status_code, 200)
@@ -147,3 +304,33 @@ class JSONApiTest(unittest.TestCase):
             self.assertEqual(response.status_code, 200)
             self.assertEqual(json.loads(response.data),
                              {'vote': 'Fail'})
+
+    def test_vote_not_found(self):
+        with mock.patch.object(votes, "vote",
+                               side_effect=exceptions.NotFound('expired')):
+            response = self.app.post('/vote',
+                                     data={'token': 'token1',
+                                           'direction': 'up',
+                                           'item': '12345'})
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.content_type, 'application/json')
+
+    def test_cache_stats(self):
+        usage = {'/pages/': {'bytes': 1, 'pages': 1, 'budget': 2}}
+        with mock.patch.object(capacity, "usage", return_value=usage):
+            response = self.app.get('/stats/cache')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data), usage)
+
+    def test_breaker_stats(self):
+        state = {'state': 'open', 'failures': 0, 'since': 1000.0}
+        with mock.patch.object(breaker, "state", return_value=state):
+            response = self.app.get('/stats/breaker')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data), state)
+
+    def test_stats(self):
+        with mock.patch.object(stats, "get", return_value={'foo': 1}):
+            response = self.app.get('/stats')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data), {'foo': 1})
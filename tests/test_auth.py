@@ -20,7 +20,7 @@ import unittest
 import mock
 import redis
 
-from newhackers import auth, config
+from newhackers import auth, config, ratelimit
 
 
 class TokenTest(unittest.TestCase):
@@ -31,14 +31,16 @@ class TokenTest(unittest.TestCase):
         mock_post = mock.Mock(return_value=mock.Mock(
                 cookies={'user': 'user_token'}))
 
-        with mock.patch.object(auth.requests, "get", mock_get) as get:
-            with mock.patch.object(auth.requests, "post", mock_post) as post:
+        with mock.patch.object(auth.hnclient, "get", mock_get) as get:
+            with mock.patch.object(auth.hnclient, "post", mock_post) as post:
                 tok = auth.get_token("test_user", "test_pass")
-                get.assert_called_with(config.HN_LOGIN)
+                get.assert_called_with(config.HN_LOGIN,
+                                       priority=ratelimit.ACCOUNT)
                 post.assert_called_with(config.HN_LOGIN_POST,
                                         data={'u': "test_user",
                                               'p': "test_pass",
-                                              'fnid': "foo42"})
+                                              'fnid': "foo42"},
+                                        priority=ratelimit.ACCOUNT)
                 self.assertEqual(tok, "user_token")
 
     def test_token_failed_get(self):
@@ -46,7 +48,7 @@ class TokenTest(unittest.TestCase):
                 content='blueberries'))
 
         with mock.patch.object(auth.logging, "error") as log_error:
-            with mock.patch.object(auth.requests, "get", mock_get) as get:
+            with mock.patch.object(auth.hnclient, "get", mock_get) as get:
                 self.assertRaises(auth.ServerError,
                                   auth.get_token, "test_user", "test_pass")
                 self.assertIn("Failed parsing response",
@@ -59,8 +61,8 @@ class TokenTest(unittest.TestCase):
                 content='<input name="fnid" value="%s">foobar</input>' % FNID))
         mock_post = mock.Mock(return_value=mock.Mock(cookies={}))
 
-        with mock.patch.object(auth.requests, "get", mock_get) as get:
-            with mock.patch.object(auth.requests, "post", mock_post) as post:
+        with mock.patch.object(auth.hnclient, "get", mock_get) as get:
+            with mock.patch.object(auth.hnclient, "post", mock_post) as post:
                 with self.assertRaisesRegexp(auth.ClientError,
                                              ".*Bad user/password.*") as exc:
                     auth.get_token("bad_user", "bad_pass")
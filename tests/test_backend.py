@@ -15,60 +15,83 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
 
+import json
+import time
 import unittest
 
 import mock
 
-from newhackers import backend, config
-from newhackers.exceptions import ClientError
-from tests.fixtures import COMMENTS, COMMENTS_JSON, STORIES, STORIES_JSON
+from newhackers import backend, breaker, cache, config, ratelimit, stats
+from newhackers.exceptions import (CircuitOpen, ClientError, LocalLimit,
+                                   NotFound, RateLimited)
+from tests.fixtures import (COMMENTS, COMMENTS_JSON, FRONT_PAGE, STORIES,
+                            STORIES_JSON)
 from tests.utils import seconds_old, rdb
 
 
 class BackendTest(unittest.TestCase):
     def setUp(self):
         backend.rdb = rdb
+        cache.rdb = rdb
+        breaker.rdb = rdb
+        stats.rdb = rdb
 
     def tearDown(self):
         rdb.flushdb()
 
     def test_time_too_old(self):
         with mock.patch.object(config, 'CACHE_INTERVAL', 30):
-            rdb.set("my-item/updated", seconds_old(30))
+            rdb.hset("my-item", "updated", seconds_old(30))
             self.assertTrue(backend.too_old("my-item"))
 
+            rdb.hset("my-item", "updated", seconds_old(29))
+            self.assertFalse(backend.too_old("my-item"))
+
+    def test_time_too_old_old_format(self):
+        with mock.patch.object(config, 'CACHE_INTERVAL', 30):
+            rdb.set("my-item", STORIES_JSON)
             rdb.set("my-item/updated", seconds_old(29))
             self.assertFalse(backend.too_old("my-item"))
 
+    def test_time_too_old_interval(self):
+        rdb.hmset('my-item', {'updated': seconds_old(100), 'interval': 120})
+        with mock.patch.object(config, 'CACHE_INTERVAL', 30):
+            self.assertFalse(backend.too_old('my-item'))
+            self.assertTrue(backend.too_old('my-item', ahead=30))
+
     def test_time_too_old_key_doesnt_exist(self):
         self.assertTrue(backend.too_old("bogus-item"))
 
     def test_update_page_not_found(self):
         mock_get = mock.Mock(return_value=mock.Mock(
                 text='No such item.'))
-        with mock.patch.object(backend.requests, "get", mock_get) as get:
+        with mock.patch.object(backend.hnclient, "get", mock_get) as get:
             self.assertRaises(backend.NotFound, backend.update_page,
                               '/pages/test_key', 'test_url')
-            get.assert_called_with(config.HN + 'test_url')
+            get.assert_called_with(config.HN + 'test_url',
+                                   priority=ratelimit.USER, deadline=None)
 
     def test_update_page_server_error(self):
         mock_get = mock.Mock(return_value=mock.Mock(
                 text='Unexpected weirdness.'))
-        with mock.patch.object(backend.requests, "get", mock_get) as get:
+        with mock.patch.object(backend.hnclient, "get", mock_get) as get:
             self.assertRaises(backend.ServerError, backend.update_page,
                               '/pages/test_key', 'test_url')
-            get.assert_called_with(config.HN + 'test_url')
+            get.assert_called_with(config.HN + 'test_url',
+                                   priority=ratelimit.USER, deadline=None)
 
     def test_update_page_stories(self):
         RESPONSE_TEXT = '<html>good stories</html>'
         mock_get = mock.Mock(return_value=mock.Mock(
                 text=RESPONSE_TEXT))
-        with mock.patch.object(backend.requests, "get", mock_get) as get:
+        with mock.patch.object(backend.hnclient, "get", mock_get) as get:
             with mock.patch.object(backend, "parse_stories",
                                    mock.Mock(return_value=STORIES)) as parse:
                 stories_json = backend.update_page("/pages/test_key",
                                                    "test_url")
-                get.assert_called_with(config.HN + "test_url")
+                get.assert_called_with(config.HN + "test_url",
+                                       priority=ratelimit.USER,
+                                       deadline=None)
                 parse.assert_called_with(RESPONSE_TEXT)
                 self.assertEqual(stories_json, STORIES_JSON)
 
@@ -76,20 +99,145 @@ class BackendTest(unittest.TestCase):
         RESPONSE_TEXT = '<html>good stories</html>'
         mock_get = mock.Mock(return_value=mock.Mock(
                 text=RESPONSE_TEXT))
-        with mock.patch.object(backend.requests, "get", mock_get) as get:
+        with mock.patch.object(backend.hnclient, "get", mock_get) as get:
             with mock.patch.object(backend, "parse_comments",
                                    mock.Mock(return_value=COMMENTS)) as parse:
                 coms_json = backend.update_page("/comments/test_key",
                                                 "test_url")
-                get.assert_called_with(config.HN + "test_url")
+                get.assert_called_with(config.HN + "test_url",
+                                       priority=ratelimit.USER,
+                                       deadline=None)
                 parse.assert_called_with(RESPONSE_TEXT)
                 self.assertEqual(coms_json, COMMENTS_JSON)
 
+    def test_download_page_fingerprint(self):
+        mock_get = mock.Mock(return_value=mock.Mock(
+                text=u'<html>good stories</html>'))
+        with mock.patch.object(backend.hnclient, "get", mock_get):
+            with mock.patch.object(backend, "parse_stories",
+                                   mock.Mock(return_value=STORIES)) as parse:
+                doc, fingerprint = backend.download_page("/pages/test_key",
+                                                         "test_url")
+                self.assertEqual(json.loads(doc), STORIES)
+
+                doc, same = backend.download_page("/pages/test_key",
+                                                  "test_url",
+                                                  fingerprint=fingerprint)
+                self.assertIsNone(doc)
+                self.assertEqual(same, fingerprint)
+                self.assertEqual(parse.call_count, 1)
+
+                mock_get.return_value.text = u'<html>new stories</html>'
+                doc, new = backend.download_page("/pages/test_key",
+                                                 "test_url",
+                                                 fingerprint=fingerprint)
+                self.assertEqual(json.loads(doc), STORIES)
+                self.assertNotEqual(new, fingerprint)
+
+    def test_download_page_streamed(self):
+        with open(FRONT_PAGE) as f:
+            page = f.read()
+
+        def get(url, priority, on_chunk, deadline):
+            for start in range(0, len(page), 1000):
+                on_chunk(page[start:start + 1000])
+            return mock.Mock(text=page.decode('utf-8'))
+
+        with mock.patch.object(config, 'HN_STREAM', True):
+            with mock.patch.object(backend.hnclient, 'get', get):
+                with mock.patch.object(backend.executor, 'run') as run:
+                    doc, _ = backend.download_page('/pages/', '')
+                    run.assert_not_called()
+        stories = json.loads(doc)['stories']
+        self.assertEqual(len(stories), config.STORIES_PER_PAGE)
+
+    def test_download_page_not_streamed_with_fingerprint(self):
+        with open(FRONT_PAGE) as f:
+            page = f.read().decode('utf-8')
+        fingerprint = backend.hashlib.sha1(page.encode('utf-8')).hexdigest()
+        mock_get = mock.Mock(return_value=mock.Mock(text=page))
+        with mock.patch.object(config, 'HN_STREAM', True):
+            with mock.patch.object(backend.hnclient, 'get', mock_get):
+                doc, _ = backend.download_page('/pages/', '',
+                                               fingerprint=fingerprint)
+        self.assertIsNone(doc)
+        self.assertNotIn('on_chunk', mock_get.call_args[1])
+
     def test_hn_get_cant_make_vote(self):
         mock_get = mock.Mock(return_value=mock.Mock(
                 text="Can't make that vote."))
-        with mock.patch.object(backend.requests, "get", mock_get) as get:
+        with mock.patch.object(backend.hnclient, "get", mock_get) as get:
             self.assertRaises(ClientError, backend.hn_get,
                               "vote-for-me", cookies={'user': 'me'})
             get.assert_called_with(config.HN + "vote-for-me",
                                    cookies={'user': 'me'})
+
+    def test_hn_get_breaker_opens(self):
+        mock_get = mock.Mock(return_value=mock.Mock(text='Weird.'))
+        with mock.patch.object(config, 'BREAKER_FAILURES', 2):
+            with mock.patch.object(backend.hnclient, "get", mock_get):
+                for i in range(2):
+                    self.assertRaises(backend.ServerError, backend.hn_get,
+                                      'news')
+                self.assertRaises(CircuitOpen, backend.hn_get, 'news')
+        self.assertEqual(mock_get.call_count, 2)
+
+    def test_hn_get_breaker_timeouts(self):
+        mock_get = mock.Mock(side_effect=backend.requests.Timeout)
+        with mock.patch.object(config, 'BREAKER_FAILURES', 1):
+            with mock.patch.object(backend.hnclient, "get", mock_get):
+                self.assertRaises(backend.requests.Timeout, backend.hn_get,
+                                  'news')
+                self.assertRaises(CircuitOpen, backend.hn_get, 'news')
+
+    def test_hn_get_breaker_ignores_rate_limits(self):
+        mock_get = mock.Mock(side_effect=RateLimited)
+        with mock.patch.object(config, 'BREAKER_FAILURES', 1):
+            with mock.patch.object(backend.hnclient, "get", mock_get):
+                self.assertRaises(RateLimited, backend.hn_get, 'news')
+                self.assertRaises(RateLimited, backend.hn_get, 'news')
+        self.assertEqual(breaker.state()['failures'], 0)
+
+    def test_hn_get_breaker_ignores_local_limits(self):
+        mock_get = mock.Mock(side_effect=LocalLimit)
+        with mock.patch.object(config, 'BREAKER_FAILURES', 1):
+            with mock.patch.object(backend.hnclient, "get", mock_get):
+                self.assertRaises(LocalLimit, backend.hn_get, 'news')
+                self.assertRaises(LocalLimit, backend.hn_get, 'news')
+        self.assertEqual(breaker.state()['failures'], 0)
+
+    def test_hn_get_breaker_probe_not_found(self):
+        self._probing()
+        # the probe gets an answer from HN, even if it's an error
+        mock_get = mock.Mock(return_value=mock.Mock(text='Unknown.'))
+        with mock.patch.object(backend.hnclient, "get", mock_get):
+            self.assertRaises(NotFound, backend.hn_get, 'news')
+        self.assertEqual(breaker.state()['state'], breaker.CLOSED)
+
+    def _probing(self):
+        """Open the breaker and make it ready for a probe"""
+        with mock.patch.object(config, 'BREAKER_FAILURES', 1):
+            breaker.failure()
+        since = time.time() - config.BREAKER_RESET_TIME - 1
+        rdb.hset(breaker.BREAKER_KEY, 'since', since)
+
+    def test_hn_get_probe_rate_limited(self):
+        self._probing()
+        mock_get = mock.Mock(side_effect=RateLimited)
+        with mock.patch.object(backend.hnclient, "get", mock_get):
+            self.assertRaises(RateLimited, backend.hn_get, 'news')
+            # HN wasn't asked, so the next request probes
+            mock_get.side_effect = None
+            mock_get.return_value = mock.Mock(text='<html></html>')
+            backend.hn_get('news')
+        self.assertEqual(breaker.state()['state'], breaker.CLOSED)
+
+    def test_hn_get_probe_other_error(self):
+        self._probing()
+        mock_get = mock.Mock(
+            side_effect=backend.requests.exceptions.ChunkedEncodingError)
+        with mock.patch.object(backend.hnclient, "get", mock_get):
+            self.assertRaises(backend.requests.RequestException,
+                              backend.hn_get, 'news')
+        self.assertEqual(breaker.state()['state'], breaker.OPEN)
+        self.assertIsNotNone(breaker.allow())
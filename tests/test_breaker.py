@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import unittest
+
+import mock
+
+from newhackers import breaker, config, stats
+from newhackers.exceptions import CircuitOpen
+from tests.utils import rdb
+
+
+class BreakerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        breaker.rdb = rdb
+        stats.rdb = rdb
+
+    def setUp(self):
+        stats._counts.clear()
+        for name, value in [('BREAKER_FAILURES', 3),
+                            ('BREAKER_RESET_TIME', 30)]:
+            patcher = mock.patch.object(config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        rdb.flushdb()
+
+    def _open(self):
+        for i in range(3):
+            breaker.allow()
+            breaker.failure()
+
+    def _age(self, seconds):
+        since = float(rdb.hget(breaker.BREAKER_KEY, 'since'))
+        rdb.hset(breaker.BREAKER_KEY, 'since', since - seconds)
+
+    def test_closed(self):
+        breaker.allow()
+        breaker.success()
+        self.assertEqual(breaker.state(), {'state': breaker.CLOSED,
+                                           'failures': 0, 'since': None})
+
+    def test_failures_counted(self):
+        breaker.failure()
+        breaker.failure()
+        self.assertEqual(breaker.state()['failures'], 2)
+        breaker.allow()
+
+    def test_success_resets_failures(self):
+        breaker.failure()
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        breaker.allow()
+        self.assertEqual(breaker.state()['failures'], 1)
+
+    def test_opens(self):
+        self._open()
+        state = breaker.state()
+        self.assertEqual(state['state'], breaker.OPEN)
+        self.assertAlmostEqual(state['since'], time.time(), delta=1)
+        self.assertRaises(CircuitOpen, breaker.allow)
+        counters = stats.get()
+        self.assertEqual(counters['breaker.open'], 1)
+        self.assertEqual(counters['breaker.rejected'], 1)
+
+    def test_single_probe(self):
+        self._open()
+        self._age(30)
+        breaker.allow()
+        self.assertEqual(breaker.state()['state'], breaker.HALF_OPEN)
+        # the others keep failing fast while the probe is being sent
+        self.assertRaises(CircuitOpen, breaker.allow)
+        self.assertEqual(stats.get()['breaker.probes'], 1)
+
+    def test_probe_succeeded(self):
+        self._open()
+        self._age(30)
+        breaker.allow()
+        breaker.success()
+        self.assertEqual(breaker.state()['state'], breaker.CLOSED)
+        breaker.allow()
+        self.assertEqual(stats.get()['breaker.closed'], 1)
+
+    def test_probe_failed(self):
+        self._open()
+        self._age(30)
+        breaker.allow()
+        breaker.failure()
+        self.assertEqual(breaker.state()['state'], breaker.OPEN)
+        self.assertRaises(CircuitOpen, breaker.allow)
+        self.assertEqual(stats.get()['breaker.open'], 2)
+
+    def test_probe_lost(self):
+        self._open()
+        self._age(30)
+        breaker.allow()
+        # the probe's process never said how it went
+        self._age(30)
+        breaker.allow()
+        self.assertEqual(stats.get()['breaker.probes'], 2)
+
+    def test_probe_given_back(self):
+        self._open()
+        self._age(30)
+        probe = breaker.allow()
+        self.assertIsNotNone(probe)
+        breaker.give_back(probe)
+        self.assertEqual(breaker.state()['state'], breaker.OPEN)
+        # the next request probes without waiting for the reset time
+        self.assertIsNotNone(breaker.allow())
+        self.assertEqual(stats.get()['breaker.probes'], 2)
+
+    def test_give_back_other_probe(self):
+        self._open()
+        self._age(30)
+        probe = breaker.allow()
+        self._age(30)
+        breaker.allow()
+        # somebody else is probing now
+        breaker.give_back(probe)
+        self.assertEqual(breaker.state()['state'], breaker.HALF_OPEN)
+
+    def test_give_back_not_probe(self):
+        self.assertIsNone(breaker.allow())
+        breaker.give_back(None)
+        self.assertEqual(breaker.state()['state'], breaker.CLOSED)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import unittest
+
+import mock
+
+from newhackers import cache, capacity, codec, config
+from tests.fixtures import COMMENTS_JSON, STORIES_JSON
+from tests.utils import rdb, seconds_old
+
+
+class CacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        cache.rdb = rdb
+        capacity.rdb = rdb
+
+    def tearDown(self):
+        rdb.flushdb()
+
+    def test_read_missing(self):
+        self.assertIsNone(cache.read('/pages/'))
+
+    def test_write_read(self):
+        written = cache.write('/pages/', STORIES_JSON)
+        self.assertEqual(codec.decode(written.payload), STORIES_JSON)
+        self.assertAlmostEqual(written.updated, time.time(), delta=1)
+        self.assertEqual(written.etag, cache.etag(STORIES_JSON))
+        self.assertEqual(written.version, cache.VERSION)
+        self.assertEqual(written.interval, config.CACHE_INTERVAL)
+
+        self.assertEqual(cache.read('/pages/'), written)
+
+    def test_read_fields(self):
+        written = cache.write('/pages/', STORIES_JSON)
+        self.assertEqual(cache.read('/pages/', ['updated', 'etag']),
+                         cache.Entry(None, written.updated, written.etag,
+                                     None, None, None, None))
+
+    def test_write_accounted(self):
+        written = cache.write('/pages/', STORIES_JSON)
+        self.assertEqual(capacity.usage()['/pages/']['bytes'],
+                         len(written.payload))
+
+    def test_write_pipe(self):
+        pipe = rdb.pipeline(True)
+        cache.write('/pages/', STORIES_JSON, pipe)
+        self.assertIsNone(cache.read('/pages/'))
+        pipe.execute()
+        self.assertIsNotNone(cache.read('/pages/'))
+
+    def test_write_interval(self):
+        cache.write('/pages/', STORIES_JSON, interval=120)
+        self.assertEqual(cache.read('/pages/').interval, 120)
+
+    def test_stale_until(self):
+        with mock.patch.object(config, 'STALE_TIME', 100):
+            written = cache.write('/pages/', STORIES_JSON, interval=60)
+        self.assertEqual(cache.stale_until(written), written.updated + 160)
+        self.assertEqual(cache.read('/pages/').stale_until,
+                         written.stale_until)
+
+    def test_stale_until_default(self):
+        entry = cache.Entry(None, 1000, 'etag', cache.VERSION, None, None,
+                            None)
+        with mock.patch.object(config, 'CACHE_INTERVAL', 60):
+            with mock.patch.object(config, 'STALE_TIME', 100):
+                self.assertEqual(cache.stale_until(entry), 1160)
+
+    def test_extend_stale(self):
+        cache.write('/pages/', STORIES_JSON)
+        with mock.patch.object(config, 'STALE_TIME', 100):
+            cache.extend_stale('/pages/')
+        self.assertAlmostEqual(cache.read('/pages/').stale_until,
+                               time.time() + 100, delta=1)
+
+    def test_extend_stale_capped(self):
+        cache.write('/pages/', STORIES_JSON)
+        rdb.hset('/pages/', 'updated', 1000)
+        with mock.patch.multiple(config, STALE_TIME=100, STALE_IF_ERROR=1000):
+            # updating the page keeps failing
+            for now, stale_until in [(1850, 1950), (1950, 2000),
+                                     (2050, 2000)]:
+                with mock.patch.object(cache.time, 'time', return_value=now):
+                    cache.extend_stale('/pages/')
+                self.assertEqual(cache.read('/pages/').stale_until,
+                                 stale_until)
+
+    def test_extend_stale_missing(self):
+        cache.extend_stale('/pages/')
+        self.assertFalse(rdb.exists('/pages/'))
+
+    def test_write_fingerprint(self):
+        cache.write('/pages/', STORIES_JSON, fingerprint='fp')
+        self.assertEqual(cache.read('/pages/').fingerprint, 'fp')
+
+    def test_touch(self):
+        written = cache.write('/pages/', STORIES_JSON, fingerprint='fp')
+        rdb.hmset('/pages/', {'updated': 0, 'stale_until': 0})
+        with mock.patch.object(config, 'STALE_TIME', 100):
+            cache.touch('/pages/', 120)
+        entry = cache.read('/pages/')
+        self.assertAlmostEqual(entry.updated, time.time(), delta=1)
+        self.assertEqual(entry.interval, 120)
+        self.assertEqual(entry.stale_until, entry.updated + 220)
+        self.assertEqual(entry.payload, written.payload)
+        self.assertEqual(entry.fingerprint, 'fp')
+
+    def test_touch_missing(self):
+        cache.touch('/pages/')
+        self.assertFalse(rdb.exists('/pages/'))
+
+    def test_next_interval_new_page(self):
+        self.assertEqual(cache.next_interval(None, 'etag'),
+                         config.CACHE_INTERVAL)
+
+    def test_next_interval_unchanged(self):
+        previous = cache.Entry(None, 0, 'etag', cache.VERSION, 60, None, None)
+        with mock.patch.object(config, 'MAX_CACHE_INTERVAL', 100):
+            self.assertEqual(cache.next_interval(previous, 'etag'), 100)
+            with mock.patch.object(config, 'CACHE_INTERVAL_STEP', 1.5):
+                self.assertEqual(cache.next_interval(previous, 'etag'), 90)
+
+    def test_next_interval_changed(self):
+        previous = cache.Entry(None, 0, 'etag', cache.VERSION, 60, None, None)
+        with mock.patch.object(config, 'MIN_CACHE_INTERVAL', 40):
+            self.assertEqual(cache.next_interval(previous, 'other'), 40)
+            with mock.patch.object(config, 'CACHE_INTERVAL_STEP', 1.2):
+                self.assertEqual(cache.next_interval(previous, 'other'), 50)
+
+    def test_next_interval_default(self):
+        # pages stored before they had an interval
+        previous = cache.Entry(None, 0, 'etag', cache.VERSION, None, None,
+                               None)
+        with mock.patch.object(config, 'CACHE_INTERVAL', 60):
+            self.assertEqual(cache.next_interval(previous, 'etag'), 120)
+
+    def test_etag_without_times(self):
+        self.assertEqual(cache.etag('{"title": "a", "time": 1350901062.0}'),
+                         cache.etag('{"title": "a", "time": 1350901121.0}'))
+        self.assertNotEqual(cache.etag('{"title": "a", "time": 1.0}'),
+                            cache.etag('{"title": "b", "time": 1.0}'))
+
+    def test_etag_changes(self):
+        self.assertEqual(cache.etag(STORIES_JSON), cache.etag(STORIES_JSON))
+        self.assertNotEqual(cache.etag(STORIES_JSON),
+                            cache.etag(COMMENTS_JSON))
+
+    def test_read_migrates(self):
+        updated = seconds_old(10)
+        rdb.set('/comments/1', COMMENTS_JSON)
+        rdb.set('/comments/1/updated', updated)
+
+        entry = cache.read('/comments/1')
+        self.assertEqual(entry[:5], (COMMENTS_JSON, updated,
+                                     cache.etag(COMMENTS_JSON),
+                                     cache.VERSION, None))
+        # it's served while it's being updated
+        self.assertGreater(entry.stale_until, time.time())
+        self.assertFalse(rdb.exists('/comments/1/updated'))
+        self.assertEqual(rdb.type('/comments/1'), 'hash')
+
+    def test_migrate_without_timestamp(self):
+        rdb.set('/comments/1', codec.encode(COMMENTS_JSON))
+        self.assertTrue(cache.migrate('/comments/1'))
+        entry = cache.read('/comments/1')
+        self.assertEqual(entry.updated, 0)
+        self.assertEqual(codec.decode(entry.payload), COMMENTS_JSON)
+
+    def test_migrate_all(self):
+        rdb.set('/pages/', STORIES_JSON)
+        rdb.set('/pages//updated', seconds_old(10))
+        rdb.set('/pages//queued', 1)
+        rdb.set('/comments/1', COMMENTS_JSON)
+        cache.write('/comments/2', COMMENTS_JSON)
+
+        self.assertEqual(cache.migrate_all(), 2)
+        self.assertEqual(rdb.type('/pages/'), 'hash')
+        self.assertEqual(rdb.type('/comments/1'), 'hash')
+        self.assertEqual(rdb.get('/pages//queued'), '1')
+        self.assertFalse(cache.migrate('/comments/2'))
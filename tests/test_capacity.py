@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+import time
+import unittest
+
+import mock
+
+from newhackers import capacity, config, stats
+from tests.utils import rdb, seconds_old
+
+
+BUDGETS = {'/pages/': 100, '/comments/': 10}
+
+
+class CapacityTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        capacity.rdb = rdb
+        stats.rdb = rdb
+
+    def setUp(self):
+        stats._counts.clear()
+        patcher = mock.patch.object(config, 'CACHE_BUDGETS', BUDGETS)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        rdb.flushdb()
+
+    def store(self, db_key, size, read=None):
+        rdb.hset(db_key, 'payload', 'x' * size)
+        capacity.record(db_key, size)
+        if read is not None:
+            rdb.zadd(capacity.LRU_KEY + capacity.prefix(db_key),
+                     {db_key: read})
+
+    def test_prefix(self):
+        self.assertEqual(capacity.prefix('/pages/x?fnid=1'), '/pages/')
+        self.assertEqual(capacity.prefix('/comments/1'), '/comments/')
+        self.assertIsNone(capacity.prefix('/stats'))
+
+    def test_record(self):
+        self.store('/pages/', 10)
+        self.store('/pages/ask', 20)
+        self.store('/pages/', 5)
+        self.assertEqual(capacity.usage(),
+                         {'/pages/': {'bytes': 25, 'pages': 2, 'budget': 100},
+                          '/comments/': {'bytes': 0, 'pages': 0,
+                                         'budget': 10}})
+
+    def test_touch(self):
+        self.store('/comments/1', 1, read=seconds_old(100))
+        pipe = rdb.pipeline()
+        capacity.touch(['/comments/1', '/comments/2', '/other'], pipe)
+        pipe.execute()
+
+        lru = capacity.LRU_KEY + '/comments/'
+        self.assertAlmostEqual(rdb.zscore(lru, '/comments/1'), time.time(),
+                               delta=1)
+        # pages which aren't stored aren't tracked
+        self.assertIsNone(rdb.zscore(lru, '/comments/2'))
+
+    def test_forget(self):
+        self.store('/comments/1', 4)
+        rdb.hmset('/comments/1', {'payload': 'page'})
+        self.assertEqual(capacity.forget('/comments/1'), 4)
+        self.assertFalse(rdb.exists('/comments/1'))
+        self.assertEqual(capacity.usage()['/comments/']['bytes'], 0)
+        self.assertIsNone(rdb.hget(capacity.SIZES_KEY, '/comments/1'))
+
+    def test_forget_missing(self):
+        self.assertEqual(capacity.forget('/comments/1'), 0)
+
+    def test_evict_lru(self):
+        self.store('/comments/1', 4, read=seconds_old(30))
+        self.store('/comments/2', 4, read=seconds_old(10))
+        self.store('/comments/3', 4, read=seconds_old(20))
+
+        self.assertEqual(capacity.evict(), 1)
+        self.assertFalse(rdb.exists('/comments/1'))
+        self.assertTrue(rdb.exists('/comments/2'))
+        self.assertTrue(rdb.exists('/comments/3'))
+        self.assertEqual(capacity.usage()['/comments/']['bytes'], 8)
+        self.assertEqual(stats.get()['cache.evicted'], 1)
+
+    def test_evict_idle(self):
+        self.store('/pages/x?fnid=1', 4, read=seconds_old(100))
+        self.store('/pages/', 4)
+
+        with mock.patch.object(config, 'CACHE_IDLE_TIME', 50):
+            self.assertEqual(capacity.evict(), 1)
+        self.assertFalse(rdb.exists('/pages/x?fnid=1'))
+        self.assertTrue(rdb.exists('/pages/'))
+
+    def test_evict_within_budget(self):
+        self.store('/pages/', 100)
+        self.assertEqual(capacity.evict(), 0)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+from gzip import GzipFile
+from StringIO import StringIO
+import unittest
+
+from newhackers import codec
+from tests.fixtures import COMMENTS_JSON, STORIES_JSON
+
+
+class CodecTest(unittest.TestCase):
+    def test_roundtrip(self):
+        value = codec.encode(COMMENTS_JSON)
+        self.assertEqual(value[0], codec.FORMAT_GZIP)
+        self.assertEqual(codec.decode(value), COMMENTS_JSON)
+
+    def test_roundtrip_unicode(self):
+        doc = u'{"title": "Ionuț"}'
+        self.assertEqual(codec.decode(codec.encode(doc)).decode('utf-8'), doc)
+
+    def test_smaller(self):
+        doc = '[%s]' % ', '.join([STORIES_JSON] * 10)
+        self.assertLess(len(codec.encode(doc)), len(doc))
+
+    def test_gzip_body(self):
+        value = codec.encode(STORIES_JSON)
+        self.assertEqual(GzipFile(fileobj=StringIO(value[1:])).read(),
+                         STORIES_JSON)
+
+    def test_decode_plain_json(self):
+        # values stored before the codec existed
+        self.assertEqual(codec.decode(STORIES_JSON), STORIES_JSON)
+        self.assertEqual(codec.decode('[1, 2]'), '[1, 2]')
+
+    def test_decode_unknown(self):
+        self.assertRaises(ValueError, codec.decode, '\x7fwhat is this')
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import unittest
+
+import mock
+
+from newhackers import config, executor, parsers
+from newhackers.exceptions import ServerError
+from tests.fixtures import NO_COMMENTS
+
+
+class InlineExecutorTest(unittest.TestCase):
+    def test_run_inline(self):
+        func = mock.Mock(return_value='parsed')
+        with mock.patch.object(config, 'PARSE_EXECUTOR', 'inline'):
+            self.assertEqual(executor.run(func, 'page'), 'parsed')
+            func.assert_called_with('page')
+
+
+class ProcessExecutorTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(config, 'PARSE_EXECUTOR', 'process')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(executor.shutdown)
+
+    def test_run_in_pool(self):
+        with open(NO_COMMENTS) as f:
+            page = f.read()
+        result = executor.run(parsers.parse_comments, page)
+        self.assertEqual(result['author'], 'twapi')
+
+    def test_exceptions_are_raised(self):
+        self.assertRaises(ValueError, executor.run, int, 'not a number')
+
+    def test_timeout(self):
+        with mock.patch.object(config, 'PARSE_TIMEOUT', 0.1):
+            self.assertRaises(ServerError, executor.run, time.sleep, 1)
+
+    def test_queue_full(self):
+        with mock.patch.object(config, 'PARSE_QUEUE_SIZE', 1):
+            pool, slots = executor._get_pool()
+            slots.acquire()
+            self.assertRaises(ServerError, executor.run, len, 'abc')
+            slots.release()
+            self.assertEqual(executor.run(len, 'abc'), 3)
+
+    def test_timed_out_call_keeps_its_slot(self):
+        with mock.patch.multiple(config, PARSE_QUEUE_SIZE=1,
+                                 PARSE_TIMEOUT=0.1):
+            self.assertRaises(ServerError, executor.run, time.sleep, 0.5)
+            # still sleeping in the pool
+            self.assertRaises(ServerError, executor.run, len, 'abc')
+            time.sleep(0.6)
+            self.assertEqual(executor.run(len, 'abc'), 3)
+
+    def test_failed_call_frees_its_slot(self):
+        with mock.patch.object(config, 'PARSE_QUEUE_SIZE', 1):
+            self.assertRaises(ValueError, executor.run, int, 'not a number')
+            self.assertEqual(executor.run(len, 'abc'), 3)
+
+    def test_waits_with_gevent(self):
+        with mock.patch.object(executor, 'gevent') as gevent:
+            gevent.sleep.side_effect = time.sleep
+            self.assertEqual(executor.run(time.sleep, 0.05), None)
+            gevent.sleep.assert_called_with(config.PARSE_POLL_INTERVAL)
+
+    def test_waits_without_gevent(self):
+        with mock.patch.object(executor, 'gevent', None):
+            self.assertEqual(executor.run(len, 'abc'), 3)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import time
+import unittest
+
+import mock
+
+from newhackers import (auth, backend, breaker, config, hnclient, ratelimit,
+                        stats)
+from newhackers.exceptions import ClientError, NotFound, ServerError
+from tests.fakehn import FakeHN
+from tests.utils import rdb
+
+
+class FakeHNTest(unittest.TestCase):
+    """The fake HN must look like HN to the backend"""
+
+    @classmethod
+    def setUpClass(self):
+        breaker.rdb = rdb
+        ratelimit.rdb = rdb
+        stats.rdb = rdb
+        self.server = FakeHN()
+        self.url = self.server.start()
+
+    @classmethod
+    def tearDownClass(self):
+        # close the keep-alive connections for the handler threads to end
+        hnclient._get_session().close()
+        self.server.stop()
+
+    def setUp(self):
+        for name, value in [('HN', self.url),
+                            ('HN_LOGIN', self.url + 'newslogin'),
+                            ('HN_LOGIN_POST', self.url + 'y')]:
+            patcher = mock.patch.object(config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.latency = self.server.error_rate = 0
+        rdb.flushdb()
+
+    def test_stories(self):
+        for path in ['news', 'ask', 'x?fnid=4AVKeJz9TP']:
+            stories = json.loads(backend.update_page('/pages/', path))
+            self.assertEqual(len(stories['stories']),
+                             config.STORIES_PER_PAGE)
+
+    def test_comments(self):
+        for item in ['4705067', '4655144', '4706068', '1']:
+            page = json.loads(backend.update_page('/comments/' + item,
+                                                  'item?id=' + item))
+            self.assertIn('comments', page)
+
+    def test_no_such_item(self):
+        self.assertRaises(NotFound, backend.update_page, '/comments/x',
+                          'item?id=x')
+
+    def test_latency(self):
+        self.server.latency = 0.1
+        start = time.time()
+        backend.hn_get('news')
+        self.assertGreaterEqual(time.time() - start, 0.1)
+
+    def test_errors(self):
+        self.server.error_rate = 1
+        with mock.patch.object(self.server, 'errors', ['expired']):
+            self.assertRaises(NotFound, backend.hn_get, 'news')
+        with mock.patch.object(self.server, 'errors', ['weird']):
+            self.assertRaises(ServerError, backend.hn_get, 'news')
+
+    def test_login(self):
+        token = auth.get_token('user', 'pass')
+        self.assertTrue(token.startswith('user&'))
+
+    def test_login_failed(self):
+        self.assertRaises(ClientError, auth.get_token, 'user', 'wrong')
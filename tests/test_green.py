@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+import threading
+import time
+import unittest
+
+import mock
+
+from newhackers import config, green
+
+
+class GreenTest(unittest.TestCase):
+    def test_sleep_without_gevent(self):
+        with mock.patch.object(green, 'gevent', None):
+            with mock.patch.object(green.time, 'sleep') as sleep:
+                green.sleep(1)
+                sleep.assert_called_with(1)
+
+    def test_sleep_with_gevent(self):
+        with mock.patch.object(green, 'gevent') as gevent:
+            green.sleep(1)
+            gevent.sleep.assert_called_with(1)
+
+    def test_wait_ready(self):
+        event = threading.Event()
+        threading.Timer(0.05, event.set).start()
+        self.assertTrue(green.wait(event.is_set, 1))
+
+    def test_wait_timeout(self):
+        start = time.time()
+        with mock.patch.object(config, 'WAIT_POLL_INTERVAL', 0.01):
+            self.assertFalse(green.wait(lambda: False, 0.05))
+        self.assertAlmostEqual(time.time() - start, 0.05, delta=0.03)
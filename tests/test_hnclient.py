@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import threading
+import time
+import unittest
+
+import mock
+
+from newhackers import config, hnclient, ratelimit, stats
+from newhackers.exceptions import LocalLimit, RateLimited, ServerError
+from tests.utils import rdb
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # status codes to answer with, 200 when empty
+    statuses = []
+
+    def do_GET(self):
+        status = self.statuses.pop(0) if self.statuses else 200
+        body = '<html>%s</html>' % self.path
+        self.send_response(status)
+        if self.path == '/unsized':
+            # the body ends when the connection is closed
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', 'user=token')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class HNClientTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        stats.rdb = rdb
+        ratelimit.rdb = rdb
+        self.server = Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever).start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+
+    @classmethod
+    def tearDownClass(self):
+        # close the keep-alive connections for the handler threads to end
+        hnclient._get_session().close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def setUp(self):
+        stats._counts.clear()
+        hnclient._session = None
+        patcher = mock.patch.object(config, 'HN', self.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        rdb.flushdb()
+
+    def test_get(self):
+        res = hnclient.get(self.url + 'news')
+        self.assertEqual(res.text, '<html>/news</html>')
+
+    def test_connection_reused(self):
+        for i in range(3):
+            hnclient.get(self.url)
+        counters = stats.get()
+        self.assertEqual(counters['hn.requests'], 3)
+        self.assertEqual(counters['hn.connections'], 1)
+
+    def test_default_timeout(self):
+        with mock.patch.object(hnclient.requests.Session, 'request'
+                               ) as request:
+            hnclient.get(self.url)
+            request.assert_called_with('GET', self.url, stream=True,
+                                       timeout=config.HN_TIMEOUT)
+
+    def test_deadline(self):
+        with mock.patch.object(config, 'HN_TIMEOUT', (3, 10)):
+            with mock.patch.object(hnclient.requests.Session, 'request'
+                                   ) as request:
+                hnclient.get(self.url, deadline=time.time() + 5)
+                timeout = request.call_args[1]['timeout']
+        self.assertEqual(timeout[0], 3)
+        self.assertAlmostEqual(timeout[1], 5, delta=0.5)
+
+    def test_deadline_passed(self):
+        with mock.patch.object(hnclient.requests.Session, 'request'
+                               ) as request:
+            self.assertRaises(LocalLimit, hnclient.get, self.url,
+                              deadline=time.time() - 1)
+            request.assert_not_called()
+        self.assertEqual(stats.get()['hn.out_of_time'], 1)
+
+    def test_on_chunk(self):
+        chunks = []
+        with mock.patch.object(config, 'HN_CHUNK_SIZE', 4):
+            res = hnclient.get(self.url + 'news', on_chunk=chunks.append)
+        self.assertEqual(''.join(chunks), '<html>/news</html>')
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(res.text, '<html>/news</html>')
+
+    def test_too_big(self):
+        with mock.patch.object(config, 'HN_MAX_BODY', 10):
+            self.assertRaises(LocalLimit, hnclient.get, self.url + 'news')
+        self.assertEqual(stats.get()['hn.too_big'], 1)
+
+    def test_too_big_unsized(self):
+        chunks = []
+        with mock.patch.object(config, 'HN_MAX_BODY', 10):
+            with mock.patch.object(config, 'HN_CHUNK_SIZE', 4):
+                self.assertRaises(LocalLimit, hnclient.get,
+                                  self.url + 'unsized',
+                                  on_chunk=chunks.append)
+        # it stopped reading once the body got too big
+        self.assertEqual(''.join(chunks), '<html>/u')
+        self.assertEqual(stats.get()['hn.too_big'], 1)
+
+    def test_too_slow(self):
+        with mock.patch.object(config, 'HN_READ_DEADLINE', -1):
+            self.assertRaises(ServerError, hnclient.get, self.url)
+        self.assertEqual(stats.get()['hn.too_slow'], 1)
+
+    def test_cookies_not_kept(self):
+        res = hnclient.get(self.url)
+        self.assertEqual(res.cookies['user'], 'token')
+        self.assertEqual(len(hnclient._session.cookies), 0)
+
+    def test_retries(self):
+        Handler.statuses = [503]
+        res = hnclient.get(self.url)
+        self.assertEqual(res.status_code, 200)
+
+    def test_rate_limited(self):
+        with mock.patch.object(ratelimit, 'acquire',
+                               side_effect=RateLimited) as acquire:
+            self.assertRaises(RateLimited, hnclient.get, self.url,
+                              priority=ratelimit.BACKGROUND)
+            acquire.assert_called_with(ratelimit.BACKGROUND)
+
+    def test_new_session_after_fork(self):
+        session = hnclient._get_session()
+        with mock.patch.object(hnclient.os, 'getpid', return_value=-1):
+            self.assertIsNot(hnclient._get_session(), session)
@@ -15,11 +15,23 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
 
+import threading
+import time
 import unittest
 
 import mock
 
-from newhackers import config, items
+try:
+    import gevent
+except ImportError:
+    gevent = None
+
+from flask import g
+
+from newhackers import (app, cache, capacity, codec, config, items,
+                        popularity, stats)
+from newhackers.exceptions import NotFound, ServerError
+from newhackers.redis_lock import acquire_lock, release_lock
 from tests.fixtures import PAGE_ID, STORIES_JSON
 from tests.utils import seconds_old, rdb
 
@@ -28,6 +40,15 @@ class ItemsTest(unittest.TestCase):
     @classmethod
     def setUpClass(self):
         items.rdb = rdb
+        cache.rdb = rdb
+        stats.rdb = rdb
+        popularity.rdb = rdb
+        capacity.rdb = rdb
+
+    def setUp(self):
+        stats._counts.clear()
+        popularity._hits.clear()
+        items._local.clear()
 
     def tearDown(self):
         rdb.flushdb()
@@ -37,15 +58,25 @@ class ItemsTest(unittest.TestCase):
 
         with mock.patch.object(items, 'update_page') as update_page:
             self.assertEqual(STORIES_JSON,
-                             items._get_cache('test_key', 'test_item'))
+                             items._get_cache('test_key', 'test_item').payload)
             update_page.assert_not_called()
 
     def test_cache_not_cached(self):
         with mock.patch.object(items, 'update_page', return_value='stories'
                                ) as update_page:
-            self.assertEqual('stories',
-                             items._get_cache('test_key', 'test_item'))
-            update_page.assert_called_with('test_key', 'test_item')
+            stored = items._get_cache('test_key', 'test_item').payload
+            self.assertEqual('stories', codec.decode(stored))
+            self.assertEqual(rdb.hget('test_key', 'payload'), stored)
+            update_page.assert_called_with('test_key', 'test_item',
+                                           deadline=mock.ANY)
+
+    def test_cache_not_cached_deadline(self):
+        with mock.patch.object(config, 'USER_DEADLINE', 5):
+            with mock.patch.object(items, 'update_page', return_value='stories'
+                                   ) as update_page:
+                items._get_cache('test_key', 'test_item')
+        self.assertAlmostEqual(update_page.call_args[1]['deadline'],
+                               time.time() + 5, delta=1)
 
     def test_cache_other_page_cached(self):
         rdb.set("test_key", STORIES_JSON)
@@ -53,7 +84,21 @@ class ItemsTest(unittest.TestCase):
         with mock.patch.object(items, 'update_page') as update_page:
             update_page.assert_not_called()
             self.assertEqual(STORIES_JSON,
-                             items._get_cache('test_key', 'test_item'))
+                             items._get_cache('test_key', 'test_item').payload)
+
+    def test_cache_status(self):
+        with mock.patch.object(items, 'update_page', return_value='stories'):
+            with app.test_request_context():
+                items._get_cache('test_key', 'test_item')
+                self.assertEqual(g.cache_status, 'MISS')
+            items._local.clear()
+            with app.test_request_context():
+                items._get_cache('test_key', 'test_item')
+                self.assertEqual(g.cache_status, 'HIT')
+            with app.test_request_context():
+                items._get_cache('test_key', 'test_item')
+                # from the local cache
+                self.assertEqual(g.cache_status, 'HIT')
 
     def test_cache_cached_too_old_gets_update(self):
         rdb.set('test_key', STORIES_JSON)
@@ -62,19 +107,290 @@ class ItemsTest(unittest.TestCase):
 
         with mock.patch.object(config, 'CACHE_INTERVAL', 30):
             with mock.patch.object(items.tasks.update, 'delay') as update:
-                self.assertEqual(STORIES_JSON,
-                                 items._get_cache('test_key', 'test_item'))
+                self.assertEqual(STORIES_JSON, items._get_cache(
+                    'test_key', 'test_item').payload)
                 update.assert_called_with('test_key', 'test_item')
 
+    def _concurrent_misses(self, threads=5):
+        results = []
+
+        def get():
+            try:
+                results.append(items._get_cache('test_key', 'test_item'))
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=get) for i in range(threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_cache_concurrent_misses_fetch_once(self):
+        def slow_update(db_key, page, deadline):
+            time.sleep(0.2)
+            return 'stories'
+
+        with mock.patch.object(items, 'update_page',
+                               side_effect=slow_update) as update_page:
+            results = self._concurrent_misses()
+            self.assertEqual(update_page.call_count, 1)
+            self.assertEqual(len(set(results)), 1)
+            self.assertEqual(codec.decode(results[0].payload), 'stories')
+            self.assertEqual(items._flights, {})
+
+    def test_cache_concurrent_misses_share_errors(self):
+        def not_found(db_key, page, deadline):
+            time.sleep(0.2)
+            raise NotFound(page)
+
+        with mock.patch.object(items, 'update_page',
+                               side_effect=not_found) as update_page:
+            results = self._concurrent_misses()
+            self.assertEqual(update_page.call_count, 1)
+            for result in results:
+                self.assertIsInstance(result, NotFound)
+            self.assertEqual(items._flights, {})
+
+    @unittest.skipIf(gevent is None, "gevent isn't installed")
+    def test_cache_concurrent_misses_greenlets(self):
+        def slow_update(db_key, page, deadline):
+            # like executor.run, which waits for the parser with gevent
+            gevent.sleep(0.2)
+            return 'stories'
+
+        with mock.patch.object(config, 'MISS_WAIT_TIMEOUT', 2):
+            with mock.patch.object(items, 'update_page',
+                                   side_effect=slow_update) as update_page:
+                start = time.time()
+                greenlets = [gevent.spawn(items._get_cache, 'test_key',
+                                          'test_item') for i in range(2)]
+                gevent.joinall(greenlets, raise_error=True)
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(update_page.call_count, 1)
+        self.assertEqual(greenlets[0].value, greenlets[1].value)
+
+    def test_cache_miss_other_process_fetches(self):
+        # another process holds the lock and stores the page meanwhile
+        acquire_lock(rdb, '/locktest_key', 'other')
+
+        def other_process():
+            time.sleep(0.2)
+            cache.write('test_key', STORIES_JSON)
+            release_lock(rdb, '/locktest_key', 'other')
+        threading.Thread(target=other_process).start()
+
+        with mock.patch.object(items, 'update_page') as update_page:
+            self.assertEqual(STORIES_JSON, codec.decode(
+                items._get_cache('test_key', 'test_item').payload))
+            update_page.assert_not_called()
+
+    def test_cache_miss_wait_timeout(self):
+        acquire_lock(rdb, '/locktest_key', 'other')
+
+        with mock.patch.object(config, 'MISS_WAIT_TIMEOUT', 0.1):
+            with mock.patch.object(items, 'update_page') as update_page:
+                self.assertRaises(ServerError, items._get_cache,
+                                  'test_key', 'test_item')
+                update_page.assert_not_called()
+
+    def test_cache_fresh_no_update(self):
+        rdb.hmset('test_key', {'payload': STORIES_JSON,
+                              'updated': seconds_old(10)})
+
+        with mock.patch.object(config, 'CACHE_INTERVAL', 30):
+            with mock.patch.object(items.tasks.update, 'delay') as update:
+                items._get_cache('test_key', 'test_item')
+                update.assert_not_called()
+        self.assertEqual(stats.get()['refresh.not_due'], 1)
+
+    def test_cache_too_old_update_enqueued_once(self):
+        rdb.hmset('test_key', {'payload': STORIES_JSON,
+                              'updated': seconds_old(31)})
+
+        with mock.patch.object(config, 'CACHE_INTERVAL', 30):
+            with mock.patch.object(items.tasks.update, 'delay') as update:
+                for i in range(3):
+                    self.assertEqual(STORIES_JSON, items._get_cache(
+                        'test_key', 'test_item').payload)
+                update.assert_called_once_with('test_key', 'test_item')
+        self.assertLessEqual(rdb.ttl('test_key/queued'), 30)
+
+        counters = stats.get()
+        self.assertEqual(counters['refresh.enqueued'], 1)
+        self.assertEqual(counters['refresh.already_queued'], 2)
+
+    def test_cache_local_hit(self):
+        rdb.hmset('test_key', {'payload': STORIES_JSON,
+                              'updated': time.time()})
+
+        self.assertEqual(STORIES_JSON,
+                         items._get_cache('test_key', 'test_item').payload)
+        # the second request doesn't need redis
+        rdb.delete('test_key')
+        with mock.patch.object(items.tasks.update, 'delay') as update:
+            self.assertEqual(STORIES_JSON,
+                             items._get_cache('test_key', 'test_item').payload)
+            update.assert_not_called()
+
+    def test_cache_page_interval(self):
+        rdb.hmset('test_key', {'payload': STORIES_JSON,
+                              'updated': seconds_old(31),
+                              'interval': 120})
+
+        with mock.patch.object(config, 'CACHE_INTERVAL', 30):
+            with mock.patch.object(items.tasks.update, 'delay') as update:
+                items._get_cache('test_key', 'test_item', ('etag',))
+                update.assert_not_called()
+
+    def test_cache_hard_expired(self):
+        rdb.hmset('test_key', {'payload': STORIES_JSON,
+                              'updated': seconds_old(100),
+                              'stale_until': seconds_old(1)})
+
+        with mock.patch.object(items, 'update_page', return_value='stories'
+                               ) as update_page:
+            entry = items._get_cache('test_key', 'test_item')
+            update_page.assert_called_with('test_key', 'test_item',
+                                           deadline=mock.ANY)
+        self.assertEqual(codec.decode(entry.payload), 'stories')
+        self.assertEqual(stats.get()['cache.hard_expired'], 1)
+
+    def test_cache_hard_expired_serve_stale_on_error(self):
+        rdb.hmset('test_key', {'payload': STORIES_JSON,
+                              'updated': seconds_old(100),
+                              'stale_until': seconds_old(1)})
+
+        with mock.patch.object(config, 'STALE_TIME', 60):
+            with mock.patch.object(items, 'update_page',
+                                   side_effect=ServerError):
+                entry = items._get_cache('test_key', 'test_item')
+        self.assertEqual(entry.payload, STORIES_JSON)
+        self.assertEqual(stats.get()['cache.stale_on_error'], 1)
+        # the next requests don't wait for HN
+        self.assertAlmostEqual(cache.read('test_key').stale_until,
+                               time.time() + 60, delta=1)
+
+    def test_cache_hard_expired_too_old_for_error(self):
+        rdb.hmset('test_key', {'payload': STORIES_JSON,
+                              'updated': seconds_old(100),
+                              'stale_until': seconds_old(1)})
+
+        with mock.patch.object(config, 'STALE_IF_ERROR', 50):
+            with mock.patch.object(items, 'update_page',
+                                   side_effect=ServerError):
+                self.assertRaises(ServerError, items._get_cache,
+                                  'test_key', 'test_item')
+
+    def test_cache_local_not_too_old(self):
+        rdb.hmset('test_key', {'payload': STORIES_JSON,
+                              'updated': seconds_old(31)})
+
+        with mock.patch.object(config, 'CACHE_INTERVAL', 30):
+            with mock.patch.object(items.tasks.update, 'delay'):
+                items._get_cache('test_key', 'test_item')
+        self.assertIsNone(items._local.get('test_key'))
+
+    def test_cache_local_invalidated(self):
+        rdb.hmset('test_key', {'payload': STORIES_JSON,
+                              'updated': time.time()})
+        items._get_cache('test_key', 'test_item')
+
+        # wait for the listener to subscribe before publishing
+        for i in range(100):
+            if rdb.publish(config.INVALIDATE_CHANNEL, 'test_key'):
+                break
+            time.sleep(0.01)
+
+        for i in range(100):
+            if items._local.get('test_key') is None:
+                break
+            time.sleep(0.01)
+        self.assertIsNone(items._local.get('test_key'))
+
+    def test_cache_some_fields(self):
+        rdb.hmset('test_key', {'payload': STORIES_JSON,
+                              'updated': time.time(),
+                              'etag': 'etag'})
+
+        entry = items._get_cache('test_key', 'test_item', ('updated', 'etag'))
+        self.assertEqual(entry.etag, 'etag')
+        self.assertIsNone(entry.payload)
+        self.assertIsNone(items._local.get('test_key'))
+
+    def test_cache_counts_hits(self):
+        rdb.hmset('test_key', {'payload': STORIES_JSON,
+                              'updated': time.time()})
+        for i in range(2):
+            items._get_cache('test_key', 'test_item')
+        popularity.flush()
+        self.assertEqual(rdb.zscore(popularity.POPULAR_KEY, 'test_key'), 2)
+
     def test_get_comments(self):
         with mock.patch.object(items, '_get_cache') as get_cache:
             items.get_comments('test_item')
             get_cache.assert_called_with('/comments/test_item',
-                                         'item?id=test_item')
+                                         'item?id=test_item', cache.FIELDS)
 
     def test_get_stories(self):
         with mock.patch.object(items, '_get_cache') as get_cache:
             items.get_stories('test_id')
             get_cache.assert_called_with('/pages/x?fnid=test_id',
-                                         'x?fnid=test_id')
+                                         'x?fnid=test_id', cache.FIELDS)
+
+
+def entry(payload, updated=None):
+    if updated is None:
+        updated = time.time()
+    return cache.Entry(payload, updated, 'etag', cache.VERSION, None, None,
+                       None)
+
+
+class LocalCacheTest(unittest.TestCase):
+    def test_get_set(self):
+        cache = items.LocalCache(100, 60)
+        self.assertIsNone(cache.get('key'))
+        page = entry('page')
+        cache.set('key', page)
+        self.assertEqual(cache.get('key'), page)
+        self.assertEqual(cache.size, 4)
+
+    def test_ttl(self):
+        cache = items.LocalCache(100, 0.1)
+        cache.set('key', entry('page'))
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(cache.size, 0)
+
+    def test_expires_when_too_old(self):
+        cache = items.LocalCache(100, 60)
+        with mock.patch.object(config, 'CACHE_INTERVAL', 30):
+            cache.set('key', entry('page', time.time() - 29.9))
+            self.assertEqual(cache.get('key').payload, 'page')
+            time.sleep(0.1)
+            self.assertIsNone(cache.get('key'))
+
+    def test_lru_bytes(self):
+        cache = items.LocalCache(10, 60)
+        cache.set('a', entry('1234'))
+        cache.set('b', entry('1234'))
+        cache.get('a')
+        cache.set('c', entry('1234'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a').payload, '1234')
+        self.assertEqual(cache.get('c').payload, '1234')
+        self.assertEqual(cache.size, 8)
+
+    def test_too_big(self):
+        cache = items.LocalCache(10, 60)
+        cache.set('a', entry('12345678901'))
+        self.assertIsNone(cache.get('a'))
 
+    def test_discard(self):
+        cache = items.LocalCache(10, 60)
+        cache.set('a', entry('1234'))
+        cache.discard('a')
+        cache.discard('b')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 0)
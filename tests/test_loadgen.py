@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+import imp
+import os
+import unittest
+
+# the load generator is a script, tests/performance isn't a package
+loadgen = imp.load_source('loadgen', os.path.join(
+    os.path.dirname(__file__), 'performance', 'loadgen.py'))
+
+
+class HistogramTest(unittest.TestCase):
+    def test_empty(self):
+        histogram = loadgen.Histogram()
+        self.assertIsNone(histogram.percentile(50))
+        self.assertEqual(histogram.summary(), {'count': 0})
+
+    def test_small_values_exact(self):
+        histogram = loadgen.Histogram()
+        for microseconds in range(1, 101):
+            histogram.record(microseconds / 1e6)
+        self.assertEqual(histogram.percentile(50), 50 / 1e6)
+        self.assertEqual(histogram.percentile(100), 100 / 1e6)
+
+    def test_precision(self):
+        histogram = loadgen.Histogram(precision_bits=7)
+        for seconds in [0.001, 0.01, 0.1, 1, 10]:
+            histogram.record(seconds)
+        for percent, seconds in [(20, 0.001), (60, 0.1), (99, 10)]:
+            self.assertAlmostEqual(histogram.percentile(percent), seconds,
+                                   delta=seconds / 2 ** 7)
+
+    def test_percentile_not_above_max(self):
+        histogram = loadgen.Histogram(precision_bits=2)
+        histogram.record(1.5)
+        self.assertEqual(histogram.percentile(99), 1.5)
+
+    def test_merge(self):
+        first, second = loadgen.Histogram(), loadgen.Histogram()
+        for i in range(9):
+            first.record(0.001)
+        second.record(1)
+        first.merge(second)
+        summary = first.summary()
+        self.assertEqual(summary['count'], 10)
+        self.assertEqual(summary['max'], 1000)
+        self.assertAlmostEqual(summary['p50'], 1, delta=0.01)
+        self.assertAlmostEqual(summary['p99'], 1000, delta=10)
+        self.assertAlmostEqual(summary['mean'], 100.9)
+
+
+class ResultsTest(unittest.TestCase):
+    def test_record_cache_status(self):
+        results = loadgen.Results()
+        results.record('stories', 0.1, 200, 'HIT')
+        results.record('stories', 0.5, 200, 'MISS')
+        results.record('vote', 0.2, 403)
+        self.assertEqual(results.latencies['stories'].count, 2)
+        self.assertEqual(results.latencies['stories.hit'].count, 1)
+        self.assertEqual(results.latencies['stories.miss'].count, 1)
+        self.assertNotIn('vote.hit', results.latencies)
+        self.assertEqual(dict(results.statuses['vote']), {'403': 1})
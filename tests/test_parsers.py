@@ -20,8 +20,9 @@ import time
 import unittest
 
 from bs4 import BeautifulSoup
+import mock
 
-from newhackers import config, parsers
+from newhackers import config, parsers, streamparser
 from tests.utils import valid_url
 from tests.fixtures import (COMMENTS_PAGE, NO_COMMENTS, ASK_COMMENTS,
                             FRONT_PAGE, STORIES)
@@ -182,3 +183,109 @@ class ParseStoriesTest(unittest.TestCase):
 
     def test_parse_subtexts_no_comments(self):
         self.assertIsNone(parsers._parse_subtexts(BeautifulSoup()))
+
+
+class StreamEngineTest(unittest.TestCase):
+    """The stream parser must return exactly what the soup parser returns"""
+
+    def setUp(self):
+        # relative times would differ between two parses, so compare
+        # the raw time strings instead
+        patcher = mock.patch.object(parsers, '_decode_time',
+                                     lambda t, now=None: t)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _assert_same(self, parse, fixture):
+        with open(fixture) as f:
+            page = f.read()
+        self.assertEqual(parse(page, engine='stream'),
+                         parse(page, engine='soup'))
+
+    def test_front_page(self):
+        self._assert_same(parsers.parse_stories, FRONT_PAGE)
+
+    def test_comments(self):
+        self._assert_same(parsers.parse_comments, COMMENTS_PAGE)
+
+    def test_ask_comments(self):
+        self._assert_same(parsers.parse_comments, ASK_COMMENTS)
+
+    def test_no_comments(self):
+        self._assert_same(parsers.parse_comments, NO_COMMENTS)
+
+    def test_unicode_page(self):
+        with open(COMMENTS_PAGE) as f:
+            page = f.read().decode('utf-8')
+        self.assertEqual(parsers.parse_comments(page, engine='stream'),
+                         parsers.parse_comments(page, engine='soup'))
+
+    def test_fed_in_chunks(self):
+        with open(COMMENTS_PAGE) as f:
+            page = f.read()
+        parser = streamparser.PageParser()
+        # split the page in the middle of multibyte characters too
+        for start in range(0, len(page), 1000):
+            parser.feed_bytes(page[start:start + 1000])
+        parser.close()
+        self.assertEqual(parsers.parse_comments(parser),
+                         parsers.parse_comments(page, engine='soup'))
+
+    def test_unclosed_tags(self):
+        doc = ("<span class='comhead'>Story title</span>"
+               "<span class='comhead'> <a href='user?id=foo'>foo</a>"
+               " 3 hours ago | <a href='item?id=42'>link</a></span>"
+               "<span class='comment'><p>one &amp; <p>two &#147;</span>"
+               "</td><span class='comment'>stray</span>")
+        self.assertEqual(
+            parsers._comments(*self._stream(doc)),
+            parsers._parse_comments(BeautifulSoup(doc)))
+
+    def _stream(self, doc):
+        parser = streamparser.parse(doc)
+        return parser.comheads, parser.comments
+
+
+class DecodeTimeTest(unittest.TestCase):
+    NOW = 1351000000.0
+
+    def setUp(self):
+        parsers._time_cache.clear()
+
+    def _parsedatetime(self, timestamp):
+        return time.mktime(parsers.cal.parse(
+            timestamp, time.localtime(self.NOW))[0])
+
+    def test_relative_same_as_parsedatetime(self):
+        for timestamp in ['1 minute ago', '24 minutes ago', '4 hours ago ',
+                          '1 day ago', '11 days ago', '2 weeks ago']:
+            self.assertEqual(parsers._decode_time(timestamp, self.NOW),
+                             self._parsedatetime(timestamp))
+
+    def test_relative_doesnt_use_parsedatetime(self):
+        with mock.patch.object(parsers.cal, 'parse') as parse:
+            parsers._decode_time('3 hours ago', self.NOW)
+            self.assertFalse(parse.called)
+
+    def test_unusual_falls_back(self):
+        self.assertEqual(parsers._decode_time('2 months ago', self.NOW),
+                         self._parsedatetime('2 months ago'))
+
+    def test_cached(self):
+        with mock.patch.object(parsers.cal, 'parse',
+                               wraps=parsers.cal.parse) as parse:
+            first = parsers._decode_time('2 months ago', self.NOW)
+            second = parsers._decode_time('2 months ago', self.NOW + 0.5)
+            self.assertEqual(first, second)
+            self.assertEqual(parse.call_count, 1)
+
+            parsers._decode_time('2 months ago', self.NOW + 1)
+            self.assertEqual(parse.call_count, 2)
+
+    def test_cache_bounded(self):
+        with mock.patch.object(config, 'TIME_CACHE_SIZE', 2):
+            for hours in range(5):
+                parsers._decode_time('%d hours ago' % hours, self.NOW)
+        self.assertEqual(list(parsers._time_cache),
+                         [('3 hours ago', self.NOW),
+                          ('4 hours ago', self.NOW)])
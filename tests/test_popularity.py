@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+import time
+import unittest
+
+import mock
+
+from newhackers import config, popularity
+from tests.utils import seconds_old, rdb
+
+
+class PopularityTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        popularity.rdb = rdb
+
+    def setUp(self):
+        popularity._hits.clear()
+        popularity._paths.clear()
+
+    def tearDown(self):
+        rdb.flushdb()
+
+    def test_hit_local(self):
+        with mock.patch.object(config, 'POPULARITY_FLUSH_INTERVAL', 3600):
+            popularity.flush()
+            popularity.hit('/pages/', '')
+            popularity.hit('/pages/', '')
+            self.assertFalse(rdb.exists(popularity.POPULAR_KEY))
+            self.assertEqual(popularity._hits['/pages/'], 2)
+
+    def test_hit_flushes(self):
+        with mock.patch.object(config, 'POPULARITY_FLUSH_INTERVAL', 0):
+            popularity.hit('/comments/1', 'item?id=1')
+        self.assertEqual(rdb.zscore(popularity.POPULAR_KEY, '/comments/1'), 1)
+        self.assertEqual(rdb.hget(popularity.PATHS_KEY, '/comments/1'),
+                         'item?id=1')
+
+    def test_decay(self):
+        rdb.zadd(popularity.POPULAR_KEY, {'/pages/': 10, '/comments/1': 0.5})
+        rdb.hmset(popularity.PATHS_KEY, {'/pages/': '',
+                                         '/comments/1': 'item?id=1'})
+
+        with mock.patch.object(config, 'POPULARITY_DECAY', 0.5):
+            with mock.patch.object(config, 'POPULARITY_MIN_SCORE', 0.5):
+                self.assertEqual(popularity.decay(), 1)
+
+        self.assertEqual(rdb.zrange(popularity.POPULAR_KEY, 0, -1,
+                                    withscores=True), [('/pages/', 5)])
+        self.assertEqual(rdb.hkeys(popularity.PATHS_KEY), ['/pages/'])
+
+    def test_due(self):
+        rdb.zadd(popularity.POPULAR_KEY, {'/pages/': 3, '/pages/ask': 2,
+                                          '/comments/1': 1})
+        rdb.hmset(popularity.PATHS_KEY, {'/pages/': '', '/pages/ask': 'ask',
+                                         '/comments/1': 'item?id=1'})
+        rdb.hset('/pages/', 'updated', seconds_old(55))
+        rdb.hset('/pages/ask', 'updated', time.time())
+        # '/comments/1' isn't cached at all
+
+        with mock.patch.object(config, 'CACHE_INTERVAL', 60):
+            self.assertEqual(popularity.due(10),
+                             [('/pages/', ''), ('/comments/1', 'item?id=1')])
+
+    def test_due_top_keys(self):
+        rdb.zadd(popularity.POPULAR_KEY, {'/pages/': 2, '/comments/1': 1})
+        rdb.hmset(popularity.PATHS_KEY, {'/pages/': '',
+                                         '/comments/1': 'item?id=1'})
+
+        with mock.patch.object(config, 'REFRESH_TOP_KEYS', 1):
+            self.assertEqual(popularity.due(10), [('/pages/', '')])
+
+    def test_due_old_format(self):
+        rdb.zadd(popularity.POPULAR_KEY, {'/pages/': 1})
+        rdb.hset(popularity.PATHS_KEY, '/pages/', '')
+        rdb.set('/pages/', '{}')
+
+        self.assertEqual(popularity.due(10), [('/pages/', '')])
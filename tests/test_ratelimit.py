@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+import time
+import unittest
+
+import mock
+
+from newhackers import config, ratelimit, stats
+from newhackers.exceptions import RateLimited
+from tests.utils import rdb
+
+
+PRIORITIES = {ratelimit.USER: (0, 1),
+              ratelimit.ACCOUNT: (1, 1),
+              ratelimit.BACKGROUND: (2, 0)}
+
+
+class RateLimitTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        ratelimit.rdb = rdb
+        stats.rdb = rdb
+
+    def setUp(self):
+        stats._counts.clear()
+        for name, value in [('HN_RATE', 10.0), ('HN_BURST', 3),
+                            ('HN_PRIORITIES', PRIORITIES)]:
+            patcher = mock.patch.object(config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        rdb.flushdb()
+
+    def test_burst(self):
+        for i in range(3):
+            ratelimit.acquire(ratelimit.USER)
+        self.assertEqual(stats.get()['ratelimit.user.sent'], 3)
+
+    def test_wait_for_refill(self):
+        for i in range(3):
+            ratelimit.acquire(ratelimit.USER)
+        start = time.time()
+        ratelimit.acquire(ratelimit.USER)
+        # 10 requests per second
+        self.assertAlmostEqual(time.time() - start, 0.1, delta=0.05)
+        self.assertEqual(stats.get()['ratelimit.user.waited'], 1)
+
+    def test_wait_lets_greenlets_run(self):
+        for i in range(3):
+            ratelimit.acquire(ratelimit.USER)
+        with mock.patch.object(ratelimit.green, 'sleep') as sleep:
+            sleep.side_effect = time.sleep
+            ratelimit.acquire(ratelimit.USER)
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_background_goes_last(self):
+        ratelimit.acquire(ratelimit.USER)
+        # one request is left, but it's kept for the higher priorities
+        self.assertRaises(RateLimited, ratelimit.acquire,
+                          ratelimit.BACKGROUND)
+        self.assertEqual(stats.get()['ratelimit.background.limited'], 1)
+        ratelimit.acquire(ratelimit.ACCOUNT)
+        ratelimit.acquire(ratelimit.USER)
+
+    def test_wait_too_long(self):
+        with mock.patch.object(config, 'HN_RATE', 0.1):
+            for i in range(3):
+                ratelimit.acquire(ratelimit.USER)
+            self.assertRaises(RateLimited, ratelimit.acquire,
+                              ratelimit.USER)
+
+    def test_refilled_up_to_burst(self):
+        rdb.hmset(ratelimit.BUCKET_KEY, {'tokens': 0,
+                                         'updated': time.time() - 60})
+        for i in range(3):
+            ratelimit.acquire(ratelimit.USER)
+        self.assertRaises(RateLimited, ratelimit.acquire,
+                          ratelimit.BACKGROUND)
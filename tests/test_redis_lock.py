@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+import threading
+import time
+import unittest
+
+try:
+    import gevent
+except ImportError:
+    gevent = None
+
+from newhackers import stats
+from newhackers.redis_lock import (acquire_lock, redis_lock as lock,
+                                   release_lock, LockException)
+from tests.utils import rdb
+
+
+class RedisLockTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        stats.rdb = rdb
+
+    def setUp(self):
+        stats._counts.clear()
+
+    def tearDown(self):
+        rdb.flushdb()
+
+    def test_acquire_release(self):
+        self.assertEqual(acquire_lock(rdb, '/lock', 'me', ltime=5), 'me')
+        self.assertAlmostEqual(rdb.pttl('/lock'), 5000, delta=100)
+        self.assertTrue(release_lock(rdb, '/lock', 'me'))
+        self.assertFalse(rdb.exists('/lock'))
+
+    def test_acquire_held(self):
+        acquire_lock(rdb, '/lock', 'other')
+        start = time.time()
+        self.assertFalse(acquire_lock(rdb, '/lock', 'me', atime=0.2))
+        self.assertAlmostEqual(time.time() - start, 0.2, delta=0.1)
+        self.assertEqual(stats.get()['lock.timeout'], 1)
+
+    def test_release_someone_elses(self):
+        acquire_lock(rdb, '/lock', 'other')
+        self.assertFalse(release_lock(rdb, '/lock', 'me'))
+        self.assertEqual(rdb.get('/lock'), 'other')
+
+    def test_wake_on_release(self):
+        acquire_lock(rdb, '/lock', 'other', ltime=10)
+
+        def other():
+            time.sleep(0.2)
+            release_lock(rdb, '/lock', 'other')
+        threading.Thread(target=other).start()
+
+        start = time.time()
+        self.assertEqual(acquire_lock(rdb, '/lock', 'me', atime=5), 'me')
+        self.assertLess(time.time() - start, 1)
+        counters = stats.get()
+        self.assertEqual(counters['lock.contended'], 1)
+        self.assertGreaterEqual(counters['lock.wait_ms'], 150)
+
+    def test_wake_cooperative(self):
+        acquire_lock(rdb, '/lock', 'other', ltime=10)
+        threading.Timer(0.2, release_lock, [rdb, '/lock', 'other']).start()
+        start = time.time()
+        self.assertEqual(acquire_lock(rdb, '/lock', 'me', atime=5,
+                                      cooperative=True), 'me')
+        self.assertLess(time.time() - start, 1)
+
+    @unittest.skipIf(gevent is None, "gevent isn't installed")
+    def test_wake_cooperative_greenlets(self):
+        acquire_lock(rdb, '/lock', 'other', ltime=10)
+
+        def other():
+            gevent.sleep(0.2)
+            release_lock(rdb, '/lock', 'other')
+        gevent.spawn(other)
+
+        start = time.time()
+        self.assertEqual(acquire_lock(rdb, '/lock', 'me', atime=2,
+                                      cooperative=True), 'me')
+        self.assertLess(time.time() - start, 1)
+
+    def test_wake_on_expiry(self):
+        acquire_lock(rdb, '/lock', 'other', ltime=0.2)
+        start = time.time()
+        self.assertEqual(acquire_lock(rdb, '/lock', 'me', atime=5), 'me')
+        self.assertLess(time.time() - start, 1)
+
+    def test_lock_without_expiry(self):
+        rdb.set('/lock', 'other')
+        acquire_lock(rdb, '/lock', 'me', atime=0.1, ltime=5)
+        self.assertGreater(rdb.pttl('/lock'), 0)
+
+    def test_context_manager(self):
+        with lock(rdb, '/lock') as identifier:
+            self.assertEqual(rdb.get('/lock'), identifier)
+        self.assertFalse(rdb.exists('/lock'))
+        self.assertIn('lock.hold_ms', stats.get())
+
+    def test_context_manager_lost(self):
+        def lose():
+            with lock(rdb, '/lock'):
+                rdb.delete('/lock')
+        self.assertRaises(LockException, lose)
+        self.assertEqual(stats.get()['lock.lost'], 1)
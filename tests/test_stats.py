@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import mock
+
+from newhackers import config, stats
+from tests.utils import rdb
+
+
+class StatsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        stats.rdb = rdb
+
+    def setUp(self):
+        stats._counts.clear()
+
+    def tearDown(self):
+        rdb.flushdb()
+
+    def test_incr_local(self):
+        with mock.patch.object(config, 'STATS_INTERVAL', 3600):
+            stats.flush()
+            stats.incr('foo')
+            stats.incr('foo', 2)
+            self.assertFalse(rdb.exists(stats.STATS_KEY))
+            self.assertEqual(stats._counts['foo'], 3)
+
+    def test_incr_flushes(self):
+        with mock.patch.object(config, 'STATS_INTERVAL', 0):
+            stats.incr('foo')
+            self.assertEqual(rdb.hget(stats.STATS_KEY, 'foo'), '1')
+            self.assertEqual(stats._counts['foo'], 0)
+
+    def test_get(self):
+        rdb.hset(stats.STATS_KEY, 'foo', 2)
+        with mock.patch.object(config, 'STATS_INTERVAL', 3600):
+            stats.incr('foo')
+            stats.incr('bar')
+            self.assertEqual(stats.get(), {'foo': 3, 'bar': 1})
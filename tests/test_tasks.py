@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+# This file is part of newhackers.
+# Copyright (c) 2012 Ionuț Arțăriși
+
+# cuZmeură is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+
+# cuZmeură is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
+import json
+import time
+import unittest
+
+import mock
+
+from newhackers import (backend, cache, capacity, codec, config, parsers,
+                        popularity, ratelimit, stats, tasks)
+from newhackers.exceptions import (CircuitOpen, NotFound, RateLimited,
+                                   ServerError)
+from tests.fixtures import FRONT_PAGE
+from tests.utils import rdb
+
+
+class TasksTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        tasks.rdb = rdb
+        capacity.rdb = rdb
+        backend.rdb = rdb
+        cache.rdb = rdb
+        popularity.rdb = rdb
+        stats.rdb = rdb
+
+    def setUp(self):
+        stats._counts.clear()
+        popularity._hits.clear()
+        # the pages in these tests aren't real stories pages
+        patcher = mock.patch.object(config, 'PREFETCH_DEPTH', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        rdb.flushdb()
+
+    def test_update(self):
+        rdb.set('/pages//queued', 1)
+        with mock.patch.object(tasks, 'download_page',
+                               return_value=('stories', 'fp')) as download:
+            tasks.update('/pages/', '')
+            download.assert_called_with('/pages/', '', ratelimit.BACKGROUND,
+                                        None, mock.ANY)
+        self.assertIsNotNone(cache.read('/pages/'))
+        self.assertFalse(rdb.exists('/pages//queued'))
+
+    def test_update_not_too_old(self):
+        cache.write('/pages/', 'stories')
+        with mock.patch.object(tasks, 'download_page') as download:
+            tasks.update('/pages/', '')
+            download.assert_not_called()
+
+    def test_update_ahead(self):
+        cache.write('/pages/', 'stories')
+        with mock.patch.object(config, 'CACHE_INTERVAL', 60):
+            with mock.patch.object(tasks, 'download_page',
+                                   return_value=('stories', 'fp')
+                                   ) as download:
+                tasks.update('/pages/', '', 60)
+                download.assert_called_with('/pages/', '',
+                                            ratelimit.BACKGROUND, None,
+                                            mock.ANY)
+
+    def test_update_unchanged(self):
+        cache.write('/pages/', 'stories', interval=60)
+        rdb.hset('/pages/', 'updated', 0)
+        with mock.patch.object(tasks, 'download_page',
+                               return_value=('stories', 'fp')):
+            tasks.update('/pages/', '')
+        self.assertEqual(cache.read('/pages/').interval,
+                         60 * config.CACHE_INTERVAL_STEP)
+        self.assertEqual(stats.get()['refresh.unchanged'], 1)
+
+    def test_update_changed(self):
+        cache.write('/pages/', 'stories', interval=120)
+        rdb.hset('/pages/', 'updated', 0)
+        with mock.patch.object(tasks, 'download_page',
+                               return_value=('new', 'fp')):
+            tasks.update('/pages/', '')
+        self.assertEqual(cache.read('/pages/').interval,
+                         120 / config.CACHE_INTERVAL_STEP)
+        self.assertEqual(stats.get()['refresh.changed'], 1)
+
+    def test_update_same_page_later(self):
+        # the same stories with their times decoded a minute apart
+        with open(FRONT_PAGE) as f:
+            page = f.read()
+        docs = []
+        for now in [1350901062.0, 1350901122.0]:
+            with mock.patch.object(parsers.time, 'time', return_value=now):
+                docs.append(json.dumps(parsers.parse_stories(page)))
+        self.assertNotEqual(docs[0], docs[1])
+
+        cache.write('/pages/', docs[0], interval=60)
+        rdb.hset('/pages/', 'updated', 0)
+        with mock.patch.object(tasks, 'download_page',
+                               return_value=(docs[1], 'fp')):
+            tasks.update('/pages/', '')
+        self.assertEqual(cache.read('/pages/').interval,
+                         60 * config.CACHE_INTERVAL_STEP)
+        self.assertEqual(stats.get()['refresh.unchanged'], 1)
+
+    def test_update_fingerprint(self):
+        with mock.patch.object(tasks, 'download_page',
+                               return_value=('stories', 'fp')):
+            tasks.update('/pages/', '')
+        self.assertEqual(cache.read('/pages/').fingerprint, 'fp')
+        self.assertEqual(stats.get()['refresh.parsed'], 1)
+
+    def test_update_html_unchanged(self):
+        cache.write('/pages/', 'stories', interval=60, fingerprint='fp')
+        rdb.hset('/pages/', 'updated', 0)
+        with mock.patch.object(tasks, 'download_page',
+                               return_value=(None, 'fp')) as download:
+            with mock.patch.object(cache, 'write') as write:
+                tasks.update('/pages/', '')
+                write.assert_not_called()
+            download.assert_called_with('/pages/', '', ratelimit.BACKGROUND,
+                                        'fp', mock.ANY)
+        entry = cache.read('/pages/')
+        self.assertEqual(codec.decode(entry.payload), 'stories')
+        self.assertAlmostEqual(entry.updated, time.time(), delta=1)
+        self.assertEqual(entry.interval, 60 * config.CACHE_INTERVAL_STEP)
+        self.assertGreater(entry.stale_until, time.time())
+        counters = stats.get()
+        self.assertEqual(counters['refresh.html_unchanged'], 1)
+        self.assertNotIn('refresh.unchanged', counters)
+
+    def test_update_failed_extends_stale(self):
+        cache.write('/pages/', 'stories')
+        # too old, but not served for longer than STALE_IF_ERROR yet
+        rdb.hmset('/pages/', {'updated': time.time() - 3600,
+                              'stale_until': 0})
+        with mock.patch.object(tasks, 'download_page',
+                               side_effect=ServerError):
+            self.assertRaises(ServerError, tasks.update, '/pages/', '')
+        entry = cache.read('/pages/')
+        self.assertEqual(codec.decode(entry.payload), 'stories')
+        self.assertGreater(entry.stale_until, time.time())
+        self.assertEqual(stats.get()['refresh.failed'], 1)
+
+    def test_update_rate_limited(self):
+        cache.write('/pages/', 'stories')
+        rdb.hmset('/pages/', {'updated': time.time() - 3600,
+                              'stale_until': 0})
+        with mock.patch.object(tasks, 'download_page',
+                               side_effect=RateLimited):
+            tasks.update('/pages/', '')
+        self.assertGreater(cache.read('/pages/').stale_until, time.time())
+        self.assertEqual(stats.get()['refresh.rate_limited'], 1)
+
+    def test_update_circuit_open(self):
+        cache.write('/pages/', 'stories')
+        rdb.hmset('/pages/', {'updated': time.time() - 3600,
+                              'stale_until': 0})
+        with mock.patch.object(tasks, 'download_page',
+                               side_effect=CircuitOpen):
+            tasks.update('/pages/', '')
+        self.assertGreater(cache.read('/pages/').stale_until, time.time())
+        self.assertEqual(stats.get()['refresh.circuit_open'], 1)
+
+    def test_update_deadline(self):
+        with mock.patch.object(config, 'TASK_DEADLINE', 30):
+            with mock.patch.object(tasks, 'download_page',
+                                   return_value=('stories', 'fp')
+                                   ) as download:
+                tasks.update('/pages/', '')
+        self.assertAlmostEqual(download.call_args[0][4], time.time() + 30,
+                               delta=1)
+
+    def test_update_not_found_forgotten(self):
+        cache.write('/pages/x', 'stories')
+        rdb.hset('/pages/x', 'updated', 0)
+        with mock.patch.object(tasks, 'download_page', side_effect=NotFound):
+            self.assertRaises(NotFound, tasks.update, '/pages/x', 'x')
+        self.assertIsNone(cache.read('/pages/x'))
+
+    def test_update_error_unqueued(self):
+        rdb.set('/pages/x/queued', 1)
+        with mock.patch.object(tasks, 'download_page', side_effect=NotFound):
+            self.assertRaises(NotFound, tasks.update, '/pages/x', 'x')
+        self.assertFalse(rdb.exists('/pages/x/queued'))
+
+    def test_update_prefetches(self):
+        doc = json.dumps({'more': 'fnid1', 'stories': []})
+        with mock.patch.object(config, 'PREFETCH_DEPTH', 2):
+            with mock.patch.object(tasks, 'download_page',
+                                   return_value=(doc, 'fp')):
+                with mock.patch.object(tasks.prefetch, 'delay') as prefetch:
+                    tasks.update('/pages/', '')
+                    prefetch.assert_called_once_with('fnid1', 2)
+
+    def test_prefetch(self):
+        doc = json.dumps({'more': 'fnid2', 'stories': []})
+        with mock.patch.object(tasks, 'update_page', return_value=doc
+                               ) as update_page:
+            with mock.patch.object(tasks.prefetch, 'delay') as prefetch:
+                tasks.prefetch('fnid1', 2)
+                update_page.assert_called_with('/pages/x?fnid=fnid1',
+                                               'x?fnid=fnid1',
+                                               ratelimit.BACKGROUND, mock.ANY)
+                prefetch.assert_called_once_with('fnid2', 1)
+        self.assertIsNotNone(cache.read('/pages/x?fnid=fnid1'))
+        self.assertEqual(stats.get()['prefetch.fetched'], 1)
+
+    def test_prefetch_last(self):
+        doc = json.dumps({'more': 'fnid2', 'stories': []})
+        with mock.patch.object(tasks, 'update_page', return_value=doc):
+            with mock.patch.object(tasks.prefetch, 'delay') as prefetch:
+                tasks.prefetch('fnid1', 1)
+                prefetch.assert_not_called()
+
+    def test_prefetch_cached(self):
+        cache.write('/pages/x?fnid=fnid1', '{}')
+        with mock.patch.object(tasks, 'update_page') as update_page:
+            tasks.prefetch('fnid1', 1)
+            update_page.assert_not_called()
+        self.assertEqual(stats.get()['prefetch.cached'], 1)
+
+    def test_prefetch_budget(self):
+        with mock.patch.object(config, 'PREFETCH_BUDGET', 1):
+            with mock.patch.object(tasks, 'update_page', return_value='{}'
+                                   ) as update_page:
+                tasks.prefetch('fnid1', 1)
+                tasks.prefetch('fnid2', 1)
+                self.assertEqual(update_page.call_count, 1)
+        self.assertEqual(stats.get()['prefetch.over_budget'], 1)
+
+    def test_prefetch_rate_limited(self):
+        with mock.patch.object(tasks, 'update_page', side_effect=RateLimited):
+            tasks.prefetch('fnid1', 1)
+        self.assertIsNone(cache.read('/pages/x?fnid=fnid1'))
+        self.assertEqual(stats.get()['prefetch.failed'], 1)
+
+    def _popular(self, *db_keys):
+        for score, db_key in enumerate(reversed(db_keys)):
+            rdb.zadd(popularity.POPULAR_KEY, {db_key: score + 10})
+            rdb.hset(popularity.PATHS_KEY, db_key, db_key[len('/pages/'):])
+
+    def test_refresh_popular(self):
+        self._popular('/pages/a', '/pages/b', '/pages/c')
+        rdb.hset('/pages/b', 'updated', time.time())
+
+        with mock.patch.object(tasks.update, 'delay') as update:
+            tasks.refresh_popular()
+            self.assertEqual(update.call_args_list,
+                             [mock.call('/pages/a', 'a',
+                                        config.REFRESH_INTERVAL),
+                              mock.call('/pages/c', 'c',
+                                        config.REFRESH_INTERVAL)])
+        self.assertTrue(rdb.exists('/pages/a/queued'))
+        self.assertEqual(stats.get()['refresh.scheduled'], 2)
+
+    def test_refresh_popular_budget(self):
+        self._popular('/pages/a', '/pages/b', '/pages/c')
+
+        with mock.patch.object(config, 'REFRESH_BUDGET', 6):
+            with mock.patch.object(config, 'REFRESH_INTERVAL', 10):
+                with mock.patch.object(tasks.update, 'delay') as update:
+                    tasks.refresh_popular()
+                    update.assert_called_once_with('/pages/a', 'a', 10)
+        self.assertEqual(stats.get()['refresh.over_budget'], 2)
+
+    def test_refresh_popular_small_budget(self):
+        self._popular('/pages/a')
+
+        # half a page per run
+        with mock.patch.object(config, 'REFRESH_BUDGET', 3):
+            with mock.patch.object(config, 'REFRESH_INTERVAL', 10):
+                with mock.patch.object(tasks.update, 'delay') as update:
+                    tasks.refresh_popular()
+                    update.assert_not_called()
+                    tasks.refresh_popular()
+                    update.assert_called_once_with('/pages/a', 'a', 10)
+
+    def test_refresh_popular_disabled(self):
+        self._popular('/pages/a')
+
+        with mock.patch.object(config, 'REFRESH_BUDGET', 0):
+            with mock.patch.object(tasks.update, 'delay') as update:
+                tasks.refresh_popular()
+                update.assert_not_called()
+        self.assertEqual(stats.get()['refresh.over_budget'], 1)
+
+    def test_refresh_popular_already_queued(self):
+        self._popular('/pages/a')
+        rdb.set('/pages/a/queued', 1)
+
+        with mock.patch.object(tasks.update, 'delay') as update:
+            tasks.refresh_popular()
+            update.assert_not_called()
+
+    def test_refresh_popular_cold(self):
+        rdb.zadd(popularity.POPULAR_KEY, {'/pages/a': 0.1})
+        rdb.hset(popularity.PATHS_KEY, '/pages/a', 'a')
+
+        with mock.patch.object(tasks.update, 'delay') as update:
+            tasks.refresh_popular()
+            update.assert_not_called()
+        self.assertEqual(stats.get()['refresh.cold'], 1)
@@ -15,79 +15,156 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with cuZmeură. If not, see <http://www.gnu.org/licenses/>.
 
+import re
 import unittest
 
+from bs4 import BeautifulSoup
 import mock
 
-from newhackers import votes
-from newhackers.exceptions import ClientError
+from newhackers import ratelimit, stats, votes
+from newhackers.exceptions import ClientError, NotFound
 from tests.fixtures import COMMENTS_PAGE, FRONT_PAGE
+from tests.utils import rdb
 
 
 STORY_ID = '4698446'
 COMMENT_ID = '4705841'
+LINKS = {'up_1234': 'good_vote_link'}
 
 
 class VotesTest(unittest.TestCase):
     @classmethod
     def setUpClass(self):
+        votes.rdb = rdb
+        stats.rdb = rdb
         with open(COMMENTS_PAGE) as f:
             self.comments = f.read()
         with open(FRONT_PAGE) as f:
             self.front_page = f.read()
 
-    def test__find_vote_link_story_up(self):
-        self.assertEqual(votes._find_vote_link(self.front_page, STORY_ID, 'up'),
+    def setUp(self):
+        stats._counts.clear()
+
+    def tearDown(self):
+        rdb.flushdb()
+
+    def test__vote_links_story_up(self):
+        self.assertEqual(votes._vote_links(self.front_page)['up_' + STORY_ID],
                          u'vote?for=4698446&dir=up&whence=%2f%78%3f%66%6e%69%64%3d%79%52%69%66%62%35%47%72%6a%37')
 
-    def test__find_vote_link_story_down(self):
-        self.assertIsNone(
-            votes._find_vote_link(self.front_page, STORY_ID, 'down'))
+    def test__vote_links_story_down(self):
+        self.assertNotIn('down_' + STORY_ID,
+                         votes._vote_links(self.front_page))
 
-    def test__find_vote_link_comment_up(self):
-        self.assertEqual(votes._find_vote_link(self.comments, COMMENT_ID, 'up'),
+    def test__vote_links_comment_up(self):
+        self.assertEqual(votes._vote_links(self.comments)['up_' + COMMENT_ID],
                          u'vote?for=4705841&dir=up&whence=%69%74%65%6d%3f%69%64%3d%34%37%30%35%30%36%37')
 
-    def test__find_vote_link_commen_down(self):
-        self.assertIsNone(
-            votes._find_vote_link(self.comments, COMMENT_ID, 'down'))
+    def test__vote_links_commen_down(self):
+        self.assertNotIn('down_' + COMMENT_ID,
+                         votes._vote_links(self.comments))
+
+    def test__vote_links_same_as_soup(self):
+        soup = BeautifulSoup(self.comments)
+        links = dict((a['id'], a['href']) for a in soup.find_all(
+            'a', id=re.compile('^(up|down)_')))
+        self.assertEqual(votes._vote_links(self.comments), links)
+
+    def test__vote_links_data_attributes(self):
+        page = ('<a data-id="up_1" href="vote?for=1"></a>'
+                '<a id="up_2" data-href="wrong" href="vote?for=2"></a>'
+                '<a data-id=x id=up_3 href=vote?for=3></a>')
+        self.assertEqual(votes._vote_links(page),
+                         {'up_2': 'vote?for=2', 'up_3': 'vote?for=3'})
 
     def test_vote_no_link(self):
         with mock.patch.object(votes, "hn_get") as hn_get:
-            with mock.patch.object(votes, "_find_vote_link",
-                                   return_value=None) as find_vote:
+            with mock.patch.object(votes, "_vote_links",
+                                   return_value={}) as find_vote:
                 self.assertRaises(ClientError, votes.vote,
                                   "token1", "up", "1234")
                 hn_get.assert_called_with('item?id=1234',
-                                          cookies={'user': 'token1'})
-                find_vote.assert_called_with(hn_get().text, "1234", "up")
+                                          cookies={'user': 'token1'},
+                                          priority=ratelimit.ACCOUNT)
+                find_vote.assert_called_with(hn_get().text)
 
     def test_vote(self):
         mock_get = mock.Mock(return_value=mock.Mock(
                 text=""))
         with mock.patch.object(votes, "hn_get", mock_get) as hn_get:
-            with mock.patch.object(votes, "_find_vote_link",
-                                   return_value="good_vote_link") as find_vote:
+            with mock.patch.object(votes, "_vote_links",
+                                   return_value=LINKS) as find_vote:
                 self.assertTrue(votes.vote("token1", "up", "1234"))
                 hn_get.assert_any_call('item?id=1234',
-                                          cookies={'user': 'token1'})
+                                          cookies={'user': 'token1'},
+                                          priority=ratelimit.ACCOUNT)
                 hn_get.assert_any_call('good_vote_link',
-                                       cookies={'user': 'token1'})
-                find_vote.assert_called_with(hn_get().text, "1234", "up")
+                                       cookies={'user': 'token1'},
+                                       priority=ratelimit.ACCOUNT)
+                find_vote.assert_called_with(hn_get().text)
 
     def test_vote_failed(self):
         mock_get = mock.Mock(return_value=mock.Mock(
                 text="fail"))
         with mock.patch.object(votes, "hn_get", mock_get) as hn_get:
-            with mock.patch.object(votes, "_find_vote_link",
-                                   return_value="good_vote_link") as find_vote:
+            with mock.patch.object(votes, "_vote_links",
+                                   return_value=LINKS) as find_vote:
                 self.assertIsNone(votes.vote("token1", "up", "1234"))
                 hn_get.assert_any_call('item?id=1234',
-                                       cookies={'user': 'token1'})
+                                       cookies={'user': 'token1'},
+                                       priority=ratelimit.ACCOUNT)
                 hn_get.assert_any_call('good_vote_link',
-                                       cookies={'user': 'token1'})
-                find_vote.assert_called_with(hn_get().text, "1234", "up")
+                                       cookies={'user': 'token1'},
+                                       priority=ratelimit.ACCOUNT)
+                find_vote.assert_called_with(hn_get().text)
 
     def test_vote_wrong_direction(self):
         self.assertRaises(ClientError, votes.vote,
                           "token", "left", "item")
+
+    def test_vote_links_cached(self):
+        page = mock.Mock(text=self.comments)
+        voted = mock.Mock(text='')
+        with mock.patch.object(votes, "hn_get",
+                               side_effect=[page, voted, voted]) as hn_get:
+            self.assertTrue(votes.vote("token1", "up", "4705067"))
+            # another comment of the same thread
+            self.assertTrue(votes.vote("token1", "up", COMMENT_ID))
+            self.assertEqual(hn_get.call_count, 3)
+            hn_get.assert_called_with(
+                votes._vote_links(self.comments)['up_' + COMMENT_ID],
+                cookies={'user': 'token1'}, priority=ratelimit.ACCOUNT)
+        self.assertEqual(stats.get()['votes.cached_link'], 1)
+        self.assertGreater(rdb.ttl(votes._links_key('token1')), 0)
+
+    def test_vote_links_cached_per_user(self):
+        page = mock.Mock(text=self.comments)
+        voted = mock.Mock(text='')
+        with mock.patch.object(votes, "hn_get",
+                               side_effect=[page, voted, page, voted]
+                               ) as hn_get:
+            votes.vote("token1", "up", "4705067")
+            votes.vote("token2", "up", COMMENT_ID)
+            self.assertEqual(hn_get.call_count, 4)
+
+    def test_rejected_link_forgotten(self):
+        page = mock.Mock(text=self.comments)
+        voted = mock.Mock(text='')
+        with mock.patch.object(votes, "hn_get",
+                               side_effect=[page, NotFound('expired'),
+                                            page, voted]) as hn_get:
+            self.assertRaises(NotFound, votes.vote, "token1", "up",
+                              COMMENT_ID)
+            # the link is downloaded again instead of failing again
+            self.assertTrue(votes.vote("token1", "up", COMMENT_ID))
+            self.assertEqual(hn_get.call_count, 4)
+
+    def test_voted_link_forgotten(self):
+        page = mock.Mock(text=self.comments)
+        voted = mock.Mock(text='')
+        with mock.patch.object(votes, "hn_get",
+                               side_effect=[page, voted, page, voted]
+                               ) as hn_get:
+            votes.vote("token1", "up", COMMENT_ID)
+            votes.vote("token1", "up", COMMENT_ID)
+            self.assertEqual(hn_get.call_count, 4)